@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Compare update and serialization cost of ProcessDataPoint against the old dict subclass."""
+
+import argparse
+import json
+import timeit
+
+import msgpack
+
+from asyncrqd.procraider import ProcessDataPoint
+
+
+class LegacyProcessDataPoint(dict):
+    """The dict-backed ProcessDataPoint this benchmark measures against."""
+
+    def __init__(self):
+        self["rss"] = 0
+        self["max_rss"] = 0
+        self["vsize"] = 0
+        self["max_vsize"] = 0
+        self["pcpu"] = 0
+        self["cpu_time"] = 0
+        self["create_time"] = 0
+        self["running_time"] = 0
+        self["context_switches"] = 0
+        self["ptree"] = []
+        self["read_calls"] = 0
+        self["write_calls"] = 0
+        self["read_bytes"] = 0
+        self["write_bytes"] = 0
+
+    @property
+    def rss(self):
+        return self["rss"]
+
+    @rss.setter
+    def rss(self, value):
+        self["rss"] = value
+        self["max_rss"] = max(value, self["max_rss"])
+
+    @property
+    def vsize(self):
+        return self["vsize"]
+
+    @vsize.setter
+    def vsize(self, value):
+        self["vsize"] = value
+        self["max_vsize"] = max(value, self["max_vsize"])
+
+    @property
+    def cpu_time(self):
+        return self["cpu_time"]
+
+    @cpu_time.setter
+    def cpu_time(self, value):
+        self["cpu_time"] = value
+
+    @property
+    def read_calls(self):
+        return self["read_calls"]
+
+    @read_calls.setter
+    def read_calls(self, value):
+        self["read_calls"] = value
+
+    @property
+    def ptree(self):
+        return self["ptree"]
+
+
+def update_legacy(sessions, pids_per_session):
+    """One sample the way the old aggregation loop built it: fresh objects every time."""
+    resultset = {}
+    for session in range(sessions):
+        for pid in range(pids_per_session):
+            process_data = resultset.setdefault(session, LegacyProcessDataPoint())
+            process_data.rss += 1000
+            process_data.vsize += 100000
+            process_data.cpu_time += 10
+            process_data.read_calls += 3
+            process_data["context_switches"] = {"voluntary": pid, "nonvoluntary": pid}
+            process_data.ptree.append({"pid": pid, "running_time": 1.0, "cpu_time": 10})
+    return resultset
+
+
+datapoints = {}
+
+
+def update_slots(sessions, pids_per_session):
+    """One sample the way the aggregation loop builds it now: records reused per session."""
+    resultset = {}
+    for session in range(sessions):
+        for pid in range(pids_per_session):
+            process_data = resultset.get(session)
+            if process_data is None:
+                process_data = datapoints.get(session)
+                if process_data is None:
+                    process_data = datapoints[session] = ProcessDataPoint()
+                else:
+                    process_data.reset()
+                resultset[session] = process_data
+            process_data.rss += 1000
+            process_data.vsize += 100000
+            process_data.cpu_time += 10
+            process_data.read_calls += 3
+            process_data.voluntary_ctxt_switches += pid
+            process_data.nonvoluntary_ctxt_switches += pid
+            process_data.ptree.append((pid, 1.0, 10))
+    for process_data in resultset.values():
+        process_data.update_peaks()
+    return resultset
+
+
+def report(name, seconds, number):
+    print("{:>28}: {:8.1f} us per sample".format(name, seconds / number * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--pids", type=int, default=10, help="processes per session")
+    parser.add_argument("-n", "--number", type=int, default=200)
+    args = parser.parse_args()
+
+    legacy = update_legacy(args.sessions, args.pids)
+    slots = update_slots(args.sessions, args.pids)
+
+    print("{} sessions x {} processes".format(args.sessions, args.pids))
+    for name, statement in (
+        ("legacy update", lambda: update_legacy(args.sessions, args.pids)),
+        ("slots update", lambda: update_slots(args.sessions, args.pids)),
+        ("legacy json.dumps", lambda: json.dumps(legacy)),
+        ("slots to_dict + json.dumps", lambda: json.dumps({k: v.to_dict() for k, v in slots.items()})),
+        ("legacy msgpack", lambda: msgpack.packb(legacy)),
+        ("slots to_dict + msgpack", lambda: msgpack.packb({k: v.to_dict() for k, v in slots.items()})),
+    ):
+        report(name, timeit.timeit(statement, number=args.number), args.number)
+
+
+if __name__ == "__main__":
+    main()
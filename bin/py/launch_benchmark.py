@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Compare frame launch latency between the preexec, direct and launcher paths.
+
+Each frame is a short /bin/true run with a nice value and a cpu list, so every
+path does its full setup. The launch latency is the time spawn() takes to
+return, the exit latency the time from launch until the exit is reported.
+--ballast grows the benchmark process by that many MB first, as a long running
+daemon grows, to show the cost of forking it; the launcher is started before.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import statistics
+import time
+
+from asyncrqd import launcher
+from asyncrqd import process
+
+
+def launch(loop, mode, frames, command, cpu_list_arg, use_cgroup):
+    """Start frames frames in mode; return (launch latencies, exit latencies)."""
+    launches = []
+    exits = []
+
+    def exited(start, fu):
+        exits.append(time.perf_counter() - start)
+
+    waits = []
+    for i in range(frames):
+        handler = process.SubprocessOutputHandler(tail_lines=0)
+        subprocess = process.SubProcess(
+            command, handler, nice=1, cpu_list_arg=cpu_list_arg, use_cgroup=use_cgroup, launch=mode
+        )
+        st = time.perf_counter()
+        wait = subprocess.spawn(loop, handler)
+        launches.append(time.perf_counter() - st)
+        subprocess.protocol.finished.add_done_callback(lambda fu, start=st: exited(start, fu))
+        waits.append(wait)
+
+    loop.run_until_complete(asyncio.gather(*waits))
+    return launches, exits
+
+
+def report(mode, latencies, label):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print("{:>8} {:>6}: frames={} median={:.2f}ms p95={:.2f}ms max={:.2f}ms".format(
+        mode,
+        label,
+        len(latencies),
+        statistics.median(latencies) * 1000,
+        p95 * 1000,
+        latencies[-1] * 1000,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-f", "--frames", type=int, default=300)
+    parser.add_argument("--command", default="/bin/true")
+    parser.add_argument("--cgroup", action="store_true", help="put each frame in its own cgroup")
+    parser.add_argument("--ballast", type=int, default=0, help="MB to allocate before launching")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    process.install_child_watcher(loop)
+    process.SubProcess.launcher_client = loop.run_until_complete(launcher.LauncherClient().start())
+
+    # Touch every page so it is mapped and has to be copied on fork
+    ballast = bytearray(args.ballast * 1024 * 1024)
+    for index in range(0, len(ballast), 4096):
+        ballast[index] = 1
+
+    cpu_list_arg = ",".join(str(cpu) for cpu in sorted(os.sched_getaffinity(0)))
+    with contextlib.closing(loop):
+        for mode in process.SubProcess.launch_modes:
+            launches, exits = launch(loop, mode, args.frames, [args.command], cpu_list_arg, args.cgroup)
+            report(mode, launches, "launch")
+            report(mode, exits, "exit")
+        loop.run_until_complete(process.SubProcess.launcher_client.close())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Fire concurrent LaunchFrame calls at the daemon and report their latency.
+
+Frames are launched through the grpc_client helpers, at most --concurrency at
+a time, and each latency is the round trip of one LaunchFrame call: the frame's
+process has been started by the time it returns. With --serve a server is run
+in this process on the given port, so the benchmark needs no running daemon.
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+import uuid
+
+from grpclib.client import Channel
+from grpclib.server import Server
+
+from asyncrqd import grpc_client
+from asyncrqd import grpc_server
+from asyncrqd import process
+from asyncrqd.proto import rqd_grpc
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+async def fire(iface, frames, concurrency, command, log_dir):
+    """Launch frames frames; return (latencies, failures, seconds)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    run_id = uuid.uuid4().hex[:8]
+    latencies = []
+    failures = []
+
+    async def launch_one(index):
+        run_frame = grpc_client.make_run_frame("{}-{:05d}".format(run_id, index), command=command, log_dir=log_dir)
+        async with semaphore:
+            st = time.perf_counter()
+            try:
+                await grpc_client.launch_frame(iface, run_frame)
+            except Exception as e:
+                failures.append(e)
+                return
+            latencies.append(time.perf_counter() - st)
+
+    st = time.perf_counter()
+    await asyncio.gather(*(launch_one(index) for index in range(frames)))
+    return sorted(latencies), failures, time.perf_counter() - st
+
+
+async def amain(args):
+    server = None
+    if args.serve:
+        process.install_child_watcher(asyncio.get_running_loop())
+        interface = grpc_server.RqdInterface()
+        server = Server([interface])
+        await server.start(args.host, args.port)
+
+    channel = Channel(args.host, args.port)
+    iface = rqd_grpc.RqdInterfaceStub(channel)
+    with tempfile.TemporaryDirectory() as log_dir:
+        latencies, failures, elapsed = await fire(iface, args.frames, args.concurrency, args.command, log_dir)
+        if server is not None:
+            await interface.frames.wait_all()
+    channel.close()
+
+    if latencies:
+        print("frames={} concurrency={} failed={} {:.0f} launches/s".format(
+            args.frames, args.concurrency, len(failures), len(latencies) / elapsed,
+        ))
+        print("latency p50={:.2f}ms p90={:.2f}ms p99={:.2f}ms max={:.2f}ms mean={:.2f}ms".format(
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.9) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            latencies[-1] * 1000,
+            statistics.mean(latencies) * 1000,
+        ))
+    if failures:
+        print("first failure: {}".format(failures[0]))
+
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-f", "--frames", type=int, default=500)
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    parser.add_argument("--command", default="sleep 1")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--serve", action="store_true", help="run the server in this process")
+    asyncio.run(amain(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Compare per-line and batched writes in SubprocessOutputHandler.
+
+The output follows the bin/hurtme pattern without the sleep: numbered lines of
+128 random characters, delivered to SubprocessProtocol.pipe_data_received in
+pipe-sized chunks, as a chatty renderer's progress output would be. The
+compressed modes count the writes made by the sink's writer thread, including
+the time it takes to finish the stream on close.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import string
+import tempfile
+import time
+
+from asyncrqd import process
+from asyncrqd import sinks
+
+
+def hurtme_chunks(lines, chunk_size):
+    """Return the hurtme output for lines lines, split into chunk_size byte chunks."""
+    characters = string.ascii_letters + string.digits
+    output = "".join(
+        "{:4d}: {}\n".format(index, "".join(random.choices(characters, k=128)))
+        for index in range(lines)
+    ).encode("utf-8")
+    return [output[index:index + chunk_size] for index in range(0, len(output), chunk_size)]
+
+
+MODES = [
+    ("per-line", {}),
+    ("batched", {"batch": True}),
+    ("gzip", {"batch": True, "compress": "gzip"}),
+]
+if sinks.zstandard is not None:
+    MODES.append(("zstd", {"batch": True, "compress": "zstd"}))
+
+
+async def drive(chunks, logfile, options):
+    """Feed chunks through a protocol and handler; return (seconds, file writes, log path)."""
+    handler = process.SubprocessOutputHandler(logfile, **options)
+    protocol = process.SubprocessProtocol(loop=asyncio.get_running_loop(), output_handler=handler)
+    compressed = list(handler._compressed.values())
+
+    st = time.perf_counter()
+    for chunk in chunks:
+        protocol.pipe_data_received(protocol.STDOUT, chunk)
+    closing = handler.close()
+    if closing is not None:
+        await closing
+    elapsed = time.perf_counter() - st
+
+    writes = handler.writes + sum(sink.writes for sink in compressed)
+    path = compressed[0].path if compressed else logfile
+    return elapsed, writes, path
+
+
+async def amain(args):
+    chunks = hurtme_chunks(args.lines, args.chunk_size)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, options in MODES:
+            logfile = os.path.join(tmpdir, name + ".log")
+            elapsed, writes, path = await drive(chunks, logfile, options)
+            print("{:>8}: lines={} chunks={} writes={} {:.2f}ms {:.0f} lines/s size={}".format(
+                name,
+                args.lines,
+                len(chunks),
+                writes,
+                elapsed * 1000,
+                args.lines / elapsed,
+                os.path.getsize(path),
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-l", "--lines", type=int, default=100000)
+    parser.add_argument("-c", "--chunk-size", type=int, default=65536, help="bytes per pipe read")
+    asyncio.run(amain(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
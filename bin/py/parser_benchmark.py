@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+Benchmark the ProcRaider stat and status parsers against /proc fixtures.
+
+Each parser runs against fixtures scaled to every requested pid count, and the
+report gives the per-call latency distribution plus the memory allocated by one
+call. Nothing reads the live /proc unless --record is given.
+
+Before it is timed, every parser's output is checked field by field against
+naive reference parsers written here, which share no code with the parsers
+under test, for every record; the run exits non-zero if any parser disagrees.
+"""
+
+import argparse
+import gc
+import statistics
+import sys
+import time
+import tracemalloc
+
+from asyncrqd import procfixtures
+from asyncrqd.procraider import ProcRaider
+
+
+PARSERS = (
+    ("stat_0", "stat", ProcRaider.process_proc_pid_stat_0),
+    ("stat_1", "stat", ProcRaider.process_proc_pid_stat_1),
+    ("status_0", "status", ProcRaider.process_proc_pid_status_0),
+    ("status_1", "status", ProcRaider.process_proc_pid_status_1),
+    ("status_2", "status", ProcRaider.process_proc_pid_status_2),
+)
+
+
+# The stat fields ProcRaider keeps, by their 1-based number in "man proc"
+STAT_FIELD_NUMBERS = {
+    "pid": 1,
+    "session": 6,
+    "utime": 14,
+    "stime": 15,
+    "cutime": 16,
+    "cstime": 17,
+    "num_threads": 20,
+    "start_time": 22,
+    "vsize": 23,
+    "rss": 24,
+    "cpu_num": 39,
+}
+
+STATUS_KEYS = ("Tgid", "Pid", "voluntary_ctxt_switches", "nonvoluntary_ctxt_switches")
+
+
+# The reference parsers are deliberately naive and share no code with the
+# parsers under test, so a bug in the shared helpers shows up as a difference.
+
+def reference_stat(line):
+    """Return a dict of the STAT_FIELD_NUMBERS fields of one stat line."""
+    head, tail = line.rsplit(")", 1)
+    # Field 1 is the pid, field 2 the comm, and tail holds field 3 onwards
+    fields = [head.split(" ", 1)[0], None] + tail.split()
+    return {key: int(fields[number - 1]) for key, number in STAT_FIELD_NUMBERS.items()}
+
+
+def reference_status(block):
+    """Return a dict of the STATUS_KEYS fields of one status block, 0 for the missing ones."""
+    result = dict.fromkeys(STATUS_KEYS, 0)
+    for line in block.strip().split("\n"):
+        key, value = line.split(":", 1)
+        if key in result:
+            result[key] = int(value.split()[0])
+    return result
+
+
+def reference(records):
+    """Return {"stat": {pid: dict}, "status": {pid: dict}} parsed by the reference parsers."""
+    stat_data = {}
+    status_data = {}
+    for pid, stat_line, status_block in records:
+        stat_data[pid] = reference_stat(stat_line)
+        status_data[pid] = reference_status(status_block)
+    return {"stat": stat_data, "status": status_data}
+
+
+def normalise(kind, entry):
+    """Return a parser's entry as a dict of ints, as far as the parser fills it in."""
+    if kind == "stat":
+        # stat_0 gives a stat_entry, stat_1 a dict of str fields
+        if isinstance(entry, tuple):
+            return entry._asdict()
+        return {key: int(value) for key, value in entry.items()}
+    # status_1 and status_2 give the raw block, which only they split out
+    return reference_status(entry) if isinstance(entry, str) else entry
+
+
+def differences(kind, result, expected):
+    """Return a list of the ways result differs from the reference result expected."""
+    problems = []
+    if set(result) != set(expected):
+        problems.append("{} pids against {}".format(len(result), len(expected)))
+    for pid in set(result) & set(expected):
+        entry = normalise(kind, result[pid])
+        reference_entry = {key: expected[pid][key] for key in entry}
+        if entry != reference_entry:
+            problems.append("pid {}: {} != {}".format(pid, entry, reference_entry))
+    return problems
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure_latency(parser, text, iterations):
+    """Return a sorted list of per-call latencies in seconds and the result of the last call."""
+    latencies = []
+    result = None
+    for i in range(iterations):
+        result = None
+        gc.collect()
+        st = time.perf_counter()
+        result = parser(text)
+        latencies.append(time.perf_counter() - st)
+    return sorted(latencies), result
+
+
+def measure_allocations(parser, text):
+    """Return (peak_bytes, retained_bytes, retained_blocks) allocated by one call."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        result = parser(text)
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return peak - baseline, current - baseline, blocks
+
+
+def run(records, sizes, iterations, selected):
+    """Print the report for every parser and size; return False if any parser was wrong."""
+    correct = True
+    print("{:>9} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "parser", "pids", "min ms", "median ms", "p95 ms", "max ms", "peak MB", "kept MB", "kept blks"
+    ))
+    for size in sizes:
+        scaled = procfixtures.scale(records, size)
+        texts = dict(zip(("stat", "status"), procfixtures.render(scaled)))
+        expected = reference(scaled)
+        for name, kind, parser in PARSERS:
+            if selected and name not in selected:
+                continue
+
+            latencies, result = measure_latency(parser, texts[kind], iterations)
+            problems = differences(kind, result, expected[kind])
+            if problems:
+                correct = False
+                print("ERROR: {} differs from the reference in {} ways, first: {}".format(
+                    name, len(problems), problems[0]
+                ))
+            del result
+
+            peak, kept, blocks = measure_allocations(parser, texts[kind])
+            print("{:>9} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10}".format(
+                name,
+                size,
+                latencies[0] * 1000,
+                statistics.median(latencies) * 1000,
+                percentile(latencies, 0.95) * 1000,
+                latencies[-1] * 1000,
+                peak / 1e6,
+                kept / 1e6,
+                blocks,
+            ))
+    return correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    parser.add_argument("-s", "--sizes", default="1000,10000,50000", help="comma separated pid counts")
+    parser.add_argument("-p", "--parser", action="append", default=[], help="only run this parser; may be repeated")
+    parser.add_argument("-f", "--fixture", help="fixture file to scale; the built-in templates by default")
+    parser.add_argument("--record", metavar="FILEPATH", help="record the live /proc to a fixture file and exit")
+    args = parser.parse_args()
+
+    if args.record:
+        records = procfixtures.record()
+        procfixtures.save(args.record, records)
+        print("recorded {} processes to {}".format(len(records), args.record))
+        return
+
+    if args.fixture:
+        records = procfixtures.load(args.fixture)
+    else:
+        records = procfixtures.template_records()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if not run(records, sizes, args.iterations, set(args.parser)):
+        sys.exit("parsers disagree with the reference")
+
+
+if __name__ == "__main__":
+    main()
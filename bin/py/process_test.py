@@ -14,9 +14,7 @@ if __name__ == "__main__":
     else:
         loop = asyncio.get_event_loop()
 
-        child_watcher = process.ResourceUsageSafeChildWatcher()
-        child_watcher.attach_loop(loop)
-        asyncio.set_child_watcher(child_watcher)
+        process.install_child_watcher(loop)
 
     with contextlib.closing(loop):
         # This will only connect to the process
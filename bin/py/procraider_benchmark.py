@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Compare the per-sample latency of the ProcRaider /proc backends.
+
+Every backend must return the same stat and status data as the first one.
+Against the live /proc processes come and go and their counters move between
+samples, so only the pids both saw and their fixed fields are compared; with
+--synthetic the tree is static and every field must match.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from asyncrqd.procfixtures import SyntheticProcTree
+from asyncrqd.procraider import ProcRaider
+
+
+# Fields of a live process that do not change between samples
+STATIC_STAT_FIELDS = ("pid", "session", "start_time")
+
+
+async def sample(backend, iterations):
+    """Return a list of per-sample latencies in seconds for backend, and the last sample."""
+    ProcRaider.set_backend(backend)
+    latencies = []
+    data = None
+    for i in range(iterations):
+        st = time.perf_counter()
+        data = await ProcRaider.read_proc_data()
+        latencies.append(time.perf_counter() - st)
+    return latencies, data
+
+
+def differences(reference, data, exact, sessions=None):
+    """
+    Return a list of the differences between two (stat_data, status_data, io_data) samples.
+
+    If sessions is given, data only holds the processes in those sessions.
+    """
+    (ref_stat, ref_status, _), (stat_data, status_data, _) = reference, data
+    problems = []
+    expected_pids = set(ref_stat)
+    if sessions is not None:
+        expected_pids = ProcRaider.session_member_pids(ref_stat, sessions)
+    if exact and expected_pids != set(stat_data):
+        problems.append("pids differ: {} against {}".format(len(stat_data), len(expected_pids)))
+
+    for pid in set(ref_stat) & set(stat_data):
+        expected, actual = ref_stat[pid], stat_data[pid]
+        fields = ProcRaider.stat_keys if exact else STATIC_STAT_FIELDS
+        for field in fields:
+            if getattr(expected, field) != getattr(actual, field):
+                problems.append("pid {} stat {}: {} != {}".format(
+                    pid, field, getattr(actual, field), getattr(expected, field)
+                ))
+
+    for pid in set(ref_status) & set(status_data):
+        if exact and ref_status[pid] != status_data[pid]:
+            problems.append("pid {} status: {} != {}".format(pid, status_data[pid], ref_status[pid]))
+    return problems
+
+
+def report(backend, latencies, pid_count):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print("{:>10}: pids={} min={:.2f}ms median={:.2f}ms mean={:.2f}ms p95={:.2f}ms max={:.2f}ms".format(
+        backend,
+        pid_count,
+        latencies[0] * 1000,
+        statistics.median(latencies) * 1000,
+        statistics.mean(latencies) * 1000,
+        p95 * 1000,
+        latencies[-1] * 1000,
+    ))
+
+
+async def amain(iterations, sessions, exact):
+    for session in sessions:
+        ProcRaider.watch_session(session)
+
+    reference = None
+    failed = False
+    for backend in ProcRaider.backends:
+        # Warm up caches and the scanner's buffers before timing
+        await sample(backend, 2)
+        latencies, data = await sample(backend, iterations)
+        report(backend, latencies, len(data[0]))
+
+        if reference is None:
+            reference = data
+            continue
+        # The session backend only scans the watched sessions
+        scanned = ProcRaider.watched_pids.keys() if backend == "session" else None
+        problems = differences(reference, data, exact, scanned)
+        if problems:
+            failed = True
+            print("{:>10}: {} differences from {}, first: {}".format(
+                backend, len(problems), ProcRaider.backends[0], problems[0]
+            ))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=100)
+    parser.add_argument(
+        "-s", "--session", type=int, action="append", default=[],
+        help="session id to watch with the 'session' backend; may be repeated"
+    )
+    parser.add_argument("--synthetic", action="store_true", help="sample a static synthetic proc root")
+    args = parser.parse_args()
+
+    if not args.synthetic:
+        failed = asyncio.run(amain(args.iterations, args.session, False))
+    else:
+        with SyntheticProcTree() as tree:
+            ProcRaider.set_proc_root(tree.root)
+            failed = asyncio.run(amain(args.iterations, args.session or tree.session_leaders, True))
+    if failed:
+        sys.exit("the backends disagree")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Measure ProcRaider sampling throughput against a synthetic proc root."""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from asyncrqd.procfixtures import SyntheticProcTree
+from asyncrqd.procraider import ProcRaider
+
+
+async def sample(tree, backend, iterations, churn):
+    """
+    Return (latencies, session_count) for iterations samples of tree with backend.
+
+    Only get_filesystem_data is timed, as it is the one call the sampler makes:
+    it walks /proc once and aggregates the sessions.
+    """
+    ProcRaider.set_backend(backend)
+    latencies = []
+    session_count = 0
+    for i in range(iterations):
+        if churn:
+            tree.churn(churn)
+        st = time.perf_counter()
+        resultset = await ProcRaider.get_filesystem_data()
+        latencies.append(time.perf_counter() - st)
+        session_count = len(resultset)
+    return latencies, session_count
+
+
+def report(backend, latencies, session_count, total_pids):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    median = statistics.median(latencies)
+    print("{:>10}: sessions={} median={:.2f}ms p95={:.2f}ms max={:.2f}ms host pids/s={:.0f}".format(
+        backend,
+        session_count,
+        median * 1000,
+        p95 * 1000,
+        latencies[-1] * 1000,
+        total_pids / median,
+    ))
+
+
+async def amain(args):
+    st = time.perf_counter()
+    tree = SyntheticProcTree(
+        sessions=args.sessions,
+        processes=args.processes,
+        background=args.background,
+        threads=args.threads,
+        fanout=args.fanout,
+        root=args.root,
+    )
+    print("built {} pids in {} in {:.1f}s".format(len(tree.pids), tree.root, time.perf_counter() - st))
+
+    try:
+        ProcRaider.set_proc_root(tree.root)
+        for session in tree.session_leaders:
+            ProcRaider.watch_session(session)
+
+        for backend in args.backend or ProcRaider.backends:
+            # Warm up the scanners' indexes and buffers before timing
+            await sample(tree, backend, 2, 0)
+            latencies, session_count = await sample(tree, backend, args.iterations, args.churn)
+            report(backend, latencies, session_count, len(tree.pids))
+    finally:
+        if not args.keep:
+            tree.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    parser.add_argument("--sessions", type=int, default=100, help="frame sessions")
+    parser.add_argument("--processes", type=int, default=20, help="processes per frame session")
+    parser.add_argument("--background", type=int, default=10000, help="processes outside any frame")
+    parser.add_argument("--threads", type=int, default=1, help="threads per process")
+    parser.add_argument("--fanout", type=int, default=None, help="children per parent; 1 builds a chain")
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of frame processes replaced per sample")
+    parser.add_argument("-b", "--backend", action="append", choices=ProcRaider.backends)
+    parser.add_argument("--root", help="directory to build the tree in; a temporary one by default")
+    parser.add_argument("--keep", action="store_true", help="leave the tree on disk afterwards")
+    asyncio.run(amain(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+"""
+Long-lived /proc sampling coprocess and the client the daemon uses to drive it.
+
+The coprocess owns a session-scoped ProcRaider and pushes snapshots of the
+watched sessions to its parent, so /proc parsing never runs on the daemon's gRPC
+event loop and no process is forked per sample. A SamplingScheduler gives every
+session its own interval, so each snapshot only holds the sessions that were due.
+
+Both directions use the same framing: a 4-byte big-endian length followed by a
+msgpack map of that many bytes.
+
+    parent -> child   {"id": 7, "method": "add_pids", "args": [[1234, 1240]]}
+    child -> parent   {"id": 7, "result": {"pids": [1234, 1240]}}
+    child -> parent   {"id": 7, "error": "..."}
+    child -> parent   {"id": None, "event": "snapshot", "time": ..., "sessions": {...}}
+
+Every request carries an id that is echoed in its response, so the parent can
+pipeline commands without waiting for each reply.
+"""
+
+import asyncio
+import contextlib
+import os
+import signal
+import struct
+import sys
+import time
+
+import msgpack
+
+from . import log
+from .cgroup import FrameCgroup
+from .procraider import ProcRaider
+from .scheduler import SamplingScheduler
+
+
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class CoprocessException(RuntimeError):
+    """The sampler coprocess returned an error or went away."""
+
+
+def pack_frame(message):
+    """Return message encoded as a length-prefixed msgpack frame."""
+    payload = msgpack.packb(message, use_bin_type=True)
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    """Return the next decoded message from reader, or None at EOF."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise CoprocessException("frame of {} bytes exceeds the limit".format(length))
+
+    payload = await reader.readexactly(length)
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+class SamplerCoprocess(object):
+    """The child side: sample the watched sessions and answer commands on stdio."""
+
+    logger = log.get_logger()
+
+    def __init__(self, loop, interval=5.0):
+        """Constructor."""
+        self.loop = loop
+        self.scheduler = SamplingScheduler(interval=interval)
+        self.reader = None
+        self.writer = None
+        self.stopping = False
+        self._wakeup = asyncio.Event()
+        self.methods = {
+            "add_pids": self.add_pids,
+            "remove_pids": self.remove_pids,
+            "update_pids": self.update_pids,
+            "add_cgroup": self.add_cgroup,
+            "set_memory_limit": self.set_memory_limit,
+            "set_interval": self.set_interval,
+            "get_intervals": self.get_intervals,
+            "sample": self.sample,
+            "shutdown": self.shutdown,
+        }
+        ProcRaider.set_backend("session")
+
+    async def connect(self, stdin, stdout):
+        """Attach the frame reader and writer to the given binary pipes."""
+        self.reader = asyncio.StreamReader(limit=MAX_FRAME_SIZE, loop=self.loop)
+        protocol = asyncio.StreamReaderProtocol(self.reader, loop=self.loop)
+        await self.loop.connect_read_pipe(lambda: protocol, stdin)
+
+        transport, protocol = await self.loop.connect_write_pipe(
+            lambda: asyncio.streams.FlowControlMixin(loop=self.loop), stdout
+        )
+        self.writer = asyncio.StreamWriter(transport, protocol, None, self.loop)
+        await self.send({"id": None, "event": "ready", "pid": os.getpid()})
+
+    async def send(self, message):
+        self.writer.write(pack_frame(message))
+        await self.writer.drain()
+
+    async def add_pids(self, pids):
+        """Watch the sessions led by each of pids."""
+        for pid in pids:
+            ProcRaider.watch_session(int(pid))
+            self.scheduler.add(int(pid))
+        self._wakeup.set()
+        return {"pids": sorted(ProcRaider.watched_pids)}
+
+    async def remove_pids(self, pids):
+        """Stop watching the sessions led by each of pids."""
+        for pid in pids:
+            ProcRaider.unwatch_session(int(pid))
+            self.scheduler.remove(int(pid))
+        return {"pids": sorted(ProcRaider.watched_pids)}
+
+    async def update_pids(self, add=(), remove=()):
+        """Apply a batch of additions and removals in one message."""
+        await self.remove_pids(remove)
+        return await self.add_pids(add)
+
+    async def add_cgroup(self, pid, path, create_time=None):
+        """Watch the session led by pid through the frame cgroup at path."""
+        ProcRaider.watch_session(int(pid), cgroup=FrameCgroup(path, create_time))
+        self.scheduler.add(int(pid))
+        self._wakeup.set()
+        return {"pids": sorted(ProcRaider.watched_pids)}
+
+    async def set_memory_limit(self, pid, memory_limit):
+        """Sample the session led by pid faster as its rss nears memory_limit, in kB."""
+        self.scheduler.add(int(pid), memory_limit=int(memory_limit))
+        return {"pid": int(pid), "memory_limit": int(memory_limit)}
+
+    async def set_interval(self, interval):
+        """Reset every session to interval; the new value takes effect immediately."""
+        interval = float(interval)
+        if interval <= 0:
+            raise ValueError("interval must be positive, got {}".format(interval))
+
+        self.scheduler.set_interval(interval)
+        self._wakeup.set()
+        return {"interval": self.scheduler.interval}
+
+    async def get_intervals(self):
+        """Return the scheduler settings and the current interval of every session."""
+        return self.scheduler.to_dict()
+
+    async def sample(self):
+        """Return a snapshot of the watched sessions immediately."""
+        message, resultset = await self.snapshot()
+        return message
+
+    async def shutdown(self):
+        self.stop()
+        return {"status": "shutdown"}
+
+    async def snapshot(self, sessions=None):
+        resultset = await ProcRaider.get_filesystem_data(sessions)
+        return {
+            "time": time.time(),
+            "intervals": self.scheduler.intervals(),
+            "sessions": {session: data.to_dict() for session, data in resultset.items()},
+        }, resultset
+
+    async def sample_forever(self):
+        """Push a snapshot of the sessions that are due to the parent until stopped."""
+        scheduler = self.scheduler
+        while not self.stopping:
+            due = scheduler.due()
+            if due:
+                try:
+                    message, resultset = await self.snapshot(due)
+                    for session in due:
+                        if session in resultset:
+                            scheduler.update(session, resultset[session])
+                        else:
+                            scheduler.skip(session)
+                    message["id"] = None
+                    message["event"] = "snapshot"
+                    await self.send(message)
+                except Exception:
+                    self.logger.exception("failed to send snapshot")
+                    for session in due:
+                        scheduler.skip(session)
+            scheduler.update_budget()
+
+            self._wakeup.clear()
+            timeout = scheduler.next_wakeup()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), scheduler.interval if timeout is None else timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def handle_reads(self):
+        while not self.stopping:
+            request = await read_frame(self.reader)
+            if request is None:
+                break
+            await self.process_request(request)
+
+    async def process_request(self, request):
+        request_id = request.get("id")
+        method = request.get("method")
+        if method not in self.methods:
+            await self.send({"id": request_id, "error": "unrecognised method: {}".format(method)})
+            return
+
+        try:
+            result = await self.methods[method](*request.get("args", ()), **request.get("kwargs", {}))
+        except Exception as e:
+            self.logger.exception("failed to execute request", method=method)
+            await self.send({"id": request_id, "error": str(e)})
+        else:
+            await self.send({"id": request_id, "result": result})
+
+    def stop(self):
+        self.stopping = True
+        self._wakeup.set()
+
+
+class SamplerClient(object):
+    """The parent side: spawn the sampler coprocess and exchange frames with it."""
+
+    logger = log.get_logger()
+
+    def __init__(self, on_snapshot=None):
+        """Constructor."""
+        self.on_snapshot = on_snapshot
+        self.latest_snapshot = None
+        # The latest ProcessDataPoint.to_dict() values of each watched session,
+        # which are only in the snapshots that the session was due in
+        self.sessions = {}
+        self.process = None
+        self._next_id = 0
+        self._pending = {}
+        self._ready = None
+        self._read_task = None
+
+    async def start(self, interval=5.0):
+        """Start the coprocess and wait until it is ready for commands."""
+        loop = asyncio.get_running_loop()
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.pathsep.join(
+            path for path in (package_root, env.get("PYTHONPATH")) if path
+        )
+
+        self._ready = loop.create_future()
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, "-u", "-m", "asyncrqd.coprocess", str(interval),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=env,
+            limit=MAX_FRAME_SIZE,
+        )
+        self._read_task = loop.create_task(self.handle_reads())
+        await self._ready
+
+    async def handle_reads(self):
+        try:
+            while True:
+                message = await read_frame(self.process.stdout)
+                if message is None:
+                    break
+                self.dispatch(message)
+        finally:
+            error = CoprocessException("sampler coprocess exited")
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+            if not self._ready.done():
+                self._ready.set_exception(error)
+
+    def dispatch(self, message):
+        request_id = message.get("id")
+        if request_id is None:
+            event = message.get("event")
+            if event == "ready":
+                self._ready.set_result(message)
+            elif event == "snapshot":
+                self.latest_snapshot = message
+                self.sessions.update(message["sessions"])
+                if self.on_snapshot is not None:
+                    try:
+                        self.on_snapshot(message)
+                    except Exception:
+                        self.logger.exception("snapshot callback failed")
+            return
+
+        future = self._pending.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if "error" in message:
+            future.set_exception(CoprocessException(message["error"]))
+        else:
+            future.set_result(message.get("result"))
+
+    def send(self, method, *args, **kwargs):
+        """Send a request without waiting and return a future for its result."""
+        if self._read_task is None or self._read_task.done():
+            # Nothing would ever answer it
+            raise CoprocessException("sampler coprocess is not running")
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self._next_id] = future
+        self.process.stdin.write(
+            pack_frame({"id": self._next_id, "method": method, "args": args, "kwargs": kwargs})
+        )
+        return future
+
+    async def call(self, method, *args, **kwargs):
+        """Send a request and return its result."""
+        future = self.send(method, *args, **kwargs)
+        await self.process.stdin.drain()
+        return await future
+
+    async def add_pids(self, *pids):
+        return await self.call("add_pids", pids)
+
+    async def remove_pids(self, *pids):
+        result = await self.call("remove_pids", pids)
+        for pid in pids:
+            self.sessions.pop(pid, None)
+        return result
+
+    async def update_pids(self, add=(), remove=()):
+        return await self.call("update_pids", add=list(add), remove=list(remove))
+
+    async def add_cgroup(self, pid, cgroup):
+        """Watch the session led by pid through cgroup, a FrameCgroup."""
+        return await self.call("add_cgroup", pid, cgroup.path, cgroup.create_time)
+
+    async def set_memory_limit(self, pid, memory_limit):
+        return await self.call("set_memory_limit", pid, memory_limit)
+
+    async def set_interval(self, interval):
+        return await self.call("set_interval", interval)
+
+    async def get_intervals(self):
+        return await self.call("get_intervals")
+
+    async def sample(self):
+        return await self.call("sample")
+
+    async def stop(self):
+        """Ask the coprocess to shut down and wait for it to exit."""
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            await self.call("shutdown")
+        except CoprocessException:
+            pass
+        self.process.stdin.close()
+        await self.process.wait()
+        await self._read_task
+
+
+async def amain(loop, interval):
+    # Keep the protocol on a private copy of stdout and send anything printed
+    # by accident to stderr, where it cannot corrupt a frame.
+    stdout = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    sampler = SamplerCoprocess(loop, interval=interval)
+    loop.add_signal_handler(signal.SIGINT, sampler.stop)
+    loop.add_signal_handler(signal.SIGTERM, sampler.stop)
+    await sampler.connect(sys.stdin, stdout)
+
+    sampling = loop.create_task(sampler.sample_forever())
+    await sampler.handle_reads()
+    sampler.stop()
+    await sampling
+    ProcRaider.shutdown_executor()
+
+
+def main():
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    with contextlib.closing(loop):
+        loop.run_until_complete(amain(loop, interval))
+
+
+if __name__ == "__main__":
+    main()
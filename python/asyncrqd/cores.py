@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Book the host's cores to frames, and lock them on CueBot's request.
+
+CueBot asks for cores in core units, 100 to a physical core. Every booking gets
+whole physical cores, with all of their hyperthreads, and is packed into as few
+NUMA nodes as will hold it: the node with the fewest free cores that can take
+the whole frame, or failing that the nodes with the most free cores first.
+
+The ledger keeps the free, booked and locked physical cores as int bitmaps, and
+the booked and locked cpus alongside for CPU_LIST, so booking, releasing and
+CoreDetail counts are a few integer operations however busy the host is.
+Locked cores are taken from the idle ones first; locking a booked core leaves
+the frame running on it, but the core is not booked again until unlocked.
+"""
+
+import math
+
+from . import log
+from .proto import report_pb2
+from .topology import bits
+from .topology import format_cpu_list
+from .topology import popcount
+
+
+CORE_UNITS = 100
+
+
+class CoreBookingException(RuntimeError):
+    """When there are not enough free cores for a frame."""
+
+
+class CoreLedger(object):
+    """Track which physical cores are free, booked to a frame, or locked."""
+
+    logger = log.get_logger()
+
+    def __init__(self, topology):
+        """Constructor."""
+        self.topology = topology
+        self.free = topology.all_cores
+        self.booked = 0
+        self.locked = 0
+        self.booked_cpus = 0
+        self.locked_cpus = 0
+        # frame id -> core bitmap
+        self.bookings = {}
+
+    @staticmethod
+    def cores_for(core_units):
+        """Return the whole physical cores needed for core_units, at least one."""
+        return max(1, math.ceil(core_units / CORE_UNITS))
+
+    def select(self, count):
+        """Return a core bitmap of count free cores, packed into as few nodes as possible."""
+        free_by_node = [
+            (popcount(self.free & cores), node, self.free & cores)
+            for node, cores in self.topology.node_cores.items()
+        ]
+
+        fitting = [entry for entry in free_by_node if entry[0] >= count]
+        if fitting:
+            # Best fit, keeping the larger spans of free cores for larger frames
+            candidates = [min(fitting)]
+        else:
+            candidates = sorted(free_by_node, reverse=True)
+
+        selected = 0
+        for free_count, node, free in candidates:
+            while free and count:
+                low = free & -free
+                selected |= low
+                free ^= low
+                count -= 1
+        return selected
+
+    def book(self, frame_id, core_units):
+        """Book cores for frame_id and return their cpus as a CPU_LIST string."""
+        if frame_id in self.bookings:
+            raise CoreBookingException("frame {} already has cores booked".format(frame_id))
+
+        count = self.cores_for(core_units)
+        if count > popcount(self.free):
+            raise CoreBookingException(
+                "frame {} needs {} cores, {} are free".format(frame_id, count, popcount(self.free))
+            )
+
+        cores = self.select(count)
+        cpus = self.topology.cpus_of_cores(cores)
+        self.free &= ~cores
+        self.booked |= cores
+        self.booked_cpus |= cpus
+        self.bookings[frame_id] = cores
+        return format_cpu_list(bits(cpus))
+
+    def release(self, frame_id):
+        """Return the cores of frame_id to the free set, unless they have been locked since."""
+        cores = self.bookings.pop(frame_id, 0)
+        if not cores:
+            return
+        self.booked &= ~cores
+        self.booked_cpus &= ~self.topology.cpus_of_cores(cores)
+        self.free |= cores & ~self.locked
+
+    def lock(self, core_units):
+        """Lock up to core_units more cores, idle ones first; return the core units locked."""
+        count = self.cores_for(core_units) if core_units else 0
+        locked = 0
+        # Lock from the top, so frames keep packing from the bottom
+        for pool in (self.free, self.booked & ~self.locked):
+            for core in reversed(bits(pool)):
+                if locked == count:
+                    break
+                self.locked |= 1 << core
+                locked += 1
+        self.free &= ~self.locked
+        self.locked_cpus = self.topology.cpus_of_cores(self.locked)
+        return locked * CORE_UNITS
+
+    def unlock(self, core_units):
+        """Unlock up to core_units locked cores; return the core units unlocked."""
+        count = self.cores_for(core_units) if core_units else 0
+        unlocked = 0
+        # Cores nobody is running on are unlocked first
+        for pool in (self.locked & ~self.booked, self.locked & self.booked):
+            for core in bits(pool):
+                if unlocked == count:
+                    break
+                self.locked &= ~(1 << core)
+                unlocked += 1
+        self.free = self.topology.all_cores & ~self.booked & ~self.locked
+        self.locked_cpus = self.topology.cpus_of_cores(self.locked)
+        return unlocked * CORE_UNITS
+
+    def set_topology(self, topology):
+        """Move to a new topology after cpu hotplug; bookings and locks keep the cpus they hold."""
+        booking_cpus = {
+            frame_id: self.topology.cpus_of_cores(cores) for frame_id, cores in self.bookings.items()
+        }
+        self.topology = topology
+        self.bookings = {
+            frame_id: topology.cores_of_cpus(cpus) for frame_id, cpus in booking_cpus.items()
+        }
+        self.booked = 0
+        for cores in self.bookings.values():
+            self.booked |= cores
+        self.booked_cpus = topology.cpus_of_cores(self.booked)
+        self.locked = topology.cores_of_cpus(self.locked_cpus)
+        self.locked_cpus = topology.cpus_of_cores(self.locked)
+        self.free = topology.all_cores & ~self.booked & ~self.locked
+
+    def lock_all(self):
+        self.locked = self.topology.all_cores
+        self.locked_cpus = self.topology.all_cpus
+        self.free = 0
+
+    def unlock_all(self):
+        self.locked = 0
+        self.locked_cpus = 0
+        self.free = self.topology.all_cores & ~self.booked
+
+    def core_detail(self):
+        """Return a report_pb2.CoreDetail of the ledger, in core units."""
+        return report_pb2.CoreDetail(
+            total_cores=self.topology.num_cores * CORE_UNITS,
+            idle_cores=popcount(self.free) * CORE_UNITS,
+            locked_cores=popcount(self.locked) * CORE_UNITS,
+            booked_cores=popcount(self.booked) * CORE_UNITS,
+        )
+
+    def to_dict(self):
+        return {
+            "free": format_cpu_list(bits(self.topology.cpus_of_cores(self.free))),
+            "booked": format_cpu_list(bits(self.booked_cpus)),
+            "locked": format_cpu_list(bits(self.locked_cpus)),
+            "bookings": {
+                frame_id: format_cpu_list(bits(self.topology.cpus_of_cores(cores)))
+                for frame_id, cores in self.bookings.items()
+            },
+        }
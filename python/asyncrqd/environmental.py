@@ -3,54 +3,66 @@
 import time
 
 from . import config
+from .topology import HardwareInventory
+from .topology import parse_cpu_list
 
 class Environment(object):
 
+    default_path = "/usr/local/bin:/usr/bin:/bin"
+
     @classmethod
-    def linux(cls, user_name, frame):
-        dn = config.dot_notation()
+    def linux(cls, frame, cpu_list=None):
+        environment = config.dot_notation().environment
         linux = {}
-        linux["PATH"] = dn.environment.linux.PATH
+        linux["PATH"] = (environment and environment.linux and environment.linux.PATH) or cls.default_path
         linux["TZ"] = time.tzname[0]
 
         # user_name
-        linux["USER"] = user_name
-        linux["MAIL"] = "/usr/mail/{}".format(user_name)
-        linux["HOME"] = "/net/homedirs/{}".format(user_name)
+        linux["USER"] = frame.user_name
+        linux["MAIL"] = "/usr/mail/{}".format(frame.user_name)
+        linux["HOME"] = "/net/homedirs/{}".format(frame.user_name)
 
-        env = cls(linux)
+        env = cls(linux, frame, cpu_list)
         return env
 
-    def __init__(self, platform_env, frame):
-
-        env = platform_env.copy()
-        env["TERM"] = "unknown"
-        env["TZ"] = self.rqCore.machine.getTimezone()
-        env["LOGNAME"] = frame.user_name
-        env["MAIL"] = "/usr/mail/%s" % frame.user_name
-        env["HOME"] = "/net/homedirs/%s" % frame.user_name
-        env["mcp"] = "1"
-        env["show"] = frame.show
-        env["shot"] = frame.shot
-        env["jobid"] = frame.job_name
-        env["jobhost"] = self.rqCore.machine.getHostname()
-        env["frame"] = frame.frame_name
-        env["zframe"] = frame.frame_name
-        env["logfile"] = frame.log_file
-        env["maxframetime"] = "0"
-        env["minspace"] = "200"
-        env["CUE3"] = "True"
-        env["CUE_GPU_MEMORY"] = str(self.rqCore.machine.getGpuMemory())
-        env["SP_NOMYCSHRC"] = "1"
+    def __init__(self, platform_env, frame, cpu_list=None):
+        """
+        Constructor.
+
+        cpu_list is the cpus the frame is pinned to, if any; the frame gets at
+        least enough CUE_THREADS to use every one of them, hyperthreads included.
+        """
+        self.env = platform_env.copy()
+        self.env["TERM"] = "unknown"
+        inventory = HardwareInventory.get()
+        self.env["TZ"] = inventory.timezone
+        self.env["LOGNAME"] = frame.user_name
+        self.env["MAIL"] = "/usr/mail/%s" % frame.user_name
+        self.env["HOME"] = "/net/homedirs/%s" % frame.user_name
+        self.env["mcp"] = "1"
+        self.env["show"] = frame.show
+        self.env["shot"] = frame.shot
+        self.env["jobid"] = frame.job_name
+        self.env["jobhost"] = inventory.hostname
+        self.env["frame"] = frame.frame_name
+        self.env["zframe"] = frame.frame_name
+        self.env["logfile"] = frame.log_file
+        self.env["maxframetime"] = "0"
+        self.env["minspace"] = "200"
+        self.env["CUE3"] = "True"
+        self.env["CUE_GPU_MEMORY"] = str(inventory.gpu_memory)
+        self.env["SP_NOMYCSHRC"] = "1"
+
+        if cpu_list:
+            self.env["CPU_LIST"] = cpu_list
+            self.env["CUE_THREADS"] = str(len(parse_cpu_list(cpu_list)))
 
         for key in frame.environment:
             self.env[key] = frame.environment[key]
 
         # Add threads to use all assigned hyper-threading cores
-        if 'CPU_LIST' in frame.attributes and 'CUE_THREADS' in self.env:
+        if cpu_list:
             self.env['CUE_THREADS'] = str(max(
                 int(self.env['CUE_THREADS']),
-                len(frame.attributes['CPU_LIST'].split(','))))
+                len(parse_cpu_list(cpu_list))))
             self.env['CUE_HT'] = "True"
-
-
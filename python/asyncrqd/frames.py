@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Launch the frames CueBot sends and keep track of them while they run.
+
+FrameManager.launch is awaited by the LaunchFrame handler. It returns as soon as
+the frame's process has been started, and a task per frame waits for it to
+finish, so the gRPC loop is only held for the fork and exec of each launch.
+"""
+
+import asyncio
+import collections
+import os
+
+from . import config
+from . import log
+from .coprocess import CoprocessException
+from .cores import CoreBookingException
+from .environmental import Environment
+from .process import SubProcess
+from .process import SubprocessOutputHandler
+
+
+class FrameLaunchException(RuntimeError):
+    """When a frame cannot be launched."""
+
+
+class FrameAlreadyRunningException(FrameLaunchException):
+    """When a frame is launched again while it is still running."""
+
+
+class FrameCoresUnavailableException(FrameLaunchException):
+    """When there are not enough free cores to launch a frame."""
+
+
+class FrameManager(object):
+    """Start frames from RunFrame messages and wait for them in the background."""
+
+    logger = log.get_logger()
+
+    shell = "/bin/sh"
+    # The RunFrame attribute holding the frame's memory limit in kB
+    memory_limit_attribute = "memory_limit"
+    # How many of the latest launch latencies are kept
+    launch_times_size = 1000
+
+    def __init__(self, on_complete=None, ledger=None, sampler=None):
+        """
+        Constructor.
+
+        on_complete is called with the SubProcess of every frame that finishes.
+        With a cores.CoreLedger, every frame is booked num_cores worth of cores
+        and pinned to them, unless its CPU_LIST attribute already names its cpus.
+        With a coprocess.SamplerClient, every frame's session is watched by the
+        sampler while it runs, through the frame's cgroup if it has one, and
+        sampled faster as it nears the memory limit in its attributes.
+        """
+        self.on_complete = on_complete
+        self.ledger = ledger
+        self.sampler = sampler
+        self.frames = {}
+        self._tasks = set()
+        # The latest launch latencies in seconds, for benchmarks and inspection
+        self.launch_times = collections.deque(maxlen=self.launch_times_size)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get(self, frame_id):
+        return self.frames.get(frame_id)
+
+    @staticmethod
+    def log_path(run_frame):
+        """Return the log file of run_frame, or None if it has none."""
+        if run_frame.log_dir_file:
+            return run_frame.log_dir_file
+        if run_frame.log_dir and run_frame.log_file:
+            return os.path.join(run_frame.log_dir, run_frame.log_file)
+        return None
+
+    @staticmethod
+    def environment(run_frame, cpu_list=None):
+        """Return the environment of the frame's process."""
+        return Environment.linux(run_frame, cpu_list).env
+
+    def memory_limit(self, run_frame):
+        """Return the memory limit of run_frame in kB, or None if it has none."""
+        value = run_frame.attributes.get(self.memory_limit_attribute)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            self.logger.warning("ignoring bad memory limit", frame_id=run_frame.frame_id, memory_limit=value)
+            return None
+
+    def output_handler(self, run_frame):
+        """Return the output handler of the frame, writing to its log file if it can be opened."""
+        output = config.dot_notation().daemon.output
+        logfile = self.log_path(run_frame)
+        options = {
+            "batch": True,
+            "queued": True,
+            "compress": output and output.compression,
+        }
+        if logfile is not None:
+            try:
+                os.makedirs(os.path.dirname(logfile), exist_ok=True)
+                return SubprocessOutputHandler(logfile, **options)
+            except OSError as e:
+                self.logger.warning("cannot open frame log", frame_id=run_frame.frame_id, path=logfile, error=str(e))
+        return SubprocessOutputHandler(**options)
+
+    async def launch(self, run_frame):
+        """Start run_frame and return its SubProcess as soon as it is running."""
+        frame_id = run_frame.frame_id
+        if frame_id in self.frames:
+            raise FrameAlreadyRunningException("frame {} is already running".format(frame_id))
+
+        loop = asyncio.get_running_loop()
+        st = loop.time()
+        cpu_list = run_frame.attributes.get("CPU_LIST")
+        if cpu_list is None and self.ledger is not None:
+            try:
+                cpu_list = self.ledger.book(frame_id, run_frame.num_cores)
+            except CoreBookingException as e:
+                raise FrameCoresUnavailableException(str(e)) from e
+
+        handler = self.output_handler(run_frame)
+        cwd = run_frame.frame_temp_dir if os.path.isdir(run_frame.frame_temp_dir) else None
+        subprocess = SubProcess(
+            [self.shell, "-c", run_frame.command],
+            handler,
+            cwd=cwd,
+            env=self.environment(run_frame, cpu_list),
+            cpu_list_arg=cpu_list,
+            frame_id=frame_id,
+        )
+        subprocess.run_frame = run_frame
+
+        # Hold the frame id while the process starts, so a repeated request fails
+        self.frames[frame_id] = subprocess
+        try:
+            await subprocess.start(loop)
+        except Exception as e:
+            del self.frames[frame_id]
+            self.release(frame_id)
+            handler.close()
+            raise FrameLaunchException("failed to launch frame {}: {}".format(frame_id, e)) from e
+
+        self.launch_times.append(loop.time() - st)
+        if self.sampler is not None:
+            # The frame is running already, so the sampler is told in the background
+            self._add_task(loop, self.watch(subprocess, self.memory_limit(run_frame)))
+        self._add_task(loop, self._wait(subprocess))
+        self.logger.debug("launched frame", frame_id=frame_id, pid=subprocess.pid)
+        return subprocess
+
+    def _add_task(self, loop, coro):
+        task = loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def watch(self, subprocess, memory_limit=None):
+        """Have the sampler watch the session of the frame, which leads it; memory_limit is in kB."""
+        try:
+            if subprocess.cgroup is not None:
+                await self.sampler.add_cgroup(subprocess.pid, subprocess.cgroup)
+            else:
+                await self.sampler.add_pids(subprocess.pid)
+            if memory_limit is not None:
+                await self.sampler.set_memory_limit(subprocess.pid, memory_limit)
+        except CoprocessException as e:
+            self.logger.warning("cannot sample frame", frame_id=subprocess.frame_id, error=str(e))
+
+    async def unwatch(self, subprocess):
+        try:
+            await self.sampler.remove_pids(subprocess.pid)
+        except CoprocessException as e:
+            self.logger.warning("cannot stop sampling frame", frame_id=subprocess.frame_id, error=str(e))
+
+    async def _wait(self, subprocess):
+        try:
+            await subprocess.wait()
+            await subprocess.output_handler.aclose()
+        finally:
+            del self.frames[subprocess.frame_id]
+            self.release(subprocess.frame_id)
+        if self.sampler is not None:
+            # Kept for the completion report; the sampler forgets it on unwatch
+            subprocess.usage = self.sampler.sessions.get(subprocess.pid)
+            await self.unwatch(subprocess)
+        self.logger.debug(
+            "frame finished",
+            frame_id=subprocess.frame_id,
+            exitcode=subprocess.exitcode,
+            realtime=subprocess.realtime,
+        )
+        if self.on_complete is not None:
+            try:
+                self.on_complete(subprocess)
+            except Exception:
+                self.logger.exception("frame completion callback failed", frame_id=subprocess.frame_id)
+
+    def release(self, frame_id):
+        if self.ledger is not None:
+            self.ledger.release(frame_id)
+
+    async def wait_all(self):
+        """Wait for every running frame to finish."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
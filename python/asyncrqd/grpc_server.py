@@ -4,9 +4,13 @@
 import asyncio
 import uvloop
 
+from grpclib.const import Status
+from grpclib.exceptions import GRPCError
 from grpclib.utils import graceful_exit
+from grpclib.client import Channel
 from grpclib.server import Server
 
+from .proto import report_grpc
 from .proto import rqd_grpc
 from .proto import rqd_pb2_grpc
 from .proto import rqd_pb2
@@ -15,7 +19,21 @@ from .proto import report_pb2
 
 
 from . import config
+from . import coprocess
+from . import launcher
 from . import log
+from . import process
+from .cores import CoreLedger
+from .frames import FrameAlreadyRunningException
+from .frames import FrameCoresUnavailableException
+from .frames import FrameLaunchException
+from .frames import FrameManager
+from .hoststats import HostStatsSampler
+from .process import SubProcess
+from .procraider import ProcessDataPoint
+from .swap import VmStat
+from .topology import HardwareInventory
+from .topology import HotplugWatcher
 
 print(config.get("grpc"))
 grpc = None
@@ -26,24 +44,74 @@ class RqdInterface(rqd_grpc.RqdInterfaceBase):
 
     logger = log.get_logger()
 
+    # Seconds to wait for CueBot to take a frame completion report
+    report_timeout = 30.0
+
+    def __init__(self, frames=None, ledger=None, host_stats=None, sampler=None):
+        """Constructor."""
+        self.ledger = ledger or CoreLedger(HardwareInventory.get().topology)
+        self.sampler = sampler
+        self.frames = frames or FrameManager(on_complete=self.frame_complete, ledger=self.ledger, sampler=sampler)
+        self.host_stats = host_stats or HostStatsSampler()
+        self.vmstat = VmStat(None, sampler=self.host_stats)
+        self._report_channel = None
+        self._report_tasks = set()
+
+    def report_stub(self):
+        """Return the stub of CueBot's report interface, connecting on first use."""
+        if self._report_channel is None:
+            connect = config.dot_notation().grpc.connect
+            self._report_channel = Channel(
+                (connect and connect.host) or "localhost", (connect and connect.port) or 8443
+            )
+        return report_grpc.RqdReportInterfaceStub(self._report_channel)
+
+    async def close(self):
+        """Wait for the completion reports still being sent and disconnect from CueBot."""
+        if self._report_tasks:
+            await asyncio.gather(*self._report_tasks, return_exceptions=True)
+        if self._report_channel is not None:
+            self._report_channel.close()
+            self._report_channel = None
+
+    @staticmethod
+    def running_frame_info(subprocess):
+        """Return a report_pb2.RunningFrameInfo for the frame subprocess ran, with its last sampled usage."""
+        run_frame = subprocess.run_frame
+        info = report_pb2.RunningFrameInfo(
+            resource_id=run_frame.resource_id,
+            job_id=run_frame.job_id,
+            job_name=run_frame.job_name,
+            frame_id=run_frame.frame_id,
+            frame_name=run_frame.frame_name,
+            layer_id=run_frame.layer_id,
+            num_cores=run_frame.num_cores,
+            start_time=run_frame.start_time,
+        )
+        if subprocess.usage is not None:
+            ProcessDataPoint.from_dict(subprocess.usage).to_running_frame_info(info)
+        return info
+
+    def frame_complete(self, subprocess):
+        """Report a finished frame to CueBot in the background; FrameManager's on_complete."""
+        task = asyncio.get_running_loop().create_task(self.report_frame_completion(subprocess))
+        self._report_tasks.add(task)
+        task.add_done_callback(self._report_tasks.discard)
+
+    async def report_frame_completion(self, subprocess):
+        """Send the FrameCompleteReport of a finished frame to CueBot."""
+        report = subprocess.frame_complete_report(self.host_stats.render_host(), self.running_frame_info(subprocess))
+        try:
+            await self.report_stub().ReportRunningFrameCompletion(
+                report_pb2.RqdReportRunningFrameCompletionRequest(frame_complete_report=report),
+                timeout=self.report_timeout,
+            )
+        except (GRPCError, OSError, asyncio.TimeoutError) as e:
+            self.logger.warning("cannot report frame completion", frame_id=subprocess.frame_id, error=str(e))
+
     async def LaunchFrame(self, stream):
         """Respond to CueBot request to launch a frame."""
         request: rqd_pb2.RqdStaticLaunchFrameRequest = await stream.recv_message()
-        print("===============================================")
-        print('request')
-        print(request)
-        print('type request')
-        print(type(request))
-        print('dir request')
-        print(dir(request))
-        print("===============================================")
-        print('request.run_frame')
-        print(request.run_frame)
-        print('type request.run_frame')
-        print(type(request.run_frame))
-        print('dir request.run_frame')
-        print(dir(request.run_frame))
-        print("===============================================")
         run_frame = request.run_frame
         self.logger.debug(
             "Received LaunchFrame",
@@ -70,6 +138,15 @@ class RqdInterface(rqd_grpc.RqdInterfaceBase):
             environment=run_frame.environment,
             attributes=run_frame.attributes,
         )
+        try:
+            await self.frames.launch(run_frame)
+        except FrameAlreadyRunningException as e:
+            raise GRPCError(Status.ALREADY_EXISTS, str(e))
+        except FrameCoresUnavailableException as e:
+            raise GRPCError(Status.RESOURCE_EXHAUSTED, str(e))
+        except FrameLaunchException as e:
+            self.logger.error("LaunchFrame failed", frame_id=run_frame.frame_id, error=str(e))
+            raise GRPCError(Status.INTERNAL, str(e))
         await stream.send_message(rqd_pb2.RqdStaticLaunchFrameResponse())
 
     async def ReportStatus(self, stream):
@@ -77,7 +154,12 @@ class RqdInterface(rqd_grpc.RqdInterfaceBase):
         request = await stream.recv_message()
         self.logger.debug("request", request=request)
         await stream.send_message(
-            rqd_pb2.RqdStaticReportStatusResponse(host_report=report_pb2.HostReport())
+            rqd_pb2.RqdStaticReportStatusResponse(
+                host_report=report_pb2.HostReport(
+                    host=self.host_stats.render_host(),
+                    core_info=self.ledger.core_detail(),
+                )
+            )
         )
 
     async def GetRunningFrameStatus(self, stream):
@@ -100,6 +182,58 @@ class RqdInterface(rqd_grpc.RqdInterfaceBase):
             """
         return rqd_pb2.RqdStaticGetRunningFrameStatusResponse()
 
+    async def GetRunningFrameTail(self, stream):
+        """RPC call to return the most recent output of the given frame id from memory"""
+        request = await stream.recv_message()
+        self.logger.debug("Request received: getRunningFrameTail", frame_id=request.frame_id)
+        subprocess = SubProcess.get(request.frame_id)
+        tail = subprocess.tail(request.lines, request.max_bytes) if subprocess else None
+        if tail is None:
+            raise GRPCError(
+                Status.NOT_FOUND,
+                "The requested frame was not found. frameId: {}".format(request.frame_id),
+            )
+
+        offset, data = tail
+        await stream.send_message(
+            rqd_pb2.RqdStaticGetRunningFrameTailResponse(
+                data=data,
+                offset=offset,
+                end_offset=subprocess.output_handler.tail.end_offset,
+            )
+        )
+
+    async def StreamRunningFrameLog(self, stream):
+        """RPC call to stream the output of the given frame id until it ends"""
+        request = await stream.recv_message()
+        self.logger.debug(
+            "Request received: streamRunningFrameLog", frame_id=request.frame_id, offset=request.offset
+        )
+        subprocess = SubProcess.get(request.frame_id)
+        output_handler = subprocess.output_handler if subprocess else None
+        log_stream = output_handler.attach_stream(request.offset, request.lines) if output_handler else None
+        if log_stream is None:
+            raise GRPCError(
+                Status.NOT_FOUND,
+                "The requested frame was not found. frameId: {}".format(request.frame_id),
+            )
+
+        try:
+            while True:
+                block = await log_stream.get()
+                if block is None:
+                    break
+                offset, data = block
+                await stream.send_message(
+                    rqd_pb2.RqdStaticStreamRunningFrameLogResponse(data=data, offset=offset)
+                )
+        finally:
+            output_handler.detach_stream(log_stream)
+            if log_stream.skipped:
+                self.logger.debug(
+                    "log stream skipped output", frame_id=request.frame_id, skipped=log_stream.skipped
+                )
+
     async def KillRunningFrame(self, stream):
         """RPC call that kills the running frame with the given id"""
         self.logger.debug("Request received: killRunningFrame")
@@ -168,26 +302,28 @@ class RqdInterface(rqd_grpc.RqdInterfaceBase):
         """RPC call that locks a specific number of cores"""
         request = await stream.recv_message()
         self.logger.debug("Request recieved: lock {cores}", cores=request.cores)
-        self.logger.debug("self.rqCore.lock(request.cores)")
+        locked = self.ledger.lock(request.cores)
+        self.logger.debug("locked cores", requested=request.cores, locked=locked)
         await stream.send_message(rqd_pb2.RqdStaticLockResponse())
 
     async def LockAll(self, stream):
         """RPC call that locks all cores"""
         self.logger.debug("Request recieved: lockAll")
-        self.logger.debug("self.rqCore.lockAll()")
+        self.ledger.lock_all()
         await stream.send_message(rqd_pb2.RqdStaticLockAllResponse())
 
     async def Unlock(self, stream):
         """RPC call that unlocks a specific number of cores"""
         request = await stream.recv_message()
         self.logger.debug("Request recieved: unlock {cores}", cores=request.cores)
-        self.logger.debug("self.rqCore.unlock(request.cores)")
+        unlocked = self.ledger.unlock(request.cores)
+        self.logger.debug("unlocked cores", requested=request.cores, unlocked=unlocked)
         await stream.send_message(rqd_pb2.RqdStaticUnlockResponse())
 
     async def UnlockAll(self, stream):
         """RPC call that unlocks all cores"""
         self.logger.debug("Request recieved: unlockAll")
-        self.logger.debug("self.rqCore.unlockAll()")
+        self.ledger.unlock_all()
         await stream.send_message(rqd_pb2.RqdStaticUnlockAllResponse())
 
     async def GetRunFrame(self, stream):
@@ -200,11 +336,33 @@ class RqdInterface(rqd_grpc.RqdInterfaceBase):
 
 async def main(*, host="127.0.0.1", port=50051, loop=None):
     """Attach a protocol to a listener on the given IP address and port."""
-    server = Server([RqdInterface()])  # , loop=loop)
+    process.install_child_watcher(asyncio.get_running_loop())
+    launch = config.dot_notation().daemon.launch
+    if launch and launch.mode == "launcher":
+        # Started before the daemon grows, and forked from for every frame
+        SubProcess.launcher_client = await launcher.LauncherClient().start()
+    # Frames are sampled in a coprocess, off this loop; without it they are not sampled
+    sampling = config.dot_notation().daemon.sampling
+    sampler = coprocess.SamplerClient()
+    try:
+        await sampler.start(interval=(sampling and sampling.interval) or 5.0)
+    except coprocess.CoprocessException as e:
+        RqdInterface.logger.error("cannot start the sampler coprocess", error=str(e))
+        sampler = None
+    interface = RqdInterface(sampler=sampler)
+    hotplug = HotplugWatcher(on_change=lambda inventory: interface.ledger.set_topology(inventory.topology))
+    hotplug.start()
+    # The host stats sampler feeds ReportStatus and the page out rate
+    host_stats = asyncio.ensure_future(interface.host_stats.start())
+    server = Server([interface])  # , loop=loop)
     with graceful_exit([server]):  # , loop=loop):
         await server.start(host, port)
         print(f"Serving on {host}:{port}")
         await server.wait_closed()
+    await interface.close()
+    host_stats.cancel()
+    if sampler is not None:
+        await sampler.stop()
 
 
 def run():
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+One sampler for the host-wide statistics in /proc.
+
+/proc/vmstat, /proc/meminfo, /proc/loadavg and, where the kernel has PSI,
+/proc/pressure/{cpu,memory,io} are opened once and kept open. Each tick they
+are read again from offset 0 with os.preadv into buffers that are reused from
+one tick to the next, and only the fields that RenderHost and VmStat use are
+parsed out. The result is one HostStats snapshot per tick, handed to every
+subscriber, so they all see the same numbers taken at the same time.
+"""
+
+import asyncio
+import collections
+import os
+import time
+
+from . import config
+from . import log
+from .topology import HardwareInventory
+
+
+HostStats = collections.namedtuple(
+    "HostStats",
+    (
+        "time",
+        "pgpgout",
+        "pswpout",
+        "mem_total",
+        "mem_free",
+        "mem_available",
+        "swap_total",
+        "swap_free",
+        "load1",
+        "load5",
+        "load15",
+        "pressure",
+    ),
+)
+HostStats.__doc__ = """
+A snapshot of the host. Memory is in kB, pgpgout and pswpout are counters
+since boot, and pressure maps "cpu", "memory" and "io" to the (some, full)
+avg10 percentages, where the kernel has PSI.
+"""
+
+
+class HostStatsSampler(object):
+    """Sample the host statistics through persistent file descriptors."""
+
+    logger = log.get_logger()
+
+    files = ("vmstat", "meminfo", "loadavg", "pressure/cpu", "pressure/memory", "pressure/io")
+    buffer_size = 8192
+
+    vmstat_keys = (b"pgpgout ", b"pswpout ")
+    meminfo_keys = (b"MemTotal:", b"MemFree:", b"MemAvailable:", b"SwapTotal:", b"SwapFree:")
+
+    def __init__(self, interval=None, proc_root=None):
+        """Constructor."""
+        dn = config.dot_notation()
+        host_stats = dn.daemon.host_stats
+        linux = dn.machine.linux
+        self.interval = interval or (host_stats and host_stats.interval) or 5.0
+        self.proc_root = proc_root or (linux and linux.proc_root) or "/proc"
+        self.latest = None
+        self.stopping = False
+        self._subscribers = []
+        self._fds = {}
+        self._buffers = {}
+
+    def open(self):
+        """Open every file that exists; the pressure files are missing without PSI."""
+        for name in self.files:
+            if name in self._fds:
+                continue
+            try:
+                self._fds[name] = os.open(os.path.join(self.proc_root, name), os.O_RDONLY)
+            except OSError:
+                continue
+            self._buffers[name] = bytearray(self.buffer_size)
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+        self._buffers.clear()
+
+    def subscribe(self, callback):
+        """Call callback with every new HostStats snapshot."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def read(self, name):
+        """
+        Read the file name from the start into its buffer; return (buffer, length).
+
+        The buffer is reused for the next read, so it is only valid until then.
+        The length is -1 if the file is not open.
+        """
+        fd = self._fds.get(name)
+        if fd is None:
+            return None, -1
+        buffer = self._buffers[name]
+        while True:
+            length = os.preadv(fd, [buffer], 0)
+            if length < len(buffer):
+                return buffer, length
+            # Too small to be sure of the whole file; grow it for this and later reads
+            buffer = self._buffers[name] = bytearray(len(buffer) * 2)
+
+    @staticmethod
+    def find_values(buffer, length, keys):
+        """Return the first number after each of keys in buffer[:length], 0 for the missing ones."""
+        values = []
+        for key in keys:
+            start = buffer.find(key, 0, length) if length > 0 else -1
+            if start < 0:
+                values.append(0)
+                continue
+            start += len(key)
+            end = buffer.find(b"\n", start, length)
+            # Only the rest of the line is copied, to drop the padding and any " kB"
+            values.append(int(buffer[start:length if end < 0 else end].split()[0]))
+        return values
+
+    @staticmethod
+    def parse_pressure(buffer, length):
+        """Return (some avg10, full avg10) from a /proc/pressure file in buffer[:length]."""
+        values = []
+        for kind in (b"some avg10=", b"full avg10="):
+            start = buffer.find(kind, 0, length)
+            if start < 0:
+                values.append(0.0)
+                continue
+            start += len(kind)
+            values.append(float(buffer[start:buffer.find(b" ", start, length)]))
+        return tuple(values)
+
+    def sample(self):
+        """Read every file, publish the new snapshot to the subscribers and return it."""
+        if not self._fds:
+            self.open()
+
+        pgpgout, pswpout = self.find_values(*self.read("vmstat"), self.vmstat_keys)
+        mem_total, mem_free, mem_available, swap_total, swap_free = self.find_values(
+            *self.read("meminfo"), self.meminfo_keys
+        )
+
+        buffer, length = self.read("loadavg")
+        load1 = load5 = load15 = 0.0
+        if length > 0:
+            # "0.52 0.58 0.59 1/467 12345"
+            load1, load5, load15 = [float(value) for value in buffer[:length].split()[:3]]
+
+        pressure = {}
+        for name in ("cpu", "memory", "io"):
+            buffer, length = self.read("pressure/" + name)
+            if length > 0:
+                pressure[name] = self.parse_pressure(buffer, length)
+
+        self.latest = HostStats(
+            time.time(),
+            pgpgout,
+            pswpout,
+            mem_total,
+            mem_free,
+            mem_available,
+            swap_total,
+            swap_free,
+            load1,
+            load5,
+            load15,
+            pressure,
+        )
+
+        for callback in list(self._subscribers):
+            try:
+                callback(self.latest)
+            except Exception:
+                self.logger.exception("host stats subscriber failed")
+        return self.latest
+
+    def stop(self):
+        self.stopping = True
+
+    async def start(self):
+        """Sample every interval seconds until stopped."""
+        self.open()
+        try:
+            while not self.stopping:
+                self.sample()
+                await asyncio.sleep(self.interval)
+        finally:
+            self.close()
+
+    def render_host(self):
+        """Return a report_pb2.RenderHost with the static inventory and the latest statistics."""
+        render_host = HardwareInventory.get().render_host()
+        stats = self.latest or self.sample()
+        render_host.free_mem = stats.mem_available or stats.mem_free
+        render_host.free_swap = stats.swap_free
+        # Load average in hundredths, as CueBot expects
+        render_host.load = int(stats.load1 * 100)
+        for name, (some, full) in stats.pressure.items():
+            render_host.attributes["pressure_{}_some".format(name)] = "{:.2f}".format(some)
+            render_host.attributes["pressure_{}_full".format(name)] = "{:.2f}".format(full)
+        return render_host
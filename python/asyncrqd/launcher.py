@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+"""
+A small forkserver that launches frames for the daemon.
+
+The daemon grows as it runs, and forking it for every frame copies its page
+tables, so launches get slower as its RSS grows. The launcher is started once
+at boot, imports nothing but the standard library and msgpack, and forks and
+execs frames on the daemon's behalf, so a launch costs the same however large
+the daemon gets.
+
+The two talk over a SOCK_SEQPACKET socketpair, one msgpack map per record:
+
+    daemon -> launcher  {"id": 7, "method": "launch", "command": [...], "env": {...},
+                         "cwd": ..., "nice": ..., "cpu_list": [...], "cgroup": ...}
+    launcher -> daemon  {"id": 7, "pid": 1234}  with the stdout, stderr and pidfd fds
+    launcher -> daemon  {"id": 7, "error": "..."}
+    launcher -> daemon  {"id": None, "event": "exit", "pid": 1234, "returncode": 0, "rusage": {...}}
+
+The fds go with their record as SCM_RIGHTS ancillary data. Frames are children
+of the launcher, which reaps them with wait4 and reports their exit and rusage.
+LauncherTransport makes a launched frame look like any asyncio subprocess to
+SubprocessProtocol.
+"""
+
+import array
+import asyncio
+import os
+import selectors
+import signal
+import socket
+import sys
+
+import msgpack
+
+
+MAX_RECORD_SIZE = 4 * 1024 * 1024
+
+rusage_fields = (
+    "ru_utime",
+    "ru_stime",
+    "ru_maxrss",
+    "ru_minflt",
+    "ru_majflt",
+    "ru_inblock",
+    "ru_oublock",
+    "ru_nvcsw",
+    "ru_nivcsw",
+)
+
+
+class LauncherException(RuntimeError):
+    """The launcher could not start a frame, or went away."""
+
+
+def pack(message):
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def recv_record(sock, maxfds):
+    """
+    Return (data, fds) for the next record on sock.
+
+    The fds are received close-on-exec, so they never leak into the processes
+    started after them. socket.recv_fds is not used as it ignores its flags.
+    """
+    fds = array.array("i")
+    data, ancdata, flags, address = sock.recvmsg(
+        MAX_RECORD_SIZE, socket.CMSG_LEN(maxfds * fds.itemsize), socket.MSG_CMSG_CLOEXEC
+    )
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    return data, list(fds)
+
+
+def unpack(data):
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+class ForkServer(object):
+    """The launcher side: fork and exec frames on request and report their exits."""
+
+    def __init__(self, sock):
+        """Constructor."""
+        self.sock = sock
+        self.selector = selectors.DefaultSelector()
+        # pidfd -> pid of every running frame
+        self.children = {}
+
+    def serve(self):
+        """Answer requests until the daemon closes its end, then wait for the running frames."""
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.send({"id": None, "event": "ready", "pid": os.getpid()})
+        connected = True
+        while connected or self.children:
+            for key, events in self.selector.select():
+                if key.fileobj is self.sock:
+                    connected = self.handle_request()
+                else:
+                    self.reap(key.fd)
+
+    def send(self, message, fds=()):
+        try:
+            socket.send_fds(self.sock, [pack(message)], list(fds))
+        except OSError:
+            # The daemon has gone; the frames are still reaped
+            pass
+
+    def handle_request(self):
+        """Handle one request; return False once the daemon has closed its end."""
+        try:
+            data, fds = recv_record(self.sock, 0)
+        except OSError:
+            data = b""
+        if not data:
+            self.selector.unregister(self.sock)
+            return False
+
+        # Nothing is ever passed to the launcher; do not leak what a bad request sent
+        for fd in fds:
+            os.close(fd)
+
+        message = None
+        try:
+            message = unpack(data)
+            if message.get("method") == "launch":
+                self.launch(message)
+            else:
+                self.send({"id": message.get("id"), "error": "unknown method: {}".format(message.get("method"))})
+        except Exception as e:
+            # A bad request or a failed fork must not take down the launcher
+            request_id = message.get("id") if isinstance(message, dict) else None
+            self.send({"id": request_id, "error": "{}: {}".format(type(e).__name__, e)})
+        return True
+
+    def launch(self, message):
+        pipes = []
+        try:
+            for i in range(3):
+                pipes.extend(os.pipe())
+            pid = os.fork()
+        except OSError:
+            for fd in pipes:
+                os.close(fd)
+            raise
+        stdout_r, stdout_w, stderr_r, stderr_w, error_r, error_w = pipes
+
+        if pid == 0:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            os.close(error_r)
+            self.exec_child(message, stdout_w, stderr_w, error_w, self.sock.fileno())
+
+        os.close(stdout_w)
+        os.close(stderr_w)
+        os.close(error_w)
+
+        # The error pipe is closed on exec, or carries the reason exec failed
+        error = b""
+        while True:
+            chunk = os.read(error_r, 4096)
+            if not chunk:
+                break
+            error += chunk
+        os.close(error_r)
+
+        if error:
+            os.waitpid(pid, 0)
+            os.close(stdout_r)
+            os.close(stderr_r)
+            self.send({"id": message.get("id"), "error": error.decode("utf-8", "replace")})
+            return
+
+        try:
+            pidfd = os.pidfd_open(pid)
+        except OSError:
+            # Without a pidfd the frame could be neither reported nor reaped
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            os.close(stdout_r)
+            os.close(stderr_r)
+            raise
+        self.children[pidfd] = pid
+        self.selector.register(pidfd, selectors.EVENT_READ)
+        self.send({"id": message.get("id"), "pid": pid}, (stdout_r, stderr_r, pidfd))
+        os.close(stdout_r)
+        os.close(stderr_r)
+
+    @staticmethod
+    def exec_child(message, stdout_w, stderr_w, error_w, control_fd):
+        """Set up the forked child and exec the frame's command; never returns."""
+        try:
+            # The frame must never see the daemon's control socket
+            os.close(control_fd)
+            for signum in (signal.SIGPIPE, signal.SIGXFSZ, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            os.setsid()
+
+            if message.get("cgroup"):
+                fd = os.open(os.path.join(message["cgroup"], "cgroup.procs"), os.O_WRONLY)
+                os.write(fd, b"0")
+                os.close(fd)
+            if message.get("nice"):
+                os.nice(message["nice"])
+            if message.get("cpu_list"):
+                os.sched_setaffinity(0, message["cpu_list"])
+
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(stdout_w, 1)
+            os.dup2(stderr_w, 2)
+            if message.get("cwd"):
+                os.chdir(message["cwd"])
+
+            command = message["command"]
+            env = message.get("env")
+            if env is None:
+                os.execvp(command[0], command)
+            os.execvpe(command[0], command, env)
+        except BaseException as e:
+            os.write(error_w, "{}: {}".format(type(e).__name__, e).encode("utf-8", "replace"))
+        finally:
+            os._exit(127)
+
+    def reap(self, pidfd):
+        pid = self.children.pop(pidfd)
+        self.selector.unregister(pidfd)
+        os.close(pidfd)
+        try:
+            pid, status, resources = os.wait4(pid, 0)
+        except ChildProcessError:
+            returncode = 255
+            rusage = None
+        else:
+            returncode = os.waitstatus_to_exitcode(status)
+            rusage = {field: getattr(resources, field) for field in rusage_fields}
+        self.send({"id": None, "event": "exit", "pid": pid, "returncode": returncode, "rusage": rusage})
+
+
+class LaunchedProcess(object):
+    """A frame started by the launcher: its pid, its output pipes, and a future for its exit."""
+
+    def __init__(self, pid, stdout, stderr, pidfd, exited):
+        """Constructor."""
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.pidfd = pidfd
+        # Resolves to {"returncode": ..., "rusage": {...}}
+        self.exited = exited
+
+    def send_signal(self, signum):
+        """Signal the frame through its pidfd, which cannot hit a reused pid."""
+        if self.pidfd is not None:
+            signal.pidfd_send_signal(self.pidfd, signum)
+
+    def close(self):
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+
+
+class LauncherClient(object):
+    """The daemon side: start the launcher and ask it to launch frames."""
+
+    def __init__(self):
+        """Constructor."""
+        self.process = None
+        self.sock = None
+        self._next_id = 0
+        self._pending = {}
+        self._running = {}
+        self._ready = None
+
+    async def start(self):
+        """Start the launcher and wait until it is ready; return self."""
+        loop = asyncio.get_running_loop()
+        self.sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.pathsep.join(
+            path for path in (package_root, env.get("PYTHONPATH")) if path
+        )
+
+        self._ready = loop.create_future()
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "asyncrqd.launcher", str(child_sock.fileno()),
+            pass_fds=(child_sock.fileno(),),
+            env=env,
+        )
+        child_sock.close()
+        self.sock.setblocking(False)
+        loop.add_reader(self.sock, self._on_readable)
+        await self._ready
+        return self
+
+    def _on_readable(self):
+        while True:
+            try:
+                # The pipes and pidfd are for the daemon only, not for the processes it starts
+                data, fds = recv_record(self.sock, 3)
+            except BlockingIOError:
+                return
+            except OSError:
+                data, fds = b"", []
+            if not data:
+                self._closed()
+                return
+            self.dispatch(unpack(data), fds)
+
+    def _closed(self):
+        asyncio.get_running_loop().remove_reader(self.sock)
+        error = LauncherException("launcher exited")
+        for future in list(self._pending.values()) + [launched.exited for launched in self._running.values()]:
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+        self._running.clear()
+        if not self._ready.done():
+            self._ready.set_exception(error)
+
+    def dispatch(self, message, fds):
+        request_id = message.get("id")
+        if request_id is None:
+            event = message.get("event")
+            if event == "ready":
+                self._ready.set_result(message)
+            elif event == "exit":
+                launched = self._running.pop(message["pid"], None)
+                if launched is not None and not launched.exited.done():
+                    launched.exited.set_result(message)
+            return
+
+        future = self._pending.pop(request_id, None)
+        if "error" in message:
+            for fd in fds:
+                os.close(fd)
+            if future is not None and not future.done():
+                future.set_exception(LauncherException(message["error"]))
+            return
+
+        # Registered here rather than by the waiting coroutine, as the exit
+        # event can be dispatched before that coroutine resumes
+        stdout, stderr, pidfd = fds
+        launched = LaunchedProcess(
+            message["pid"], stdout, stderr, pidfd, asyncio.get_running_loop().create_future()
+        )
+        self._running[launched.pid] = launched
+        if future is not None and not future.done():
+            future.set_result(launched)
+        else:
+            launched.close()
+
+    async def launch(self, command, env=None, cwd=None, nice=None, cpu_list=None, cgroup=None):
+        """Launch command and return a LaunchedProcess once it has been exec'd."""
+        loop = asyncio.get_running_loop()
+        self._next_id += 1
+        future = loop.create_future()
+        self._pending[self._next_id] = future
+        message = {
+            "id": self._next_id,
+            "method": "launch",
+            "command": list(command),
+            "env": env,
+            "cwd": cwd,
+            "nice": nice,
+            "cpu_list": sorted(cpu_list) if cpu_list else None,
+            "cgroup": cgroup,
+        }
+        await loop.sock_sendall(self.sock, pack(message))
+        return await future
+
+    async def close(self):
+        """Close the socket; the launcher exits once its running frames have."""
+        if self.sock is not None:
+            loop = asyncio.get_running_loop()
+            loop.remove_reader(self.sock)
+            self.sock.close()
+            self.sock = None
+        if self.process is not None:
+            await self.process.wait()
+
+
+class _PipeProtocol(asyncio.Protocol):
+
+    def __init__(self, transport, fd):
+        """Constructor."""
+        self.transport = transport
+        self.fd = fd
+
+    def data_received(self, data):
+        self.transport._protocol.pipe_data_received(self.fd, data)
+
+    def connection_lost(self, exc):
+        self.transport._pipe_lost(self.fd, exc)
+
+
+class LauncherTransport(asyncio.SubprocessTransport):
+    """An asyncio subprocess transport for a frame started by the launcher."""
+
+    def __init__(self, loop, protocol, launched):
+        """Constructor."""
+        super().__init__()
+        self._loop = loop
+        self._protocol = protocol
+        self._launched = launched
+        self._pipes = {}
+        self._open_pipes = set()
+        self._returncode = None
+        self._closed = False
+        # The rusage reported by the launcher, read by SubprocessProtocol.process_exited
+        self.rusage = None
+
+    @classmethod
+    async def create(cls, loop, protocol_factory, client, command, **kwargs):
+        """Launch command through client; return (transport, protocol) as subprocess_exec does."""
+        launched = await client.launch(command, **kwargs)
+        protocol = protocol_factory()
+        transport = cls(loop, protocol, launched)
+        await transport._connect()
+        return transport, protocol
+
+    async def _connect(self):
+        self._protocol.connection_made(self)
+        for fd, pipe_fd in ((1, self._launched.stdout), (2, self._launched.stderr)):
+            pipe = os.fdopen(pipe_fd, "rb", buffering=0)
+            transport, protocol = await self._loop.connect_read_pipe(
+                lambda fd=fd: _PipeProtocol(self, fd), pipe
+            )
+            self._pipes[fd] = transport
+            self._open_pipes.add(fd)
+        self._launched.exited.add_done_callback(self._exited)
+
+    def _pipe_lost(self, fd, exc):
+        self._open_pipes.discard(fd)
+        self._protocol.pipe_connection_lost(fd, exc)
+        self._try_finish()
+
+    def _exited(self, future):
+        if future.cancelled() or future.exception() is not None:
+            self._returncode = 255
+        else:
+            result = future.result()
+            self._returncode = result["returncode"]
+            self.rusage = result.get("rusage")
+        self._launched.close()
+        self._try_finish()
+
+    def _try_finish(self):
+        # Report the exit once all output has been read, as the protocol expects
+        if self._returncode is None or self._open_pipes or self._closed:
+            return
+        self._closed = True
+        self._protocol.process_exited()
+        self._protocol.connection_lost(None)
+
+    def get_pid(self):
+        return self._launched.pid
+
+    def get_returncode(self):
+        return self._returncode
+
+    def get_pipe_transport(self, fd):
+        return self._pipes.get(fd)
+
+    def send_signal(self, signal):
+        self._launched.send_signal(signal)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def is_closing(self):
+        return self._closed
+
+    def close(self):
+        for pipe in self._pipes.values():
+            pipe.close()
+
+
+def main():
+    # The daemon's Ctrl-C must not take the launcher down with it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Passed in with pass_fds, so it arrives inheritable; the frames must not inherit it
+    fd = int(sys.argv[1])
+    os.set_inheritable(fd, False)
+    sock = socket.socket(fileno=fd)
+    ForkServer(sock).serve()
+
+
+if __name__ == "__main__":
+    main()
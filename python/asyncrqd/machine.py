@@ -12,6 +12,7 @@ import psutil
 
 from . import config
 from . import log
+from .topology import HardwareInventory
 
 
 class Machine(object):
@@ -19,10 +20,18 @@ class Machine(object):
     logger = log.get_logger()
     PidData = collections.namedtuple("PidData", ("cpu_time", "wall_time", "percent_cpu"))
 
-    def __init__(self):
+    def __init__(self, proc_root=None):
         self.config = config.dot_notation()
         self.platform_name = platform.system().lower()
-        self.boot_time = psutil.boot_time()
+        self.proc_root = proc_root or self.config.machine.linux.proc_root or "/proc"
+        if self.platform_name == "linux":
+            # psutil reads every process and host value through this path
+            psutil.PROCFS_PATH = self.proc_root
+        if proc_root is None:
+            self.boot_time = HardwareInventory.get().boot_time
+        else:
+            # A synthetic proc root has a boot time of its own
+            self.boot_time = psutil.boot_time()
         self.pid_history = {}
 
     @functools.lru_cache(maxsize=1)
@@ -9,17 +9,50 @@ import os
 import random
 import sys
 import time
+import warnings
 
 from asyncrqd.proto import rqd_grpc
 from asyncrqd.proto import rqd_pb2
+from asyncrqd.proto import report_pb2
+from asyncio.log import logger
+from asyncio.unix_events import AbstractChildWatcher
 from asyncio.unix_events import SafeChildWatcher
 
+from asyncrqd import cgroup
 from asyncrqd import config
+from asyncrqd import launcher
 from asyncrqd import log
+from asyncrqd import sinks
+from asyncrqd.topology import parse_cpu_list
 
 from grpclib.client import Channel
 
 
+# The struct rusage fields kept from wait4 when a frame exits. ru_maxrss is in kB,
+# ru_inblock and ru_oublock count 512 byte blocks.
+rusage_fields = (
+    "ru_utime",
+    "ru_stime",
+    "ru_maxrss",
+    "ru_minflt",
+    "ru_majflt",
+    "ru_inblock",
+    "ru_oublock",
+    "ru_nvcsw",
+    "ru_nivcsw",
+)
+
+
+def rusage_to_dict(resources):
+    """Return the rusage_fields of a struct rusage as a dict, or an empty dict for None."""
+    if resources is None:
+        return {}
+    if isinstance(resources, dict):
+        # As reported by the launcher
+        return {field: resources[field] for field in rusage_fields if field in resources}
+    return {field: getattr(resources, field) for field in rusage_fields}
+
+
 class FailedSubProcessException(RuntimeError):
     """When a child process returns a non-zero exit code."""
 
@@ -30,25 +63,104 @@ class FailedSubProcessException(RuntimeError):
         RuntimeError.__init__(self, msg.format(pid, exitcode))
 
 
+def task_ids(pid, proc_root="/proc"):
+    """Return the thread ids of pid, or just pid if they cannot be listed."""
+    try:
+        return [int(tid) for tid in os.listdir(os.path.join(proc_root, str(pid), "task"))]
+    except (OSError, ValueError):
+        return [pid]
+
+
 class SubprocessOutputHandler(object):
-    def __init__(self, logfile=None, encoding=None):
+    """
+    Write the output of a child process to every connected file and websocket.
+
+    By default every line is written and flushed to every sink as it arrives. With
+    batch=True, the lines of each chunk read from the pipe are encoded and queued
+    together, and the queue goes to each sink in a single write once it holds
+    flush_size bytes or flush_interval seconds after the first queued line,
+    whichever comes first. Output from stdout and stderr shares one queue, so the
+    order of the lines is kept.
+
+    With queued=True, every file and websocket runs behind its own bounded
+    sinks.QueuedSink and writer task, so a slow sink never holds up the event loop
+    or the other sinks. overflow selects what a full queue does: "block" pauses
+    reading the child's pipes until the sink catches up, "drop_oldest" and "drop"
+    discard output and count it. sink_stats() returns the lag and drop counters.
+
+    With compress="gzip" or "zstd", logfile is written compressed by a
+    sinks.CompressedFileSink, which buffers and writes from a thread of its own.
+
+    The last tail_lines lines, at most tail_bytes, are also kept in a
+    sinks.TailBuffer as they arrive, so a frame's recent output can be served
+    without reading its log back; tail_lines=0 turns this off. attach_stream()
+    follows the output live from a byte offset through a sinks.LogStream.
+    """
+
+    def __init__(self, logfile=None, encoding=None, batch=False, flush_interval=None, flush_size=None,
+                 queued=False, queue_size=None, overflow=None, compress=None, tail_lines=None, tail_bytes=None):
         self.encoding = encoding or locale.getpreferredencoding(False)
         self._stdout = None
         self._stderr = None
         self._files = {}
         self._fh = {}
         self._ws = {}
+
+        output = config.dot_notation().daemon.output
+        self.batch = batch
+        self.flush_interval = flush_interval or (output and output.flush_interval) or 1.0
+        self.flush_size = flush_size or (output and output.flush_size) or 65536
+        self._pending = []
+        self._pending_size = 0
+        self._flush_handle = None
+        # Number of writes made to sinks, for benchmarks and inspection
+        self.writes = 0
+
+        self.queued = queued
+        self.queue_size = queue_size or (output and output.queue_size) or 1024
+        self.overflow = overflow or (output and output.overflow) or "block"
+        self._sinks = {}
+        self._paused_sinks = set()
+        self._flow_control = []
+        self._compressed = {}
+        self._streams = set()
+        self.stream_max_bytes = (output and output.stream_max_bytes) or 1048576
+
+        tail_lines = (output and output.tail_lines) if tail_lines is None else tail_lines
+        self.tail = None
+        if tail_lines:
+            self.tail = sinks.TailBuffer(tail_lines, tail_bytes or (output and output.tail_bytes) or 262144)
+
         if logfile is not None:
-            self.connect_file(logfile)
+            if compress:
+                self.connect_compressed_file(logfile, compress)
+            else:
+                self.connect_file(logfile)
 
     def connect_file(self, logfile):
         fh = open(logfile, "ab", buffering=0)
         key = self.connect_fh(fh)
         self._files[logfile] = (fh, key,)
 
-    def connect_fh(self, fh):
-        print(self._fh)
+    def connect_compressed_file(self, logfile, codec="gzip"):
+        """Write a compressed copy of the output to logfile, with the codec's suffix added."""
+        output = config.dot_notation().daemon.output
+        sink = sinks.CompressedFileSink(
+            logfile,
+            codec=codec,
+            level=output and output.compression_level,
+            block_size=(output and output.compression_block_size) or 1048576,
+            sync_interval=(output and output.compression_sync_interval) or 5.0,
+        )
+        self._compressed[logfile] = sink
+        return sink
+
+    def disconnect_compressed_file(self, logfile):
+        sink = self._compressed.pop(logfile, None)
+        if sink is not None:
+            sink.close()
 
+    def connect_fh(self, fh):
         _fh = os.fdopen(fh.fileno(), "wb", closefd=False)
         flushable = hasattr(_fh, 'flush')
 
@@ -57,6 +169,8 @@ class SubprocessOutputHandler(object):
         else:
             key = max([k for k in self._fh if isinstance(k, int)]) + 1
         self._fh[key] = (_fh, flushable)
+        if self.queued:
+            self._add_sink(("fh", key), sinks.FileSink(_fh, flushable))
         return key
 
     def connect_ws(self, ws):
@@ -65,38 +179,185 @@ class SubprocessOutputHandler(object):
         else:
             key = max([k for k in self._ws if isinstance(k, int)]) + 1
         self._ws[key] = ws
+        if self.queued:
+            self._add_sink(("ws", key), sinks.WebSocketSink(ws))
         return key
 
+    def _add_sink(self, key, sink):
+        self._sinks[key] = sinks.QueuedSink(
+            sink,
+            maxsize=self.queue_size,
+            policy=self.overflow,
+            name="{}:{}".format(*key),
+            on_pause=self._sink_paused,
+            on_resume=self._sink_resumed,
+        )
+
+    def _remove_sink(self, key):
+        queued_sink = self._sinks.pop(key, None)
+        if queued_sink is not None:
+            self._sink_resumed(queued_sink)
+            asyncio.ensure_future(queued_sink.close())
+
+    def add_flow_control(self, pause, resume):
+        """Register callables that pause and resume the producer for 'block' sinks."""
+        self._flow_control.append((pause, resume))
+
+    def _sink_paused(self, queued_sink):
+        if not self._paused_sinks:
+            for pause, resume in self._flow_control:
+                pause()
+        self._paused_sinks.add(queued_sink)
+
+    def _sink_resumed(self, queued_sink):
+        if queued_sink not in self._paused_sinks:
+            return
+        self._paused_sinks.discard(queued_sink)
+        if not self._paused_sinks:
+            for pause, resume in self._flow_control:
+                resume()
+
+    def attach_stream(self, offset=0, lines=None):
+        """
+        Return a sinks.LogStream following the output from offset, or None if no tail is kept.
+
+        With lines, the stream starts that many lines back from the end instead.
+        """
+        if self.tail is None:
+            return None
+        if lines:
+            offset, data = self.tail.tail(lines)
+        log_stream = sinks.LogStream(self.tail, offset, max_bytes=self.stream_max_bytes)
+        self._streams.add(log_stream)
+        return log_stream
+
+    def detach_stream(self, log_stream):
+        self._streams.discard(log_stream)
+        log_stream.close()
+
+    def _record(self, data):
+        """Keep data in the tail and pass it to live streams as soon as it arrives."""
+        if self.tail is None:
+            return
+        self.tail.write(data)
+        if self._streams:
+            offset = self.tail.end_offset - len(data)
+            for log_stream in self._streams:
+                log_stream.write(offset, data)
+
+    def sink_stats(self):
+        """Return a list of the counters of every queued and compressed sink."""
+        return (
+            [queued_sink.stats() for queued_sink in self._sinks.values()]
+            + [sink.stats() for sink in self._compressed.values()]
+        )
+
     def disconnect_fh(self, fh):
+        self._remove_sink(("fh", fh))
         return self._fh.pop(fh, None)
 
     def disconnect_file(self, logfile):
-        fh, key = self._files.pop(logfile, None)
-        self._files.pop(logfile, None)
-        self.disconnect_fh(fh)
+        fh, key = self._files.pop(logfile)
+        self.disconnect_fh(key)
 
     def stderr_write(self, line):
-        encoded_line = line.encode("utf-8")
-        for fh, flush in self._fh.values():
-            fh.write(encoded_line)
-            if flush:
-                fh.flush()
-        for ws in self._ws.values():
-            ws.sendMessage(encoded_line, False)
+        encoded_line = line.encode("utf-8") if isinstance(line, str) else line
+        self._record(encoded_line)
+        self._write(encoded_line)
         return encoded_line
 
     def stdout_write(self, line):
-        encoded_line = line.encode("utf-8")
+        encoded_line = line.encode("utf-8") if isinstance(line, str) else line
+        self._record(encoded_line)
+        self._write(encoded_line)
+        return encoded_line
+
+    def write_lines(self, lines):
+        """Queue the lines of one chunk of output, as bytes or str, and flush if a threshold is reached."""
+        data = b"".join(line.encode("utf-8") if isinstance(line, str) else line for line in lines)
+        # The tail and live streams get the data at once rather than when the batch is flushed
+        self._record(data)
+        self._pending.append(data)
+        self._pending_size += len(data)
+
+        if self._pending_size >= self.flush_size:
+            self.flush()
+        elif self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+            else:
+                self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+        return data
+
+    def flush(self):
+        """Write everything queued by write_lines to every sink in one write each."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+
+        data = b"".join(self._pending)
+        self._pending.clear()
+        self._pending_size = 0
+        self._write(data)
+
+    def _write(self, data):
+        # Compressed sinks only hand the data to their writer threads
+        for sink in self._compressed.values():
+            sink.write(data)
+
+        if self.queued:
+            for queued_sink in self._sinks.values():
+                queued_sink.put(data)
+            return
+
         for fh, flush in self._fh.values():
-            fh.write(encoded_line)
+            fh.write(data)
             if flush:
                 fh.flush()
+            self.writes += 1
         for ws in self._ws.values():
-            ws.sendMessage(encoded_line, False)
-        return encoded_line
+            ws.sendMessage(data, False)
+            self.writes += 1
 
     def close(self):
-        for fh in self._files.values():
+        self.flush()
+        for log_stream in self._streams:
+            log_stream.close()
+        if self._sinks or (self._compressed and self._loop_running()):
+            # The files are closed once the writers have drained their queues,
+            # and the compressed logs finished off the event loop
+            return asyncio.ensure_future(self.aclose())
+        self._close_files()
+
+    @staticmethod
+    def _loop_running():
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    async def aclose(self):
+        """Flush, wait for every queued sink to drain and every compressed log to finish, then close the files."""
+        self.flush()
+        for log_stream in self._streams:
+            log_stream.close()
+        queued_sinks = list(self._sinks.values())
+        self._sinks.clear()
+        await asyncio.gather(*(queued_sink.close() for queued_sink in queued_sinks))
+        compressed = list(self._compressed.values())
+        self._compressed.clear()
+        await asyncio.gather(*(sink.aclose() for sink in compressed))
+        self._close_files()
+
+    def _close_files(self):
+        for logfile in list(self._compressed):
+            self.disconnect_compressed_file(logfile)
+        for fh, key in self._files.values():
             try:
                 fh.close()
             except Exception:
@@ -104,19 +365,31 @@ class SubprocessOutputHandler(object):
 
 
 class SubprocessProtocol(asyncio.SubprocessProtocol):
-    """A minimal process protocol that processes lines of text output."""
+    """
+    A minimal process protocol that processes lines of output.
+
+    Output is split into lines as bytes and handed to the output handler without
+    being decoded, so a multi-byte character split across two reads is passed
+    through intact. Each read is appended to a per-pipe bytearray and only the new
+    bytes are searched for the line break. Once max_line_length bytes are buffered
+    without a line break, as with a progress bar redrawn with "\\r", they are
+    passed on as a line of their own so the buffer cannot grow without bound,
+    and complete lines longer than that are cut the same way.
+    """
+
+    logger = log.get_logger()
 
     STDIN = 0
     STDOUT = 1
     STDERR = 2
     _c = 0
 
-    def __init__(self, *args, loop=None, output_handler=None, linebreak="\n", **kwargs):
+    def __init__(self, *args, loop=None, output_handler=None, linebreak="\n", max_line_length=None, **kwargs):
         """Constructor."""
         asyncio.SubprocessProtocol.__init__(self, *args, **kwargs)
 
-        self._stdout = []
-        self._stderr = []
+        self._stdout = bytearray()
+        self._stderr = bytearray()
         self._buffers = {
             self.STDOUT: self._stdout,
             self.STDERR: self._stderr,
@@ -127,8 +400,10 @@ class SubprocessProtocol(asyncio.SubprocessProtocol):
             self.STDERR: self._handle_stderr,
         }
 
+        output = config.dot_notation().daemon.output
         self._output_handler = output_handler
-        self._linebreak = linebreak
+        self._linebreak = linebreak.encode("utf-8") if isinstance(linebreak, str) else linebreak
+        self._max_line_length = max_line_length or (output and output.max_line_length) or 65536
         self._exited = asyncio.Future(loop=loop)
         self._transport = None
         self._pid = None
@@ -143,22 +418,62 @@ class SubprocessProtocol(asyncio.SubprocessProtocol):
 
     def pipe_data_received(self, fd, data):
         """Process a chunk of stdout/stderr from the child process."""
-        data = data.decode(locale.getpreferredencoding(False))
-
         # Identify the correct buffer for the file descriptor
         buff = self._buffers[fd]
-        buff.append(data)
-
-        if not self._linebreak in data:
+        linebreak = self._linebreak
+
+        # Only the new bytes can hold a line break, allowing for one that
+        # straddles the end of the previous chunk
+        start = max(0, len(buff) - len(linebreak) + 1)
+        buff += data
+        end = buff.rfind(linebreak, start)
+
+        if end >= 0:
+            end += len(linebreak)
+            block = bytes(buff[:end])
+            del buff[:end]
+            self._dispatch(fd, block)
+
+        max_line_length = self._max_line_length
+        while len(buff) >= max_line_length:
+            block = bytes(buff[:max_line_length]) + linebreak
+            del buff[:max_line_length]
+            self._dispatch(fd, block)
+
+    def _split_lines(self, block):
+        """Return the lines of block without their line breaks, cut to max_line_length."""
+        lines = block.split(self._linebreak)
+        lines.pop()
+        max_line_length = self._max_line_length
+        if len(block) <= max_line_length + len(self._linebreak):
+            return lines
+        result = []
+        for line in lines:
+            if len(line) <= max_line_length:
+                result.append(line)
+            else:
+                result.extend(line[i:i + max_line_length] for i in range(0, len(line), max_line_length))
+        return result
+
+    def _dispatch(self, fd, block):
+        """Pass block, one or more complete lines, to the output handler."""
+        linebreak = self._linebreak
+        if self._output_handler.batch:
+            if len(block) > self._max_line_length + len(linebreak):
+                # Only a block this long can hold a line that has to be cut
+                block = linebreak.join(self._split_lines(block)) + linebreak
+            # One queued write for the whole chunk instead of one write per line
+            try:
+                self._output_handler.write_lines((block,))
+            except Exception as e:
+                self.logger.error("failed to handle lines", fd=fd, error=str(e))
             return
 
-        lines = "".join(buff).split(self._linebreak)
-        self._buffers[fd] = [lines.pop()]
-        for line in lines:
+        for line in self._split_lines(block):
             try:
-                self._handlers[fd](line + self._linebreak)
+                self._handlers[fd](line + linebreak)
             except Exception as e:
-                print("ERROR: failed to handle line on fh '{}': {}".format(fd, e))
+                self.logger.error("failed to handle line", fd=fd, error=str(e))
 
     def connection_made(self, transport):
         """When the child process is alive, store a transport attribute."""
@@ -166,11 +481,37 @@ class SubprocessProtocol(asyncio.SubprocessProtocol):
         self._transport = transport
         self._pid = transport.get_pid()
         self._start_time = time.monotonic()
-        print("CONNECTION MADE: {}".format(transport.get_pid()))
+        add_flow_control = getattr(self._output_handler, "add_flow_control", None)
+        if add_flow_control is not None:
+            add_flow_control(self.pause_reading, self.resume_reading)
+        self.logger.debug("connection made", pid=self._pid)
+
+    def _pipe_transports(self):
+        for fd in (self.STDOUT, self.STDERR):
+            pipe = self._transport.get_pipe_transport(fd)
+            if pipe is not None:
+                yield pipe
+
+    def pause_reading(self):
+        """Stop reading the child's output; it blocks once the pipe buffers fill."""
+        for pipe in self._pipe_transports():
+            pipe.pause_reading()
+
+    def resume_reading(self):
+        for pipe in self._pipe_transports():
+            pipe.resume_reading()
 
     def pipe_connection_lost(self, fd, exc=None):
         """The child process has closed stdout/stderr."""
-        print("CONNECTION CLOSED ({}): {} :: {}".format(self._count, fd, exc))
+        buff = self._buffers.get(fd)
+        if buff:
+            # Pass on a last line that had no line break
+            block = bytes(buff) + self._linebreak
+            buff.clear()
+            self._dispatch(fd, block)
+        if self._output_handler.batch:
+            self._output_handler.flush()
+        self.logger.debug("pipe closed", pid=self._pid, count=self._count, fd=fd, error=exc and str(exc))
 
     def _handle_stdout(self, line):
         """The child process printed a line to stdout."""
@@ -182,24 +523,63 @@ class SubprocessProtocol(asyncio.SubprocessProtocol):
 
     def process_exited(self):
         """The child process exited."""
+        if self._output_handler.batch:
+            self._output_handler.flush()
         exitcode = self._transport.get_returncode()
         self._real_time = time.monotonic() - self._start_time
+        # None if the child was reaped by a watcher that does not keep rusage
         resources = ResourceUsageSafeChildWatcher.watched_pids.pop(self._pid, None)
+        if resources is None:
+            resources = getattr(self._transport, "rusage", None)
+        rusage = rusage_to_dict(resources)
         self._exited.set_result(
             {
                 "exitcode": exitcode,
                 "realtime": self._real_time,
-                "utime": resources.ru_utime,
-                "stime": resources.ru_stime,
+                "utime": rusage.get("ru_utime"),
+                "stime": rusage.get("ru_stime"),
+                "rusage": rusage,
             }
         )
 
 
 class SubProcess(object):
+    """
+    A frame's command running as a child of the daemon, in a session of its own.
+
+    launch selects how the child is set up:
+
+        direct   the default: the child is started with start_new_session and no
+                 preexec_fn, so the fast spawn paths can be used and nothing runs
+                 between fork and exec. The parent then moves the child into its
+                 cgroup and sets its priority and cpu affinity with
+                 os.setpriority and os.sched_setaffinity on every thread.
+        preexec  the original path: preexec_fn does all of that in the child
+                 between fork and exec, running /usr/bin/taskset for affinity.
+        launcher the frame is forked from the small launcher process started at
+                 boot, see launcher.py, which sets everything up in the child
+                 before exec. Set SubProcess.launcher_client to its client.
+
+    The direct path has a short race: the new program runs for as long as the
+    parent takes to apply the settings, normally well under a millisecond, with
+    the daemon's priority and affinity and outside the frame's cgroup. Threads
+    it starts in that window are covered, but processes it forks in it are not.
+    """
+
+    logger = log.get_logger()
 
     _count = 0
 
-    def __init__(self, command, soh, cwd=None, env=None, nice=None, cpu_list_arg=None):
+    launch_modes = ("direct", "preexec", "launcher")
+
+    # The launcher.LauncherClient used by the launcher mode
+    launcher_client = None
+
+    # Running processes keyed on the frame id they were started for
+    by_frame_id = {}
+
+    def __init__(self, command, soh, cwd=None, env=None, nice=None, cpu_list_arg=None, use_cgroup=True,
+                 frame_id=None, launch=None):
         self.exitcode = None
         self.transport = None
         self.protocol = None
@@ -210,13 +590,39 @@ class SubProcess(object):
         self.env = env
         self.command = command
         self.cpu_list_arg = cpu_list_arg
+        self.use_cgroup = use_cgroup
+        self.cgroup = None
+        self.frame_id = frame_id
+        # The RunFrame the process runs, and the sampler's last usage of its session
+        # as a ProcessDataPoint.to_dict() dict, both set by FrameManager
+        self.run_frame = None
+        self.usage = None
+        dn = config.dot_notation()
+        launch_config = dn.daemon.launch
+        self.launch = launch or (launch_config and launch_config.mode) or "direct"
+        self.proc_root = (dn.machine.linux and dn.machine.linux.proc_root) or "/proc"
+        if self.launch not in self.launch_modes:
+            raise ValueError("unknown launch mode: {}".format(self.launch))
         self.stime = None
         self.utime = None
         self.realtime = None
+        self.rusage = {}
         self._starttime = None
 
         self.id = SubProcess.next_id()
 
+    @classmethod
+    def get(cls, frame_id):
+        """Return the running SubProcess for frame_id, or None."""
+        return cls.by_frame_id.get(frame_id)
+
+    def tail(self, lines=None, max_bytes=None):
+        """Return (offset, data) for the most recent output, or None if it is not kept."""
+        tail = self.output_handler.tail
+        if tail is None:
+            return None
+        return tail.tail(lines, max_bytes)
+
     @classmethod
     def next_id(cls):
         """Return a unique integer ID for this process."""
@@ -229,6 +635,7 @@ class SubProcess(object):
         This method is run in the child process immediately after fork and before exec.
 
         This gives us an opportunity to:
+         - move the child process into the frame's cgroup
          - re-nice the child process
          - taskset the child process
          - create a new process group for the child process
@@ -241,6 +648,13 @@ class SubProcess(object):
         to stdout for the parent process to capture and log it.
         """
 
+        try:
+            if self.cgroup is not None:
+                self.cgroup.attach()
+        except Exception as e:
+            result = str(e)
+            print("failed to attach to cgroup {}: {}".format(self.cgroup, result))
+
         try:
             if self.nice:
                 os.nice(self.nice)
@@ -265,27 +679,179 @@ class SubProcess(object):
 
         os.setsid()
 
+    def apply_settings(self, pid):
+        """
+        Move pid into the frame's cgroup and set its priority and cpu affinity from the parent.
+
+        nice is relative to the daemon's own priority, as os.nice in the child
+        would be. Priority and affinity are per thread on Linux, so every thread
+        of pid is set, as taskset --all-tasks does.
+        """
+        if self.cgroup is not None:
+            try:
+                self.cgroup.attach(pid)
+            except OSError as e:
+                self.logger.warning("failed to attach to cgroup", pid=pid, cgroup=str(self.cgroup), error=str(e))
+
+        tids = task_ids(pid, self.proc_root) if self.nice or self.cpu_list_arg else []
+
+        if self.nice:
+            priority = min(19, os.getpriority(os.PRIO_PROCESS, 0) + self.nice)
+            for tid in tids:
+                try:
+                    os.setpriority(os.PRIO_PROCESS, tid, priority)
+                except ProcessLookupError:
+                    # The thread or the whole frame has already exited
+                    pass
+                except OSError as e:
+                    self.logger.warning("failed to set priority", pid=pid, tid=tid, priority=priority, error=str(e))
+
+        if self.cpu_list_arg:
+            try:
+                cpus = parse_cpu_list(self.cpu_list_arg)
+            except ValueError as e:
+                self.logger.warning("failed to parse cpu list", pid=pid, cpu_list=self.cpu_list_arg, error=str(e))
+                return
+            for tid in tids:
+                try:
+                    os.sched_setaffinity(tid, cpus)
+                except ProcessLookupError:
+                    pass
+                except OSError as e:
+                    self.logger.warning(
+                        "failed to set affinity", pid=pid, tid=tid, cpu_list=self.cpu_list_arg, error=str(e)
+                    )
+
     def spawn(self, loop, soh):
+        """
+        Start the command and return a coroutine that waits for it to finish.
+
+        This runs loop until the process has started, so it cannot be used from
+        a coroutine; await start() there instead.
+        """
+        loop.run_until_complete(self.start(loop, soh))
+        return self.handle_subprocess_exception(self.protocol.finished)
+
+    async def start(self, loop=None, soh=None):
+        """
+        Start the command and return as soon as it is running.
+
+        With use_cgroup, the frame is placed in its own cgroup v2 leaf, which is
+        left in self.cgroup for the sampler; pass it to ProcRaider.watch_session.
+        If cgroups are unavailable self.cgroup is None and the frame is sampled
+        by walking /proc as before. Await wait() for the process to finish.
+        """
+        loop = loop or asyncio.get_running_loop()
+        soh = soh or self.output_handler
         self.loop = loop
-        command = ["/usr/bin/time", "-p", "-o", "/tmp/donaltimetest.{}".format(self.id)] + self.command
+        if self.use_cgroup and self.cgroup is None:
+            self.cgroup = cgroup.FrameCgroup.create("frame-{}".format(self.id))
+        command = self.command
 
         def sp_closure():
             return SubprocessProtocol(loop=loop, output_handler=soh)
 
-        transports = loop.run_until_complete(
-            loop.subprocess_exec(sp_closure, *command, restore_signals=True, preexec_fn=self.preexec_fn, cwd=self.cwd, env=self.env)
-        )
-        self.transport = transports[0]
-        self.protocol = self.transport.get_protocol()
+        if self.launch == "launcher":
+            transports = await self._launch_with_launcher(loop, sp_closure)
+        else:
+            if self.launch == "preexec":
+                options = {"preexec_fn": self.preexec_fn}
+            else:
+                options = {"start_new_session": True}
+
+            transports = await loop.subprocess_exec(
+                sp_closure, *command, restore_signals=True, cwd=self.cwd, env=self.env, **options
+            )
+        # A child that exits at once may have closed the transport already,
+        # and a closed transport no longer knows its protocol
+        self.transport, self.protocol = transports
+        if self.launch == "direct":
+            self.apply_settings(self.transport.get_pid())
+        if self.frame_id is not None:
+            SubProcess.by_frame_id[self.frame_id] = self
         self.protocol.finished.add_done_callback(self._done)
+        return self
+
+    async def _launch_with_launcher(self, loop, protocol_factory):
+        if SubProcess.launcher_client is None:
+            raise RuntimeError("the launcher has not been started")
+        return await launcher.LauncherTransport.create(
+            loop,
+            protocol_factory,
+            SubProcess.launcher_client,
+            self.command,
+            env=dict(self.env) if self.env is not None else None,
+            cwd=self.cwd,
+            nice=self.nice,
+            cpu_list=parse_cpu_list(self.cpu_list_arg) if self.cpu_list_arg else None,
+            cgroup=self.cgroup.path if self.cgroup is not None else None,
+        )
+
+    @property
+    def pid(self):
+        return self.transport.get_pid() if self.transport is not None else None
+
+    def wait(self):
+        """Return a coroutine that waits for the started process to finish."""
         return self.handle_subprocess_exception(self.protocol.finished)
 
     def _done(self, fu):
+        if self.frame_id is not None and SubProcess.by_frame_id.get(self.frame_id) is self:
+            del SubProcess.by_frame_id[self.frame_id]
         result = fu.result()
         self.exitcode = result.get("exitcode")
         self.realtime = result.get("realtime")
         self.utime = result.get("utime")
         self.stime = result.get("stime")
+        self.rusage = result.get("rusage") or {}
+        if self.cgroup is not None:
+            if not self.rusage:
+                self.rusage = self.cgroup_rusage()
+                self.utime = self.rusage.get("ru_utime")
+                self.stime = self.rusage.get("ru_stime")
+            self.cgroup.remove()
+
+    def cgroup_rusage(self):
+        """
+        Return what the frame's cgroup can tell of its rusage, for when wait4 was not ours to call.
+
+        This covers cpu times and peak memory, for every process of the frame.
+        """
+        counters = self.cgroup.read() if self.cgroup is not None else None
+        if not counters:
+            return {}
+        rusage = {
+            "ru_utime": counters["user_usec"] / 1e6,
+            "ru_stime": counters["system_usec"] / 1e6,
+        }
+        if counters["memory.peak"]:
+            rusage["ru_maxrss"] = counters["memory.peak"] // 1024
+        return rusage
+
+    def frame_complete_report(self, host=None, frame=None):
+        """
+        Return a report_pb2.FrameCompleteReport for the finished process.
+
+        frame is the RunningFrameInfo to report on, a new one by default. The
+        rusage of the frame is added to its attributes under the struct rusage
+        field names, as strings, and ru_maxrss also sets max_rss if it is higher.
+        """
+        frame = frame if frame is not None else report_pb2.RunningFrameInfo()
+        for field, value in self.rusage.items():
+            frame.attributes[field] = str(value)
+        frame.max_rss = max(frame.max_rss, self.rusage.get("ru_maxrss", 0))
+
+        # A negative returncode is the signal that killed the process
+        exitcode = self.exitcode if self.exitcode is not None else 0
+        report = report_pb2.FrameCompleteReport(
+            frame=frame,
+            exit_status=exitcode if exitcode >= 0 else 128 - exitcode,
+            exit_signal=-exitcode if exitcode < 0 else 0,
+            run_time=int(self.realtime or 0),
+        )
+        if host is not None:
+            report.host.CopyFrom(host)
+        return report
 
     async def handle_subprocess_exception(self, coro):
         try:
@@ -318,6 +884,7 @@ class ResourceUsageSafeChildWatcher(SafeChildWatcher):
             # (may happen if waitpid() is called elsewhere).
             pid = expected_pid
             returncode = 255
+            resources = None
             logger.warning(
                 "Unknown child process pid %d, will report returncode 255",
                 pid)
@@ -326,7 +893,7 @@ class ResourceUsageSafeChildWatcher(SafeChildWatcher):
                 # The child process is still alive.
                 return
 
-            returncode = self._compute_returncode(status)
+            returncode = os.waitstatus_to_exitcode(status)
             if self._loop.get_debug():
                 logger.debug('process %s exited with returncode %s',
                              expected_pid, returncode)
@@ -343,3 +910,124 @@ class ResourceUsageSafeChildWatcher(SafeChildWatcher):
                                pid, exc_info=True)
         else:
             callback(pid, returncode, *args)
+
+
+class PidfdResourceUsageChildWatcher(AbstractChildWatcher):
+    """
+    Child watcher that waits on a pidfd per child and reports resource usage.
+
+    Each child's pidfd (Linux 5.3 or later) is registered with the loop, which
+    wakes only for the child that exited, and only that child is reaped with
+    os.wait4. The SafeChildWatcher alternative above calls wait4 for every
+    child on every SIGCHLD, which costs more the more frames are running.
+
+    Only the public loop.add_reader is used, so the watcher works with any
+    loop. uvloop does not use child watchers for subprocess_exec though: libuv
+    reaps those children itself and their rusage is lost, so SubProcess falls
+    back on the frame's cgroup counters. Child watchers are deprecated from
+    Python 3.12 on, see install_child_watcher.
+    """
+
+    watched_pids = ResourceUsageSafeChildWatcher.watched_pids
+
+    def __init__(self):
+        """Constructor."""
+        self._loop = None
+        self._callbacks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+    def is_active(self):
+        return self._loop is not None and self._loop.is_running()
+
+    def close(self):
+        self.attach_loop(None)
+
+    def attach_loop(self, loop):
+        if self._loop is not None and loop is None and self._callbacks:
+            logger.warning("A loop is being detached from a child watcher with pending handlers")
+        for pidfd, callback, args in self._callbacks.values():
+            self._loop.remove_reader(pidfd)
+            os.close(pidfd)
+        self._callbacks.clear()
+        self._loop = loop
+
+    def add_child_handler(self, pid, callback, *args):
+        existing = self._callbacks.get(pid)
+        if existing is not None:
+            self._callbacks[pid] = existing[0], callback, args
+            return
+
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            # Reaped by someone else before we could watch it
+            logger.warning("Unknown child process pid %d, will report returncode 255", pid)
+            self._loop.call_soon(callback, pid, 255, *args)
+            return
+        self._loop.add_reader(pidfd, self._do_wait, pid)
+        self._callbacks[pid] = pidfd, callback, args
+
+    def remove_child_handler(self, pid):
+        try:
+            pidfd, callback, args = self._callbacks.pop(pid)
+        except KeyError:
+            return False
+        self._loop.remove_reader(pidfd)
+        os.close(pidfd)
+        return True
+
+    def _do_wait(self, pid):
+        pidfd, callback, args = self._callbacks.pop(pid)
+        self._loop.remove_reader(pidfd)
+        os.close(pidfd)
+
+        try:
+            # The pidfd is readable once the child has exited, so this does not block
+            pid, status, resources = os.wait4(pid, 0)
+        except ChildProcessError:
+            returncode = 255
+            resources = None
+            logger.warning("Unknown child process pid %d, will report returncode 255", pid)
+        else:
+            returncode = os.waitstatus_to_exitcode(status)
+
+        self.watched_pids[pid] = resources
+        callback(pid, returncode, *args)
+
+
+def pidfd_supported():
+    """Return True if os.pidfd_open is available and works on this kernel."""
+    if not hasattr(os, "pidfd_open"):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return False
+    return True
+
+
+def install_child_watcher(loop):
+    """
+    Attach a child watcher that keeps rusage to loop and return it.
+
+    This is the pidfd watcher where the kernel supports it and the SafeChildWatcher
+    alternative otherwise. uvloop reaps its own children, so nothing is installed
+    for it and None is returned.
+    """
+    if type(loop).__module__.startswith("uvloop"):
+        return None
+    if pidfd_supported():
+        child_watcher = PidfdResourceUsageChildWatcher()
+    else:
+        child_watcher = ResourceUsageSafeChildWatcher()
+    child_watcher.attach_loop(loop)
+    with warnings.catch_warnings():
+        # set_child_watcher is deprecated from Python 3.12 on
+        warnings.simplefilter("ignore", DeprecationWarning)
+        asyncio.set_child_watcher(child_watcher)
+    return child_watcher
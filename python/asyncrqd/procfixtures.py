@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+"""
+Recorded and synthetic /proc fixtures for exercising the ProcRaider parsers.
+
+A fixture is a list of (pid, stat_line, status_block) records. Records can be
+recorded from a live /proc once and saved, or taken from the built-in templates,
+and then scaled to any number of pids by cloning them under new pids, so the
+parsers can be measured at scale without touching the live /proc.
+
+Fixture files use the same layout as the output of bin/proc_directory_reader:
+every stat line, a blank line, then every status block. That means the output of
+the reader script itself can be saved and loaded as a fixture.
+
+SyntheticProcTree goes one step further and writes a whole fake proc root to a
+temporary directory, which ProcRaider.set_proc_root and Machine(proc_root=...)
+can then be pointed at.
+"""
+
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+
+SEPARATOR = "\n\n\n"
+
+# Status fields whose values are pids, remapped when records are cloned
+STATUS_PID_FIELDS = ("Tgid", "Pid", "PPid", "NStgid", "NSpid", "NSpgid", "NSsid")
+
+# Positions of ppid, pgrp and session in the stat fields that follow the ")"
+# closing the comm field; position 0 is empty and position 1 is the state
+STAT_PID_FIELDS = (2, 3, 4)
+
+STAT_TEMPLATE = (
+    "{pid} ({name}) {state} {ppid} {session} {session} 0 -1 4194304 {minflt} 0 12 0 "
+    "{utime} {stime} {cutime} {cstime} 20 {nice} {threads} 0 {start_time} {vsize} {rss} "
+    "18446744073709551615 94047905095680 94047905115561 140732752715680 0 0 0 0 0 0 0 0 0 17 "
+    "{cpu} 0 0 0 0 0 94047905131568 94047905133184 94048950124544 140732752717035 "
+    "140732752717055 140732752717055 140732752719851 0"
+)
+
+STATUS_TEMPLATE = """Name:\t{name}
+Umask:\t0022
+State:\t{state_long}
+Tgid:\t{pid}
+Ngid:\t0
+Pid:\t{pid}
+PPid:\t{ppid}
+TracerPid:\t0
+Uid:\t1000\t1000\t1000\t1000
+Gid:\t1000\t1000\t1000\t1000
+FDSize:\t64
+Groups:\t1000
+NStgid:\t{pid}
+NSpid:\t{pid}
+NSpgid:\t{session}
+NSsid:\t{session}
+Kthread:\t0
+VmPeak:\t{vm_peak:>8} kB
+VmSize:\t{vm_size:>8} kB
+VmLck:\t       0 kB
+VmPin:\t       0 kB
+VmHWM:\t{vm_hwm:>8} kB
+VmRSS:\t{vm_rss:>8} kB
+RssAnon:\t{vm_rss:>8} kB
+RssFile:\t       0 kB
+RssShmem:\t       0 kB
+VmData:\t{vm_size:>8} kB
+VmStk:\t     132 kB
+VmExe:\t      20 kB
+VmLib:\t    1528 kB
+VmPTE:\t      44 kB
+VmSwap:\t       0 kB
+HugetlbPages:\t       0 kB
+CoreDumping:\t0
+THP_enabled:\t1
+untag_mask:\t0xffffffffffffffff
+Threads:\t{threads}
+SigQ:\t0/1030021
+SigPnd:\t0000000000000000
+ShdPnd:\t0000000000000000
+SigBlk:\t0000000000000000
+SigIgn:\t0000000000000000
+SigCgt:\t0000000000000000
+CapInh:\t0000000000000000
+CapPrm:\t0000000000000000
+CapEff:\t0000000000000000
+CapBnd:\t000001ffffffffff
+CapAmb:\t0000000000000000
+NoNewPrivs:\t0
+Seccomp:\t0
+Seccomp_filters:\t0
+Speculation_Store_Bypass:\tthread vulnerable
+SpeculationIndirectBranch:\tconditional enabled
+Cpus_allowed:\tffffffff,ffffffff,ffffffff,ffffffff
+Cpus_allowed_list:\t0-127
+Mems_allowed:\t00000000,00000003
+Mems_allowed_list:\t0-1
+voluntary_ctxt_switches:\t{voluntary}
+nonvoluntary_ctxt_switches:\t{nonvoluntary}"""
+
+# A frame-shaped process mix: a wrapper shell, a threaded renderer and a helper
+TEMPLATE_PROCESSES = (
+    {"name": "bash", "state": "S", "state_long": "S (sleeping)", "threads": 1, "rss": 900, "vsize": 12943360},
+    {"name": "renderer", "state": "R", "state_long": "R (running)", "threads": 64, "rss": 4194304, "vsize": 34359738368},
+    {"name": "(sd-pam) helper", "state": "S", "state_long": "S (sleeping)", "threads": 2, "rss": 2100, "vsize": 104857600},
+)
+
+
+def template_record(pid, ppid, session, process, counter=0):
+    """Return a (pid, stat_line, status_block) record built from the templates."""
+    values = dict(
+        process,
+        pid=pid,
+        ppid=ppid,
+        session=session,
+        minflt=1000 + counter,
+        utime=5000 + counter * 7,
+        stime=300 + counter,
+        cutime=counter % 11,
+        cstime=counter % 5,
+        nice=10,
+        start_time=180000 + counter,
+        cpu=counter % 128,
+        vm_peak=process["vsize"] // 1024,
+        vm_size=process["vsize"] // 1024,
+        vm_hwm=process["rss"] * 4,
+        vm_rss=process["rss"] * 4,
+        voluntary=counter * 3,
+        nonvoluntary=counter,
+    )
+    return pid, STAT_TEMPLATE.format(**values), STATUS_TEMPLATE.format(**values)
+
+
+IO_TEMPLATE = """rchar: {rchar}
+wchar: {wchar}
+syscr: {syscr}
+syscw: {syscw}
+read_bytes: {read_bytes}
+write_bytes: {write_bytes}
+cancelled_write_bytes: 0
+"""
+
+STATM_TEMPLATE = "{pages} {rss} 250 5 0 {pages} 0\n"
+
+ROOT_STAT_TEMPLATE = """cpu  {user} 0 {system} {idle} 0 0 0 0 0 0
+cpu0 {user} 0 {system} {idle} 0 0 0 0 0 0
+intr 0
+ctxt {ctxt}
+btime {btime}
+processes {processes}
+procs_running 1
+procs_blocked 0
+softirq 0 0 0 0 0 0 0 0 0 0 0
+"""
+
+
+def template_records():
+    """Return one frame's worth of records built from TEMPLATE_PROCESSES."""
+    session = 1000
+    records = []
+    for index, process in enumerate(TEMPLATE_PROCESSES):
+        pid = session + index
+        ppid = 1 if pid == session else session
+        records.append(template_record(pid, ppid, session, process, counter=index))
+    return records
+
+
+def read_text(filepath):
+    try:
+        with open(filepath, "r") as fh:
+            return fh.read().strip()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+
+def record(proc_root="/proc"):
+    """Return a list of records for every process currently in proc_root."""
+    records = []
+    with os.scandir(proc_root) as entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            stat_line = read_text(entry.path + "/stat")
+            status_block = read_text(entry.path + "/status")
+            if stat_line and status_block:
+                records.append((int(entry.name), stat_line, status_block))
+    return records
+
+
+def render(records):
+    """Return (stat_text, status_text) for records, as proc_directory_reader prints them."""
+    stat_text = "\n".join(stat_line for pid, stat_line, status_block in records) + "\n"
+    status_text = "\n".join(status_block for pid, stat_line, status_block in records) + "\n"
+    return stat_text, status_text
+
+
+def save(filepath, records):
+    """Write records to filepath in the proc_directory_reader layout."""
+    stat_text, status_text = render(records)
+    with open(filepath, "w") as fh:
+        fh.write(stat_text + SEPARATOR + status_text)
+
+
+def load(filepath):
+    """Return the records in a fixture file, pairing stat lines and status blocks on pid."""
+    with open(filepath, "r") as fh:
+        stat_text, status_text = fh.read().split(SEPARATOR, 1)
+
+    stat_lines = {}
+    for line in stat_text.strip().split("\n"):
+        if line.strip():
+            stat_lines[int(line.split(" ", 1)[0])] = line
+
+    records = []
+    for block in re.split(r"\n(?=Name:)", status_text.strip()):
+        pid = int(re.search(r"\nPid:\s+(\d+)\n", block).group(1))
+        if pid in stat_lines:
+            records.append((pid, stat_lines[pid], block))
+    return records
+
+
+def remap_stat(stat_line, pid_map):
+    """Return stat_line with its pid, ppid, pgrp and session remapped through pid_map."""
+    head, comm_end, tail = stat_line.rpartition(")")
+    pid, comm = head.split(" ", 1)
+    fields = tail.split(" ")
+    for index in STAT_PID_FIELDS:
+        value = int(fields[index])
+        fields[index] = str(pid_map.get(value, value))
+    return "{} {}){}".format(pid_map[int(pid)], comm, " ".join(fields))
+
+
+def remap_status(status_block, pid_map):
+    """Return status_block with its pid fields remapped through pid_map."""
+    lines = status_block.split("\n")
+    for index, line in enumerate(lines):
+        key, separator, value = line.partition(":\t")
+        if key in STATUS_PID_FIELDS:
+            values = [str(pid_map.get(int(v), int(v))) for v in value.split("\t")]
+            lines[index] = key + separator + "\t".join(values)
+    return "\n".join(lines)
+
+
+def scale(records, count, first_pid=1000):
+    """
+    Return count records cloned from records under new, unique pids.
+
+    Each full pass over records is one generation with its own pid range. Pid
+    references inside a generation (parents, sessions) point at the clones from the
+    same generation, so session fan-out is preserved; references to pids outside
+    the recorded set, such as init, are left unchanged.
+    """
+    records = sorted(records)
+    size = len(records)
+    scaled = []
+    for generation in range((count + size - 1) // size):
+        base = first_pid + generation * size
+        pid_map = {pid: base + index for index, (pid, stat_line, status_block) in enumerate(records)}
+        for pid, stat_line, status_block in records:
+            if len(scaled) == count:
+                break
+            scaled.append((
+                pid_map[pid],
+                remap_stat(stat_line, pid_map),
+                remap_status(status_block, pid_map),
+            ))
+    return scaled
+
+
+class SyntheticProcTree(object):
+    """
+    A fake proc root in a temporary directory, shaped like a busy render node.
+
+    The tree holds sessions frame sessions of processes processes each, plus
+    background processes in sessions of their own. Within a session every process
+    is parented to the one fanout places before it, so fanout=1 builds one deep
+    chain and a large fanout builds a flat tree under the leader. Every process
+    gets threads entries under task/, but only the thread group leaders are listed
+    in the root, as in the real /proc.
+
+    Each pid directory holds stat, status, io and statm, and the root holds a stat
+    file with btime. advance() moves the cpu, context switch and io counters on by
+    one tick, and churn() replaces a fraction of the frame processes with new pids,
+    so consecutive snapshots look like a live host.
+    """
+
+    def __init__(self, sessions=10, processes=10, background=100, threads=1, fanout=None,
+                 first_pid=1000, root=None, seed=0):
+        """Constructor."""
+        self.sessions = sessions
+        self.processes = processes
+        self.background = background
+        self.threads = threads
+        self.fanout = fanout or processes
+        self.root = root or tempfile.mkdtemp(prefix="asyncrqd-proc-")
+        self.random = random.Random(seed)
+        self.btime = int(time.time()) - 86400
+        self.counter = 0
+        self.next_pid = first_pid
+        # pid -> (ppid, session, process template)
+        self.pids = {}
+        self.session_leaders = []
+        self.build()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+    def allocate_pid(self):
+        pid = self.next_pid
+        # Threads take pids from the same space, like real tids
+        self.next_pid += self.threads
+        return pid
+
+    def build(self):
+        """Lay out the sessions and background processes and write the whole tree."""
+        background_processes = (TEMPLATE_PROCESSES[0], TEMPLATE_PROCESSES[2])
+        for index in range(self.background):
+            pid = self.allocate_pid()
+            self.pids[pid] = (1, pid, background_processes[index % 2])
+
+        for index in range(self.sessions):
+            leader = self.allocate_pid()
+            self.session_leaders.append(leader)
+            members = [leader]
+            self.pids[leader] = (1, leader, TEMPLATE_PROCESSES[0])
+            for member in range(1, self.processes):
+                pid = self.allocate_pid()
+                ppid = members[max(0, member - self.fanout)]
+                members.append(pid)
+                self.pids[pid] = (ppid, leader, TEMPLATE_PROCESSES[1 + member % 2])
+
+        self.write_root_stat()
+        for pid in self.pids:
+            self.write_pid(pid)
+
+    def tids(self, pid):
+        """Return the thread ids of pid; the first is pid itself."""
+        return range(pid, pid + self.threads)
+
+    def write_file(self, filepath, text):
+        with open(filepath, "w") as fh:
+            fh.write(text)
+
+    def write_root_stat(self):
+        ticks = self.counter + 1
+        self.write_file(os.path.join(self.root, "stat"), ROOT_STAT_TEMPLATE.format(
+            user=ticks * 70,
+            system=ticks * 9,
+            idle=ticks * 100,
+            ctxt=ticks * 1000,
+            btime=self.btime,
+            processes=self.next_pid,
+        ))
+
+    def write_pid(self, pid):
+        """Write every file for pid, creating its directories on first use."""
+        ppid, session, process = self.pids[pid]
+        counter = self.counter + pid % 97
+        pid_path = os.path.join(self.root, str(pid))
+        task_path = os.path.join(pid_path, "task")
+        if not os.path.isdir(pid_path):
+            os.mkdir(pid_path)
+            os.mkdir(task_path)
+            for tid in self.tids(pid):
+                os.mkdir(os.path.join(task_path, str(tid)))
+
+        process = dict(process, threads=self.threads)
+        pid, stat_line, status_block = template_record(pid, ppid, session, process, counter=counter)
+        self.write_file(os.path.join(pid_path, "stat"), stat_line + "\n")
+        self.write_file(os.path.join(pid_path, "status"), status_block + "\n")
+        self.write_file(os.path.join(pid_path, "io"), IO_TEMPLATE.format(
+            rchar=counter * 8192,
+            wchar=counter * 4096,
+            syscr=counter * 2,
+            syscw=counter,
+            read_bytes=counter * 4096,
+            write_bytes=counter * 512,
+        ))
+        self.write_file(os.path.join(pid_path, "statm"), STATM_TEMPLATE.format(
+            pages=process["vsize"] // 4096, rss=process["rss"]
+        ))
+        for tid in self.tids(pid):
+            tid_stat = stat_line.replace(str(pid), str(tid), 1)
+            self.write_file(os.path.join(task_path, str(tid), "stat"), tid_stat + "\n")
+
+    def remove_pid(self, pid):
+        del self.pids[pid]
+        shutil.rmtree(os.path.join(self.root, str(pid)), ignore_errors=True)
+
+    def advance(self):
+        """Move every counter on by one tick and rewrite the tree."""
+        self.counter += 1
+        self.write_root_stat()
+        for pid in self.pids:
+            self.write_pid(pid)
+
+    def churn(self, fraction=0.1):
+        """
+        Replace fraction of the non-leader frame processes with new pids.
+
+        Return (removed, added) lists of pids. The new processes keep the parent
+        and session of the processes they replace, as if a frame had started new
+        work in place of work that finished.
+        """
+        # Only replace leaves, so no surviving process is left with a missing parent
+        parents = {ppid for ppid, session, process in self.pids.values()}
+        leaders = set(self.session_leaders)
+        candidates = [
+            pid for pid, (ppid, session, process) in self.pids.items()
+            if session in leaders and pid != session and pid not in parents
+        ]
+        removed = self.random.sample(candidates, int(len(candidates) * fraction))
+        added = []
+        for pid in removed:
+            ppid, session, process = self.pids[pid]
+            self.remove_pid(pid)
+            new_pid = self.allocate_pid()
+            self.pids[new_pid] = (ppid, session, process)
+            self.write_pid(new_pid)
+            added.append(new_pid)
+        self.write_root_stat()
+        return removed, added
+
+    def cleanup(self):
+        """Remove the tree from disk."""
+        shutil.rmtree(self.root, ignore_errors=True)
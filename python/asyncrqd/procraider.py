@@ -17,7 +17,9 @@ As soon as we finish that, we can start parsing the results of the IO reads and
 import asyncio
 import asyncio.subprocess
 import collections
+import itertools
 import json
+import operator
 import os
 import re
 import stat
@@ -29,6 +31,11 @@ import contextlib
 import concurrent.futures
 import urllib.request
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class ProcRaider(object):
 
@@ -38,12 +45,23 @@ class ProcRaider(object):
     regex1 = re.compile(r"\n(?=Name:)")
     regex2 = re.compile(r"\b(Name:\s+.*?Pid:\s+(\d+).*?)(?=(\nName:\s|$))", re.DOTALL)
 
-    executable = "/home/donal/Geek/asyncrqd/bin/proc_directory_reader"
-    attempts = []
-    attempts2 = []
-    attempts3 = []
+    executable = os.path.join(
+        os.environ.get("BASEDIR", "."), "bin", "proc_directory_reader"
+    )
+    proc_root = "/proc"
+    backend = "subprocess"
+    backends = ("subprocess", "scandir", "session")
+    scanner = None
+    session_scanner = None
+    aggregation = "python"
+    aggregations = ("python", "numpy")
     watched_pids = {}
     historical_data = {}
+    # Sessions whose frame has its own cgroup, and their cpu history
+    cgroups = {}
+    cgroup_history = {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    datapoints = {}
     stat_keys = (
         "pid",
         "session",
@@ -84,7 +102,46 @@ class ProcRaider(object):
         CPU_NUM -1
     )
 
+    # Offsets of the stat fields (after pid) in the fields that follow the ")"
+    # closing the comm field, which is where field 3 starts. The comm may itself
+    # contain spaces or parentheses, so nothing before the last ")" is split.
+    stat_tail_indices = tuple(index - 2 for index in stat_indices[1:])
+
     stat_entry = collections.namedtuple("StatEntry", stat_keys)
+    session_getter = operator.itemgetter(stat_keys.index("session"))
+
+    # Counters the columnar aggregation pulls from the status and io dicts
+    ctxt_keys = ("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches")
+    ctxt_getter = operator.itemgetter(*ctxt_keys)
+    ctxt_default = dict.fromkeys(ctxt_keys, 0)
+    io_keys = ("syscr", "syscw", "read_bytes", "write_bytes")
+    io_getter = operator.itemgetter(*io_keys)
+    io_default = dict.fromkeys(io_keys, 0)
+
+    # The /proc/PID/status fields kept for each process, as (key, converter, default).
+    # Only these keys are looked up in a block, so the parse cost follows the length
+    # of this schema rather than the ~55 lines of the block. Converters are given the
+    # raw value, as str or bytes, with its surrounding whitespace.
+    status_schema = (
+        ("Tgid", int, 0),
+        ("Pid", int, 0),
+        ("voluntary_ctxt_switches", int, 0),
+        ("nonvoluntary_ctxt_switches", int, 0),
+    )
+    # (needle, newline, key, converter, default) for str and for bytes input
+    status_fields = tuple(
+        ("\n{}:".format(key), "\n", key, convert, default) for key, convert, default in status_schema
+    )
+    status_fields_bytes = tuple(
+        ("\n{}:".format(key).encode("ascii"), b"\n", key, convert, default)
+        for key, convert, default in status_schema
+    )
+    status_pid_field = ("\nPid:", "\n", "Pid", int, 0)
+
+    # Worker pool for the threaded /proc reads, kept for the life of the sampler
+    executor = None
+    executor_workers = 4
+    io_chunk_size = 64
 
     status = 0
     boot_time = None
@@ -96,54 +153,79 @@ class ProcRaider(object):
             return fh.read()
 
     @classmethod
-    async def proc_data_getter(cls, suffix):
+    def get_executor(cls):
+        """Return the worker pool shared by every sample, starting it on first use."""
+        if cls.executor is None:
+            cls.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=cls.executor_workers, thread_name_prefix="procraider"
+            )
+        return cls.executor
+
+    @classmethod
+    def shutdown_executor(cls):
+        """Stop the worker pool; the next read starts a new one."""
+        if cls.executor is not None:
+            cls.executor.shutdown(wait=True)
+            cls.executor = None
+
+    @classmethod
+    def read_chunk(cls, template, pids):
+        """Return a dict of the stripped contents of template.format(pid) for each of pids."""
+        rval = {}
+        for pid in pids:
+            try:
+                rval[pid] = cls.read_file(template.format(pid)).strip()
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                # The process has gone away, or its file is not ours to read
+                pass
+            except Exception as exc:
+                errno = getattr(exc, "errno", "unknown")
+                print("{} generated an exception of type '{}' errno: {}: {}".format(pid, type(exc), errno, exc))
+        return rval
+
+    @classmethod
+    async def proc_data_getter(cls, suffix, pids=None):
         """
         Return a dict of the contents of the /proc/PID/<suffix> files.
 
-        The dict will be keyed on the pid as an int.
+        The dict will be keyed on the pid as an int. Only the given pids are read,
+        by default every process. The reads run on the shared worker pool in chunks
+        of io_chunk_size pids, so the event loop is never blocked on them.
         """
-        with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
-            pid_strings = [f for f in os.listdir("/proc/") if f.isdigit()]
-            template = "/proc/{}/" + suffix
-            future_to_pid = {executor.submit(cls.read_file, template.format(pid)): pid for pid in pid_strings}
-
-            rval = {}
-            for future in concurrent.futures.as_completed(future_to_pid):
-                pid = int(future_to_pid[future])
-                try:
-                    rval[pid] = future.result().strip()
-                except FileNotFoundError:
-                    # Ephemeral file has gone away
-                    pass
-                except ProcessLookupError:
-                    # Ephemeral file has gone away and thread died in an unclean fashion
-                    if hasattr(exc, 'errno'):
-                        errno = exc.errno
-                    else:
-                        errno = 'unknown'
-                    exists = os.path.exists("/proc/{}".format(pid))
-                    print("{} generated an exception of type '{}' errno: {}: {} exists:{}".format(pid, type(exc), errno, exc, exists))
-                except Exception as exc:
-                    if hasattr(exc, 'errno'):
-                        errno = exc.errno
-                    else:
-                        errno = 'unknown'
-                    print("{} generated an exception of type '{}' errno: {}: {}".format(pid, type(exc), errno, exc))
-
-            return rval
+        if pids is None:
+            pids = [int(f) for f in os.listdir(cls.proc_root) if f.isdigit()]
+        else:
+            pids = list(pids)
+        if not pids:
+            return {}
+
+        loop = asyncio.get_running_loop()
+        executor = cls.get_executor()
+        template = os.path.join(cls.proc_root, "{}", suffix)
+        size = cls.io_chunk_size
+        chunks = await asyncio.gather(*(
+            loop.run_in_executor(executor, cls.read_chunk, template, pids[index:index + size])
+            for index in range(0, len(pids), size)
+        ))
+
+        rval = {}
+        for chunk in chunks:
+            rval.update(chunk)
+        return rval
 
     @classmethod
     def process_proc_pid_stat_0(cls, text):
         # Fastest
-        lines = [line.strip() for line in text.strip().split("\n")]
-
-        session_cache = {key:list() for key in cls.watched_pids.keys()}
+        tail_indices = cls.stat_tail_indices
 
         result = {}
-        for line in lines:
-            fields = line.split()
-            #result[fields[0]] = zip(cls.stat_keys, (int(fields[index]) for index in cls.stat_indices))
-            result[int(fields[0])] = cls.stat_entry(*(int(fields[index]) for index in cls.stat_indices))
+        for line in text.strip().split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            fields = line[line.rindex(")") + 2:].split()
+            pid = int(line[0:line.index(" ")])
+            result[pid] = cls.stat_entry(pid, *(int(fields[index]) for index in tail_indices))
 
         return result
 
@@ -156,41 +238,55 @@ class ProcRaider(object):
 
     @classmethod
     def process_stat_entry(cls, line):
-         fields = line.strip().split()
+         line = line.strip()
+         # Field 3 onwards, after the comm field and whatever spaces it holds
+         fields = line[line.rindex(")") + 2:].split()
 
-         # See "man proc"
+         # See "man proc"; field n is fields[n - 3]
          return {
-             "session": fields[5],
-             "vsize": fields[22],
-             "rss": fields[23],
+             "session": fields[3],
+             "vsize": fields[20],
+             "rss": fields[21],
              # These are needed to compute the cpu used
-             "utime": fields[13],
-             "stime": fields[14],
-             "cutime": fields[15],
-             "cstime": fields[16],
+             "utime": fields[11],
+             "stime": fields[12],
+             "cutime": fields[13],
+             "cstime": fields[14],
              # The time in jiffies the process started
              # after system boot.
-             "start_time": fields[21]
+             "start_time": fields[19]
          }
 
     @classmethod
     def process_status_entry(cls, block):
-        lines = block.strip().split("\n")
-        regex = re.compile(":\s+")
-        result = {}
-        for line in lines:
-            key, value = regex.split(line, maxsplit=1)
-            result[key] = value
-
-        result["Cpus_allowed_list"] = cls.process_cpus_allowed(result["Cpus_allowed_list"])
-        result["Threads"] = int(result["Threads"])
-        result["voluntary_ctxt_switches"] = int(result["voluntary_ctxt_switches"])
-        result["nonvoluntary_ctxt_switches"] = int(result["nonvoluntary_ctxt_switches"])
-        return result
+        """Return a dict of the status_schema fields in one /proc/PID/status block, str or bytes."""
+        fields = cls.status_fields_bytes if isinstance(block, (bytes, bytearray)) else cls.status_fields
+        return cls.parse_status_block(block, fields, 0, len(block))
 
     @classmethod
-    async def raid_proc_io(cls):
-        data = await cls.proc_data_getter("io")
+    def parse_status_block(cls, text, fields, start, end):
+        """Return a dict of fields from the status block at text[start:end], without copying it."""
+        find_value = cls.find_status_value
+        return {field[2]: find_value(text, field, start, end) for field in fields}
+
+    @staticmethod
+    def find_status_value(text, field, start, end):
+        """Return the converted value of field in the status block at text[start:end]."""
+        needle, newline, key, convert, default = field
+        index = text.find(needle, start, end)
+        if index < 0:
+            # The first line of a block has no newline in front of it
+            if not text.startswith(needle[1:], start, end):
+                return default
+            index = start - 1
+        index += len(needle)
+        line_end = text.find(newline, index, end)
+        return convert(text[index:end if line_end < 0 else line_end])
+
+    @classmethod
+    async def raid_proc_io(cls, pids=None):
+        """Return a dict of /proc/PID/io counter dicts keyed on pid, for pids or every process."""
+        data = await cls.proc_data_getter("io", pids)
 
         for pid, text in data.items():
             result = {}
@@ -214,29 +310,31 @@ class ProcRaider(object):
         return result
 
     @classmethod
-    def process_proc_pid_status_0(cls, text):
+    def process_proc_pid_status_0(cls, text, pids=None):
+        """
+        Return a dict of status_schema dicts keyed on pid for the concatenated status blocks in text.
+
+        If pids is given, the blocks of every other pid are skipped after reading their Pid line.
+        """
         # fastest
-        regex = cls.regex0
-        offset = 0
-        text = text.strip()
-        finished = False
+        fields = cls.status_fields
+        pid_field = cls.status_pid_field
+        parse_block = cls.parse_status_block
+        find_value = cls.find_status_value
         status_data = {}
 
-        relevant_pids = {}
-
-        while not finished:
-            try:
-                next_block_index = text.index("Name:\t""", offset+1)
-                this_block = text[offset:next_block_index]
-            except ValueError:
-                this_block = text[offset:]
-                finished = True
+        length = len(text)
+        start = text.find("Name:")
+        while 0 <= start < length:
+            end = text.find("\nName:", start)
+            if end < 0:
+                end = length
 
-            matches = regex.search(this_block)
-            pid = int(matches.group(1))
-            status_data[pid] = cls.process_status_entry(this_block)
+            pid = find_value(text, pid_field, start, end)
+            if pids is None or pid in pids:
+                status_data[pid] = parse_block(text, fields, start, end)
 
-            offset = next_block_index
+            start = end + 1
 
         return status_data
 
@@ -254,17 +352,14 @@ class ProcRaider(object):
     @classmethod
     async def get_data(cls):
         # slowest
-        stat_data = cls.proc_data_getter("stat")
-        status_data = cls.proc_data_getter("status")
-        await asyncio.wait([stat_data, status_data])
-        return stat_data, status_data
+        return await asyncio.gather(cls.proc_data_getter("stat"), cls.proc_data_getter("status"))
 
     @classmethod
     def get_boot_time(cls):
         if cls.boot_time is not None:
             return cls.boot_time
 
-        with open("/proc/stat") as fh:
+        with open(os.path.join(cls.proc_root, "stat")) as fh:
             data = fh.read()
             data = data.split("btime ", 1)[1]
             btime = data.split()[0]
@@ -272,258 +367,778 @@ class ProcRaider(object):
             return cls.boot_time
 
     @classmethod
-    async def get_filesystem_data(cls):
-        boot_time = cls.get_boot_time()
-        st = time.perf_counter()
-        separator = "\n\n\n"
-        status_data = {}
+    def set_proc_root(cls, proc_root):
+        """Read processes from proc_root instead of /proc, e.g. a synthetic fixture tree."""
+        cls.proc_root = proc_root
+        cls.boot_time = None
+        cls.scanner = None
+        cls.session_scanner = None
+        cls.historical_data = {}
 
-        now = time.time()
-        system_uptime = now - boot_time
+    @classmethod
+    def set_backend(cls, backend):
+        """Select how get_filesystem_data reads /proc: 'subprocess', 'scandir' or 'session'."""
+        if backend not in cls.backends:
+            raise ValueError("unknown ProcRaider backend: {}".format(backend))
+        cls.backend = backend
+
+    @classmethod
+    def watch_session(cls, session, frame=None, cgroup=None):
+        """
+        Aggregate the processes in session, which is the pid of a frame's session leader.
+
+        If the frame runs in its own FrameCgroup, pass it as cgroup and the session is
+        sampled from the cgroup's counters instead of by walking its processes.
+        """
+        cls.watched_pids[session] = frame
+        if cgroup is not None:
+            cls.cgroups[session] = cgroup
+
+    @classmethod
+    def unwatch_session(cls, session):
+        """Stop aggregating the processes in session."""
+        cls.watched_pids.pop(session, None)
+        cls.historical_data.pop(session, None)
+        cls.datapoints.pop(session, None)
+        cls.cgroups.pop(session, None)
+        cls.cgroup_history.pop(session, None)
+
+    @classmethod
+    async def read_proc_data(cls, sessions=None):
+        """
+        Return (stat_data, status_data, io_data) dicts keyed on pid, using the selected backend.
+
+        Status and io are only read for the given sessions, by default every watched
+        session. The 'session' backend reads io as it scans; the others read it on
+        the worker pool once their stat data shows which pids are in the sessions.
+        """
+        if sessions is None:
+            sessions = cls.watched_pids.keys()
+        if cls.backend == "session":
+            return cls.read_proc_data_session(sessions)
+        if cls.backend == "scandir":
+            stat_data, status_data = cls.read_proc_data_scandir(sessions)
+        else:
+            stat_data, status_data = await cls.read_proc_data_subprocess(sessions)
+        io_data = await cls.raid_proc_io(cls.session_member_pids(stat_data, sessions))
+        return stat_data, status_data, io_data
+
+    @classmethod
+    async def read_proc_data_subprocess(cls, sessions):
+        """Fork proc_directory_reader and parse its concatenated output."""
+        separator = "\n\n\n"
 
         proc = await asyncio.create_subprocess_exec(
             cls.executable,
+            cls.proc_root,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
         stdout, stderr = await proc.communicate()
 
-        #io_data = await cls.raid_proc_io()
-
         stat_lines, status_lines = stdout.decode("utf-8").split(separator, 1)
-        status_data = ProcRaider.process_proc_pid_status_0(status_lines)
+        stat_data = cls.process_proc_pid_stat_0(stat_lines)
+        status_data = cls.process_proc_pid_status_0(status_lines, cls.session_member_pids(stat_data, sessions))
+        return stat_data, status_data
+
+    @classmethod
+    def session_member_pids(cls, stat_data, sessions):
+        """Return the set of pids in stat_data that belong to one of sessions."""
+        return {pid for pid, entry in stat_data.items() if entry.session in sessions}
+
+    @classmethod
+    def read_proc_data_scandir(cls, sessions):
+        """Read /proc in-process with a ProcScanner that is kept between samples."""
+        if cls.scanner is None:
+            cls.scanner = ProcScanner(cls.proc_root)
+        return cls.scanner.scan(sessions)
+
+    @classmethod
+    def read_proc_data_session(cls, sessions):
+        """Read only the processes in sessions with a SessionScanner."""
+        if cls.session_scanner is None:
+            cls.session_scanner = SessionScanner(cls.proc_root)
+        return cls.session_scanner.scan(sessions)
+
+    @classmethod
+    def set_aggregation(cls, aggregation):
+        """Select how samples are summed per session: 'python' or 'numpy'."""
+        if aggregation not in cls.aggregations:
+            raise ValueError("unknown ProcRaider aggregation: {}".format(aggregation))
+        if aggregation == "numpy" and numpy is None:
+            raise ValueError("the numpy aggregation needs numpy to be installed")
+        cls.aggregation = aggregation
+
+    @classmethod
+    def datapoint(cls, session):
+        """Return the reset ProcessDataPoint kept for session."""
+        process_data = cls.datapoints.get(session)
+        if process_data is None:
+            process_data = cls.datapoints[session] = ProcessDataPoint()
+        else:
+            process_data.reset()
+        return process_data
+
+    @classmethod
+    async def get_filesystem_data(cls, sessions=None):
+        """
+        Return a dict of ProcessDataPoint objects keyed on watched session.
+
+        Only the given sessions are sampled, by default every watched one. Sessions
+        with a readable cgroup are sampled from it; the rest fall back to the /proc
+        walk of the selected backend.
+        """
+        boot_time = cls.get_boot_time()
+        now = time.time()
 
-        s = time.perf_counter()
-        stat_data = ProcRaider.process_proc_pid_stat_0(stat_lines)
-        e0 = time.perf_counter() - s
+        if sessions is None:
+            sessions = cls.watched_pids.keys()
+        else:
+            sessions = cls.watched_pids.keys() & set(sessions)
 
-        cls.attempts2.append(e0)
+        resultset = cls.read_cgroups(now, sessions)
+        if len(resultset) == len(sessions):
+            return resultset
 
-        x = time.perf_counter() -st
-        cls.attempts.append(x)
+        sessions = sessions - resultset.keys()
+        stat_data, status_data, io_data = await cls.read_proc_data(sessions)
 
-        watched_pids = {}
+        if cls.aggregation == "numpy":
+            resultset.update(cls.aggregate_columnar(stat_data, status_data, io_data, now, boot_time, sessions))
+        else:
+            resultset.update(cls.aggregate(stat_data, status_data, io_data, now, boot_time, sessions))
+        return resultset
 
+    @classmethod
+    def read_cgroups(cls, now, sessions):
+        """
+        Return a dict of ProcessDataPoint objects for the sessions with a cgroup.
+
+        The cgroup values are converted to the /proc units of ProcessDataPoint:
+        the anon and file_mapped bytes of memory.stat become rss in pages, as
+        /proc counts resident memory, and usage_usec becomes cpu_time in clock
+        ticks. memory.current and memory.peak include the page cache, so they
+        are kept apart in memory_current and memory_peak rather than feeding
+        rss. The io counters are block device bytes and operations rather than
+        /proc/PID/io syscalls. There is no vsize, context switch or per-process
+        ptree data for these sessions. A session whose cgroup cannot be read is
+        left out, so it is walked instead.
+        """
+        hertz = cls.system_hertz
         resultset = {}
-        _historical_data = {}
 
-        watched_pids_set = set(watched_pids.keys())
+        for session, cgroup in list(cls.cgroups.items()):
+            if session not in sessions:
+                continue
+            counters = cgroup.read()
+            if counters is None:
+                continue
+
+            process_data = resultset[session] = cls.datapoint(session)
+            process_data.rss = (counters["anon"] + counters["file_mapped"]) // cls.page_size
+            process_data.memory_current = counters["memory.current"]
+            process_data.memory_peak = counters["memory.peak"]
+            process_data.cpu_time = counters["usage_usec"] * hertz // 1000000
+            process_data.create_time = cgroup.create_time
+            process_data.running_time = now - cgroup.create_time
+            process_data.read_bytes = counters["rbytes"]
+            process_data.write_bytes = counters["wbytes"]
+            process_data.read_calls = counters["rios"]
+            process_data.write_calls = counters["wios"]
+
+            cpu_seconds = counters["usage_usec"] / 1000000
+            previous = cls.cgroup_history.get(session)
+            if previous is not None and process_data.running_time != previous[1]:
+                process_data.pcpu = (cpu_seconds - previous[0]) / (process_data.running_time - previous[1])
+            elif process_data.running_time > 0:
+                process_data.pcpu = cpu_seconds / process_data.running_time
+            cls.cgroup_history[session] = (cpu_seconds, process_data.running_time)
+
+            process_data.update_peaks()
+
+        return resultset
+
+    @classmethod
+    def unsampled_history(cls, sessions):
+        """Return the cpu history of the watched sessions that are not in sessions, to keep it."""
+        return {
+            session: history for session, history in cls.historical_data.items()
+            if session not in sessions and session in cls.watched_pids
+        }
+
+    @classmethod
+    def aggregate(cls, stat_data, status_data, io_data, now, boot_time, sessions=None):
+        """Sum the per-pid data into one ProcessDataPoint per session, by default every watched one."""
+        watched_pids = cls.watched_pids if sessions is None else sessions
+        hertz = cls.system_hertz
+
+        resultset = {}
 
         for data in stat_data.values():
-            if not data.session in watched_pids_set:
-                #continue
-                pass
+            if not data.session in watched_pids:
+                continue
 
             pid = data.session
-            if pid == 20437:
-                print("PID")
-            if pid == 0:
-                continue
 
-            sd = status_data.get(pid)
+            sd = status_data.get(data.pid)
             if sd is None or sd["Tgid"] != sd["Pid"]:
                 # Ignore threads for now
                 continue
 
+            process_data = resultset.get(pid)
+            if process_data is None:
+                process_data = resultset[pid] = cls.datapoint(pid)
 
-            process_data = resultset.setdefault(pid, ProcessDataPoint())
-
-            proc_io = None#io_data.get(pid)
+            proc_io = io_data.get(data.pid)
             if proc_io:
-                process_data.read_calls = proc_io["syscr"]
-                process_data.write_calls = proc_io["syscw"]
-                process_data.read_bytes = proc_io["read_bytes"]
-                process_data.write_bytes = proc_io["write_bytes"]
+                process_data.read_calls += proc_io["syscr"]
+                process_data.write_calls += proc_io["syscw"]
+                process_data.read_bytes += proc_io["read_bytes"]
+                process_data.write_bytes += proc_io["write_bytes"]
 
             process_data.rss += data.rss
             process_data.vsize += data.vsize
-            process_data.vsize += data.vsize
 
-            process_data.cpu_time += data.utime + data.stime + data.cutime + data.cstime
-            process_data.create_time = system_uptime + (data.start_time / cls.system_hertz)
-            process_data.running_time = now - process_data.create_time
+            cpu_time = data.utime + data.stime + data.cutime + data.cstime
+            create_time = boot_time + data.start_time / hertz
+            process_data.cpu_time += cpu_time
+            if not process_data.create_time or create_time < process_data.create_time:
+                process_data.create_time = create_time
 
-            process_data.context_switches = {
-                "voluntary": sd["voluntary_ctxt_switches"],
-                "nonvoluntary": sd["nonvoluntary_ctxt_switches"]
-            }
+            process_data.voluntary_ctxt_switches += sd["voluntary_ctxt_switches"]
+            process_data.nonvoluntary_ctxt_switches += sd["nonvoluntary_ctxt_switches"]
 
-            if process_data.running_time:
-                if pid in cls.historical_data:
-                    old_cpu_time, old_running_time, old_pid_pcpu = cls.historical_data[pid]
-                    if old_running_time != process_data.running_time:
-                        pid_pcpu = (process_data.cpu_time - old_cpu_time) / (process_data.running_time - old_running_time)
-                        process_data.pcpu = (old_pid_pcpu + pid_pcpu) / 2
-                        _historical_data[pid] = (process_data.cpu_time, process_data.running_time, pid_pcpu)
+            process_data.ptree.append((data.pid, now - create_time, cpu_time))
+
+        _historical_data = cls.unsampled_history(watched_pids)
+        for pid, process_data in resultset.items():
+            process_data.running_time = now - process_data.create_time
+            cpu_seconds = process_data.cpu_time / hertz
+
+            if pid in cls.historical_data:
+                old_cpu_seconds, old_running_time, old_pid_pcpu = cls.historical_data[pid]
+                if old_running_time != process_data.running_time:
+                    pid_pcpu = (cpu_seconds - old_cpu_seconds) / (process_data.running_time - old_running_time)
+                    process_data.pcpu = (old_pid_pcpu + pid_pcpu) / 2
+                    _historical_data[pid] = (cpu_seconds, process_data.running_time, pid_pcpu)
                 else:
-                    pid_pcpu = process_data.cpu_time / process_data.running_time
-                    process_data.pcpu += pid_pcpu
-                    _historical_data[pid] = (process_data.cpu_time, process_data.running_time, pid_pcpu)
+                    process_data.pcpu = old_pid_pcpu
+                    _historical_data[pid] = cls.historical_data[pid]
+            elif process_data.running_time > 0:
+                pid_pcpu = cpu_seconds / process_data.running_time
+                process_data.pcpu = pid_pcpu
+                _historical_data[pid] = (cpu_seconds, process_data.running_time, pid_pcpu)
 
-            process_data.ptree.append({"pid":pid, "running_time":process_data.running_time, "cpu_time":process_data.cpu_time})
+            process_data.update_peaks()
 
-            #process_data.xx += data.xx
+        cls.historical_data = _historical_data
+        return resultset
 
+    @classmethod
+    def aggregate_columnar(cls, stat_data, status_data, io_data, now, boot_time, sessions=None):
+        """
+        Sum the per-pid data into one ProcessDataPoint per watched session with NumPy.
+
+        The stat fields become one int64 column each, and the per-session sums,
+        start times and CPU deltas are grouped reductions over those columns, so
+        the cost barely grows with the number of processes on the host. Produces
+        the same results as aggregate().
+        """
+        if sessions is None:
+            sessions = cls.watched_pids
+        if not stat_data or not sessions:
+            cls.historical_data = cls.unsampled_history(sessions)
+            return {}
+
+        # Select the watched rows from the session column alone, so only those
+        # rows are unpacked into the full set of columns
+        entries = list(stat_data.values())
+        watched = numpy.fromiter(sessions, dtype=numpy.int64, count=len(sessions))
+        session_column = numpy.fromiter(map(cls.session_getter, entries), dtype=numpy.int64, count=len(entries))
+        entries = [entries[index] for index in numpy.flatnonzero(numpy.isin(session_column, watched)).tolist()]
+
+        # Drop pids that went away before their status was read
+        if len(status_data) != len(stat_data):
+            entries = [entry for entry in entries if entry.pid in status_data]
+
+        if not entries:
+            cls.historical_data = cls.unsampled_history(sessions)
+            return {}
+
+        width = len(cls.stat_keys)
+        columns = numpy.fromiter(
+            itertools.chain.from_iterable(entries), dtype=numpy.int64, count=len(entries) * width
+        ).reshape(len(entries), width)
+
+        (pid, session, utime, stime, cutime, cstime, num_threads,
+         start_time, vsize, rss, cpu_num) = columns.T
+        pids = pid.tolist()
+        count = len(pids)
+
+        # The requested sessions that still have rows; sessions itself is kept
+        # for unsampled_history, as in aggregate()
+        present, group = numpy.unique(session, return_inverse=True)
+        session_count = len(present)
+
+        def grouped_sum(values):
+            result = numpy.zeros((session_count,) + values.shape[1:], dtype=numpy.int64)
+            numpy.add.at(result, group, values)
+            return result
+
+        def counters(source, getter, default):
+            # One C-level pass over the watched pids pulls every counter out of the dicts
+            rows = map(getter, map(source.get, pids, itertools.repeat(default)))
+            return numpy.fromiter(
+                itertools.chain.from_iterable(rows), dtype=numpy.int64, count=count * len(default)
+            ).reshape(count, len(default))
+
+        context_switches = grouped_sum(counters(status_data, cls.ctxt_getter, cls.ctxt_default))
+        if io_data:
+            io = grouped_sum(counters(io_data, cls.io_getter, cls.io_default))
+        else:
+            io = numpy.zeros((session_count, len(cls.io_default)), dtype=numpy.int64)
+
+        cpu_time = utime + stime + cutime + cstime
+        first_start = numpy.full(session_count, numpy.iinfo(numpy.int64).max, dtype=numpy.int64)
+        numpy.minimum.at(first_start, group, start_time)
+
+        session_cpu_time = grouped_sum(cpu_time)
+        create_time = boot_time + first_start / cls.system_hertz
+        running_time = now - create_time
+        cpu_seconds = session_cpu_time / cls.system_hertz
+
+        # CPU deltas against the previous snapshot, matched on session
+        session_list = present.tolist()
+        history = [cls.historical_data.get(s) for s in session_list]
+        known = numpy.fromiter((h is not None for h in history), dtype=bool, count=session_count)
+        old = numpy.array([h if h is not None else (0.0, 0.0, 0.0) for h in history], dtype=numpy.float64)
+        old_cpu_seconds, old_running_time, old_pcpu = old.T
+
+        delta_time = running_time - old_running_time
+        moved = known & (delta_time != 0)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            delta_pcpu = numpy.where(moved, (cpu_seconds - old_cpu_seconds) / delta_time, 0.0)
+            first_pcpu = numpy.where(running_time > 0, cpu_seconds / running_time, 0.0)
+        pid_pcpu = numpy.where(known, numpy.where(moved, delta_pcpu, old_pcpu), first_pcpu)
+        pcpu = numpy.where(moved, (old_pcpu + delta_pcpu) / 2, pid_pcpu)
+
+        # The ptree of each session is a contiguous run once the rows are sorted by group
+        order = numpy.argsort(group, kind="stable")
+        boundaries = numpy.searchsorted(group[order], numpy.arange(session_count + 1)).tolist()
+        process_running_time = now - (boot_time + start_time / cls.system_hertz)
+        ptree_pids = pid[order].tolist()
+        ptree_running_time = process_running_time[order].tolist()
+        ptree_cpu_time = cpu_time[order].tolist()
+
+        sums = zip(
+            session_list,
+            grouped_sum(rss).tolist(),
+            grouped_sum(vsize).tolist(),
+            session_cpu_time.tolist(),
+            create_time.tolist(),
+            running_time.tolist(),
+            pcpu.tolist(),
+            context_switches.tolist(),
+            io.tolist(),
+            cpu_seconds.tolist(),
+            pid_pcpu.tolist(),
+            known.tolist(),
+            moved.tolist(),
+            boundaries[:-1],
+            boundaries[1:],
+        )
 
-        jake = (json.dumps(resultset, indent=4))#.keys())#[20437])
+        resultset = {}
+        _historical_data = cls.unsampled_history(sessions)
+        for (s, s_rss, s_vsize, s_cpu_time, s_create_time, s_running_time, s_pcpu,
+             (s_voluntary, s_nonvoluntary), (s_read_calls, s_write_calls, s_read_bytes, s_write_bytes),
+             s_cpu_seconds, s_pid_pcpu, s_known, s_moved, start, end) in sums:
+            process_data = resultset[s] = cls.datapoint(s)
+            process_data.rss = s_rss
+            process_data.vsize = s_vsize
+            process_data.cpu_time = s_cpu_time
+            process_data.create_time = s_create_time
+            process_data.running_time = s_running_time
+            process_data.pcpu = s_pcpu
+            process_data.voluntary_ctxt_switches = s_voluntary
+            process_data.nonvoluntary_ctxt_switches = s_nonvoluntary
+            process_data.read_calls = s_read_calls
+            process_data.write_calls = s_write_calls
+            process_data.read_bytes = s_read_bytes
+            process_data.write_bytes = s_write_bytes
+            process_data.ptree.extend(zip(
+                ptree_pids[start:end], ptree_running_time[start:end], ptree_cpu_time[start:end]
+            ))
+            process_data.update_peaks()
+
+            if s_known and not s_moved:
+                _historical_data[s] = cls.historical_data[s]
+            elif s_known or s_running_time > 0:
+                _historical_data[s] = (s_cpu_seconds, s_running_time, s_pid_pcpu)
 
         cls.historical_data = _historical_data
+        return resultset
+
+
+class ProcScanner(object):
+    """
+    Read /proc/PID/stat and /proc/PID/status without leaving the process.
+
+    The pid directories are listed with os.scandir and every file is read with a
+    single os.readv into a buffer that is allocated once and reused, so a sample
+    costs no forks and no per-file file objects. The results have the same shape
+    as the subprocess path: stat_entry tuples and process_status_entry dicts.
+    """
+
+    buffer_size = 4096
+
+    stat_tail_indices = ProcRaider.stat_tail_indices
+
+    def __init__(self, proc_root="/proc"):
+        """Constructor."""
+        self.proc_root = proc_root
+        self._stat_buffer = bytearray(self.buffer_size)
+        self._status_buffer = bytearray(self.buffer_size * 2)
+
+    def pid_entries(self):
+        """Return a list of (pid, path) tuples for every process directory."""
+        with os.scandir(self.proc_root) as entries:
+            return [(int(entry.name), entry.path) for entry in entries if entry.name.isdigit()]
+
+    def read_into(self, filepath, buffer):
+        """
+        Read filepath into buffer, growing it as needed.
+
+        Return (buffer, length). The length is -1 if the process has gone away.
+        """
+        try:
+            fd = os.open(filepath, os.O_RDONLY)
+        except (FileNotFoundError, ProcessLookupError):
+            return buffer, -1
+
+        try:
+            while True:
+                length = os.readv(fd, [buffer])
+                if length < len(buffer):
+                    return buffer, length
+                # Filled the buffer: grow it and read the file again from the start
+                buffer = bytearray(len(buffer) * 2)
+                os.lseek(fd, 0, os.SEEK_SET)
+        except ProcessLookupError:
+            return buffer, -1
+        finally:
+            os.close(fd)
+
+    def read_stat(self, path):
+        """Return a stat_entry for the process directory at path, or None."""
+        self._stat_buffer, length = self.read_into(path + "/stat", self._stat_buffer)
+        if length <= 0:
+            return None
+
+        return self.parse_stat(self._stat_buffer, length)
+
+    @classmethod
+    def parse_stat(cls, buffer, length):
+        """Return a stat_entry for the stat line in buffer[:length]."""
+        # The comm field is wrapped in parentheses and may itself contain spaces
+        # or parentheses, so only split what follows the last ")"
+        comm_end = buffer.rfind(b")", 0, length)
+        fields = buffer[comm_end + 2:length].split()
+        pid = int(buffer[0:buffer.index(b" ")])
+        return ProcRaider.stat_entry(pid, *(int(fields[index]) for index in cls.stat_tail_indices))
+
+    def read_status(self, path):
+        """Return the process_status_entry dict for the process directory at path, or None."""
+        self._status_buffer, length = self.read_into(path + "/status", self._status_buffer)
+        if length <= 0:
+            return None
+
+        # Parse the buffer in place; the schema fields are the only bytes converted
+        return ProcRaider.parse_status_block(self._status_buffer, ProcRaider.status_fields_bytes, 0, length)
+
+    def scan(self, sessions=None):
+        """
+        Return (stat_data, status_data) dicts keyed on pid for every process.
+
+        If sessions is given, status is only read for the processes in those sessions.
+        """
+        stat_data = {}
+        status_data = {}
+
+        for pid, path in self.pid_entries():
+            entry = self.read_stat(path)
+            if entry is None:
+                continue
+
+            if sessions is not None and entry.session not in sessions:
+                stat_data[pid] = entry
+                continue
+
+            status = self.read_status(path)
+            if status is None:
+                continue
+
+            stat_data[pid] = entry
+            status_data[pid] = status
+
         return stat_data, status_data
 
 
+class SessionScanner(ProcScanner):
+    """
+    Incrementally scan /proc for the processes in a set of watched sessions.
+
+    The session of every pid is read once, when the pid first appears, and kept in
+    an index. After that only the pids in watched sessions are read: stat for fresh
+    counters, plus status and io. The per-sample cost scales with the number of frame
+    processes rather than the number of processes on the host; the only host-wide
+    work left is listing the /proc directory.
+    """
+
+    def __init__(self, proc_root="/proc"):
+        """Constructor."""
+        ProcScanner.__init__(self, proc_root)
+        self._io_buffer = bytearray(self.buffer_size // 8)
+        self.pid_sessions = {}
+        self.session_pids = {}
+
+    def update_sessions(self, sessions):
+        """Add index entries for newly watched sessions and drop unwatched ones."""
+        for session in sessions - self.session_pids.keys():
+            # The leader may have been indexed before it called setsid(), so
+            # forget it and let the next scan read its session again
+            self.pid_sessions.pop(session, None)
+            self.session_pids[session] = {
+                pid for pid, pid_session in self.pid_sessions.items() if pid_session == session
+            }
+
+        for session in self.session_pids.keys() - sessions:
+            del self.session_pids[session]
+
+    def forget_pid(self, pid):
+        """Remove a pid that has gone away from the index."""
+        session = self.pid_sessions.pop(pid, None)
+        pids = self.session_pids.get(session)
+        if pids is not None:
+            pids.discard(pid)
+
+    def read_io(self, path):
+        """Return a dict of the /proc/PID/io counters for the process directory at path, or None."""
+        try:
+            self._io_buffer, length = self.read_into(path + "/io", self._io_buffer)
+        except PermissionError:
+            return None
+        if length <= 0:
+            return None
+
+        result = {}
+        for line in self._io_buffer[0:length].split(b"\n"):
+            key, separator, value = line.partition(b": ")
+            if separator:
+                result[key.decode("ascii")] = int(value)
+        return result
+
+    def scan(self, sessions):
+        """Return (stat_data, status_data, io_data) dicts keyed on pid for the watched sessions."""
+        sessions = set(sessions)
+        self.update_sessions(sessions)
+
+        stat_data = {}
+        status_data = {}
+        io_data = {}
+
+        paths = dict(self.pid_entries())
+        for pid in self.pid_sessions.keys() - paths.keys():
+            self.forget_pid(pid)
+
+        for pid in paths.keys() - self.pid_sessions.keys():
+            entry = self.read_stat(paths[pid])
+            if entry is None:
+                continue
+            self.pid_sessions[pid] = entry.session
+            pids = self.session_pids.get(entry.session)
+            if pids is not None:
+                pids.add(pid)
+                stat_data[pid] = entry
+
+        pending = [(pid, session) for session in sessions for pid in self.session_pids[session]]
+        while pending:
+            pid, session = pending.pop()
+            path = paths[pid]
+            entry = stat_data.get(pid) or self.read_stat(path)
+            if entry is None:
+                self.forget_pid(pid)
+                continue
+
+            if entry.session != session:
+                # The process called setsid() and left the frame's session;
+                # if it joined another watched one it is sampled there
+                self.forget_pid(pid)
+                self.pid_sessions[pid] = entry.session
+                pids = self.session_pids.get(entry.session)
+                if pids is None:
+                    stat_data.pop(pid, None)
+                    continue
+                pids.add(pid)
+                stat_data[pid] = entry
+                pending.append((pid, entry.session))
+                continue
+
+            status = self.read_status(path)
+            if status is None:
+                self.forget_pid(pid)
+                stat_data.pop(pid, None)
+                continue
+
+            stat_data[pid] = entry
+            status_data[pid] = status
+            io = self.read_io(path)
+            if io is not None:
+                io_data[pid] = io
+
+        return stat_data, status_data, io_data
+
+
+class ProcessDataPoint(object):
+    """
+    Resource usage of one frame session, summed over its processes.
 
-class ProcessDataPoint(dict):
-    """Inheriting from dict gives us json serializability for free."""
+    Records are kept per session and reset between samples rather than
+    reallocated, so max_rss and max_vsize are peaks over the life of the frame.
+    Values are in /proc units: rss in pages, vsize in bytes and cpu_time in
+    clock ticks. Sessions sampled from a cgroup also have its memory.current
+    and memory.peak, page cache included, in bytes; they are 0 for the others.
+    Use to_dict() for JSON or msgpack, and to_running_frame_info() for
+    reports; both copy the values, which the next sample overwrites.
+    """
+
+    __slots__ = (
+        "rss",
+        "max_rss",
+        "vsize",
+        "max_vsize",
+        "pcpu",
+        "cpu_time",
+        "create_time",
+        "running_time",
+        "voluntary_ctxt_switches",
+        "nonvoluntary_ctxt_switches",
+        "ptree",
+        "read_calls",
+        "write_calls",
+        "read_bytes",
+        "write_bytes",
+        "memory_current",
+        "memory_peak",
+    )
+
+    page_size_kb = os.sysconf("SC_PAGE_SIZE") // 1024
 
     def __init__(self):
         """Constructor."""
-        self["rss"] = 0
-        self["max_rss"] = 0
-        self["vsize"] = 0
-        self["max_vsize"] = 0
-        self["pcpu"] = 0
-        self["cpu_time"] = 0
-        self["create_time"] = 0
-        self["running_time"] = 0
-        self["context_switches"] = 0
-        self["ptree"] = []
-        self["read_calls"] = 0
-        self["write_calls"] = 0
-        self["read_bytes"] = 0
-        self["write_bytes"] = 0
-
-    @property
-    def read_calls(self):
-        return self["read_calls"]
-
-    @read_calls.setter
-    def read_calls(self, value):
-        self["read_calls"] = value
-
-    @property
-    def write_calls(self):
-        return self["write_calls"]
-
-    @write_calls.setter
-    def write_calls(self, value):
-        self["write_calls"] = value
-
-    @property
-    def read_bytes(self):
-        return self["read_bytes"]
-
-    @read_bytes.setter
-    def read_bytes(self, value):
-        self["read_bytes"] = value
-
-    @property
-    def write_bytes(self):
-        return self["write_bytes"]
-
-    @write_bytes.setter
-    def write_bytes(self, value):
-        self["write_bytes"] = value
-
-    @property
-    def ptree(self):
-        return self["ptree"]
-
-    @ptree.setter
-    def ptree(self, value):
-        self["ptree"] = value
-
-    @property
-    def pcpu(self):
-        return self["pcpu"]
-
-    @pcpu.setter
-    def pcpu(self, value):
-        self["pcpu"] = value
-
-    @property
-    def cpu_time(self):
-        return self["cpu_time"]
-
-    @cpu_time.setter
-    def cpu_time(self, value):
-        self["cpu_time"] = value
-
-    @property
-    def create_time(self):
-        return self["create_time"]
-
-    @create_time.setter
-    def create_time(self, value):
-        self["create_time"] = value
-
-    @property
-    def running_time(self):
-        return self["running_time"]
-
-    @running_time.setter
-    def running_time(self, value):
-        self["running_time"] = value
-
-    @property
-    def context_switches(self):
-        return self["context_switches"]
-
-    @context_switches.setter
-    def context_switches(self, value):
-        self["context_switches"] = value
-
-    @property
-    def rss(self):
-        return self["rss"]
-
-    @rss.setter
-    def rss(self, value):
-        self["rss"] = value
-        self["max_rss"] = max(value, self["max_rss"])
-
-    @property
-    def vsize(self):
-        return self["vsize"]
-
-    @vsize.setter
-    def vsize(self, value):
-        self["vsize"] = value
-        self["max_vsize"] = max(value, self["max_vsize"])
+        self.max_rss = 0
+        self.max_vsize = 0
+        self.ptree = []
+        self.reset()
+
+    def reset(self):
+        """Zero the per-sample values, keeping the peaks."""
+        self.rss = 0
+        self.vsize = 0
+        self.pcpu = 0
+        self.cpu_time = 0
+        self.create_time = 0
+        self.running_time = 0
+        self.voluntary_ctxt_switches = 0
+        self.nonvoluntary_ctxt_switches = 0
+        self.ptree.clear()
+        self.read_calls = 0
+        self.write_calls = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.memory_current = 0
+        self.memory_peak = 0
+
+    def update_peaks(self):
+        """Fold the current rss and vsize into the peaks once a sample is summed."""
+        if self.rss > self.max_rss:
+            self.max_rss = self.rss
+        if self.vsize > self.max_vsize:
+            self.max_vsize = self.vsize
+
+    @classmethod
+    def from_dict(cls, values):
+        """Return a new ProcessDataPoint with the values of a to_dict() dict."""
+        process_data = cls()
+        for key in cls.__slots__:
+            if key in values and key != "ptree":
+                setattr(process_data, key, values[key])
+        context_switches = values.get("context_switches", {})
+        process_data.voluntary_ctxt_switches = context_switches.get("voluntary", 0)
+        process_data.nonvoluntary_ctxt_switches = context_switches.get("nonvoluntary", 0)
+        process_data.ptree.extend(
+            (entry["pid"], entry["running_time"], entry["cpu_time"]) for entry in values.get("ptree", ())
+        )
+        return process_data
+
+    def to_dict(self):
+        """Return the values as a plain dict that json and msgpack can serialize."""
+        return {
+            "rss": self.rss,
+            "max_rss": self.max_rss,
+            "vsize": self.vsize,
+            "max_vsize": self.max_vsize,
+            "pcpu": self.pcpu,
+            "cpu_time": self.cpu_time,
+            "create_time": self.create_time,
+            "running_time": self.running_time,
+            "context_switches": {
+                "voluntary": self.voluntary_ctxt_switches,
+                "nonvoluntary": self.nonvoluntary_ctxt_switches,
+            },
+            "ptree": [
+                {"pid": pid, "running_time": running_time, "cpu_time": cpu_time}
+                for pid, running_time, cpu_time in self.ptree
+            ],
+            "read_calls": self.read_calls,
+            "write_calls": self.write_calls,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+            "memory_current": self.memory_current,
+            "memory_peak": self.memory_peak,
+        }
+
+    def to_running_frame_info(self, info=None):
+        """
+        Fill the usage fields of a report_pb2.RunningFrameInfo and return it.
+
+        Memory is reported in kB; the other values go into the attributes map.
+        """
+        # Imported here so the sampler coprocess does not need the compiled protos
+        from .proto import report_pb2
+
+        if info is None:
+            info = report_pb2.RunningFrameInfo()
+
+        info.rss = self.rss * self.page_size_kb
+        info.max_rss = self.max_rss * self.page_size_kb
+        info.vsize = self.vsize // 1024
+        info.max_vsize = self.max_vsize // 1024
+        info.attributes["pcpu"] = str(self.pcpu)
+        info.attributes["cpu_time"] = str(self.cpu_time)
+        info.attributes["voluntary_ctxt_switches"] = str(self.voluntary_ctxt_switches)
+        info.attributes["nonvoluntary_ctxt_switches"] = str(self.nonvoluntary_ctxt_switches)
+        info.attributes["read_calls"] = str(self.read_calls)
+        info.attributes["write_calls"] = str(self.write_calls)
+        info.attributes["read_bytes"] = str(self.read_bytes)
+        info.attributes["write_bytes"] = str(self.write_bytes)
+        if self.memory_current:
+            info.attributes["memory_current"] = str(self.memory_current)
+            info.attributes["memory_peak"] = str(self.memory_peak)
+        return info
 
     def __repr__(self):
-        return json.dumps(self, indent=4)
+        return json.dumps(self.to_dict(), indent=4)
 
     def __str__(self):
-        return json.dumps(self, indent=4)
-
-'''
-We have a set of watched pids that we care about
-We have a set of data
-We want to get the list of pids into a set.
-'''
-
-async def amain():
-    st = time.perf_counter()
-    for i in range(150):
-        fsd = await ProcRaider.get_filesystem_data()
-    print("   first ten: {}".format(ProcRaider.attempts[0:10]))
-    print("    last ten: {}".format(ProcRaider.attempts[-10:]))
-    print("       first: {}".format(ProcRaider.attempts[0]))
-    print("         max: {}".format(max(ProcRaider.attempts)))
-    print("         min: {}".format(min(ProcRaider.attempts)))
-    print("         ave: {}".format(sum(ProcRaider.attempts) / len(ProcRaider.attempts)))
-    print("        last: {}".format(ProcRaider.attempts[-1]))
-    print("      ave e0: {}".format(sum(ProcRaider.attempts2) / len(ProcRaider.attempts2)))
-    print("       total: {}".format(time.perf_counter() - st))
-    # print("      ave e1: {}".format(sum(ProcRaider.attempts3) / len(ProcRaider.attempts3)))
-
-
-
-def main():
-    loop = asyncio.get_event_loop()
-    with contextlib.closing(loop):
-        fsd = amain()
-        loop.run_until_complete(fsd)
-
-
-main()
+        return json.dumps(self.to_dict(), indent=4)
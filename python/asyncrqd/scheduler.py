@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Adaptive per-frame sampling intervals.
+
+Every watched session gets its own interval. After each sample the interval is
+halved if the frame's RSS or CPU use moved quickly, or if the frame is close to
+its memory limit, and grown by half if the frame was stable, within
+[min_interval, max_interval]. A frame that has been flat for an hour is then
+sampled a few times a minute, and one that is ramping memory every second.
+
+On top of that the scheduler watches its own process's CPU use with getrusage
+and stretches every interval by a common factor while it is over its budget.
+Only RUSAGE_SELF is measured: run in the sampler coprocess, the budget covers
+the coprocess's sampling and not the daemon's gRPC loop or its children.
+"""
+
+import resource
+import time
+
+from . import config
+from . import log
+
+
+class SessionSchedule(object):
+    """The sampling state of one watched session."""
+
+    __slots__ = ("session", "interval", "next_due", "memory_limit", "last_rss", "last_pcpu")
+
+    def __init__(self, session, interval, next_due, memory_limit=None):
+        """Constructor."""
+        self.session = session
+        self.interval = interval
+        self.next_due = next_due
+        self.memory_limit = memory_limit
+        self.last_rss = None
+        self.last_pcpu = None
+
+
+class SamplingScheduler(object):
+    """Decide which sessions are due for a sample, and when the next one is."""
+
+    logger = log.get_logger()
+
+    # Relative RSS change and absolute change in CPUs used that count as fast
+    rss_change_threshold = 0.05
+    pcpu_change_threshold = 0.25
+    # Fraction of the memory limit above which a frame is sampled at min_interval
+    memory_limit_margin = 0.9
+    shrink_factor = 0.5
+    growth_factor = 1.5
+    max_budget_scale = 8.0
+
+    def __init__(self, interval=None, min_interval=None, max_interval=None, cpu_budget=None):
+        """Constructor."""
+        sampling = config.dot_notation().daemon.sampling
+        self.interval = interval or (sampling and sampling.interval) or 5.0
+        self.min_interval = min_interval or (sampling and sampling.min_interval) or 1.0
+        self.max_interval = max_interval or (sampling and sampling.max_interval) or 60.0
+        # Fraction of one CPU the daemon may spend, 0 for no limit
+        self.cpu_budget = cpu_budget if cpu_budget is not None else (sampling and sampling.cpu_budget) or 0
+        self.widen(self.interval)
+        self.budget_scale = 1.0
+        self.cpu_usage = 0.0
+        self.schedules = {}
+        self._last_rusage = None
+        self._last_rusage_time = None
+
+    def add(self, session, memory_limit=None, now=None):
+        """Schedule session for an immediate first sample; memory_limit is in kB."""
+        now = time.monotonic() if now is None else now
+        schedule = self.schedules.get(session)
+        if schedule is None:
+            self.schedules[session] = SessionSchedule(session, self.interval, now, memory_limit)
+        elif memory_limit is not None:
+            schedule.memory_limit = memory_limit
+
+    def remove(self, session):
+        self.schedules.pop(session, None)
+
+    def widen(self, interval):
+        """Extend [min_interval, max_interval] to include interval, which was asked for explicitly."""
+        self.min_interval = min(self.min_interval, interval)
+        self.max_interval = max(self.max_interval, interval)
+
+    def set_interval(self, interval):
+        """Reset every session to interval, which is also the starting interval of new sessions."""
+        self.interval = interval
+        self.widen(interval)
+        now = time.monotonic()
+        for schedule in self.schedules.values():
+            schedule.interval = self.interval
+            schedule.next_due = now
+
+    def due(self, now=None):
+        """Return the list of sessions whose next sample is due."""
+        now = time.monotonic() if now is None else now
+        return [session for session, schedule in self.schedules.items() if schedule.next_due <= now]
+
+    def next_wakeup(self, now=None):
+        """Return the number of seconds until the next session is due, or None if there are none."""
+        if not self.schedules:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, min(schedule.next_due for schedule in self.schedules.values()) - now)
+
+    def update(self, session, process_data, now=None):
+        """Adjust the interval of session from the ProcessDataPoint of its latest sample."""
+        schedule = self.schedules.get(session)
+        if schedule is None:
+            return
+
+        now = time.monotonic() if now is None else now
+        rss = process_data.rss
+        pcpu = process_data.pcpu
+
+        near_limit = False
+        if schedule.memory_limit:
+            rss_kb = rss * process_data.page_size_kb
+            near_limit = rss_kb >= schedule.memory_limit * self.memory_limit_margin
+
+        if schedule.last_rss is None:
+            changing = False
+        else:
+            rss_change = abs(rss - schedule.last_rss) / max(schedule.last_rss, 1)
+            changing = (
+                rss_change >= self.rss_change_threshold
+                or abs(pcpu - schedule.last_pcpu) >= self.pcpu_change_threshold
+            )
+
+        if near_limit:
+            schedule.interval = self.min_interval
+        elif changing:
+            schedule.interval = max(self.min_interval, schedule.interval * self.shrink_factor)
+        elif schedule.last_rss is not None:
+            schedule.interval = min(self.max_interval, schedule.interval * self.growth_factor)
+
+        schedule.last_rss = rss
+        schedule.last_pcpu = pcpu
+        schedule.next_due = now + schedule.interval * self.budget_scale
+
+    def skip(self, session, now=None):
+        """Push back a due session that could not be sampled, without changing its interval."""
+        schedule = self.schedules.get(session)
+        if schedule is not None:
+            now = time.monotonic() if now is None else now
+            schedule.next_due = now + schedule.interval * self.budget_scale
+
+    def update_budget(self, now=None):
+        """
+        Measure this process's CPU use since the last call and adjust budget_scale.
+
+        Over budget, every interval is stretched by half as much again, up to
+        max_budget_scale; under half the budget the stretch is relaxed towards 1.
+        """
+        now = time.monotonic() if now is None else now
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_seconds = usage.ru_utime + usage.ru_stime
+
+        if self._last_rusage is not None and now > self._last_rusage_time:
+            self.cpu_usage = (cpu_seconds - self._last_rusage) / (now - self._last_rusage_time)
+            if self.cpu_budget:
+                if self.cpu_usage > self.cpu_budget:
+                    self.budget_scale = min(self.max_budget_scale, self.budget_scale * self.growth_factor)
+                    self.logger.debug(
+                        "sampling over cpu budget", cpu_usage=self.cpu_usage, budget_scale=self.budget_scale
+                    )
+                elif self.cpu_usage < self.cpu_budget / 2:
+                    self.budget_scale = max(1.0, self.budget_scale * self.shrink_factor)
+
+        self._last_rusage = cpu_seconds
+        self._last_rusage_time = now
+
+    def intervals(self):
+        """Return a dict of the effective interval in seconds of every session, for inspection."""
+        return {
+            session: schedule.interval * self.budget_scale
+            for session, schedule in self.schedules.items()
+        }
+
+    def to_dict(self):
+        return {
+            "interval": self.interval,
+            "min_interval": self.min_interval,
+            "max_interval": self.max_interval,
+            "cpu_budget": self.cpu_budget,
+            "cpu_usage": self.cpu_usage,
+            "budget_scale": self.budget_scale,
+            "intervals": self.intervals(),
+        }
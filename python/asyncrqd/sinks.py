@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+"""
+Bounded per-sink queues for fanning frame output out to files and viewers.
+
+Each sink runs behind its own QueuedSink: the output handler puts data on the
+queue without waiting and a writer task per sink drains it, so a slow NFS mount
+or a slow remote viewer only ever delays itself. What happens when a queue is
+full depends on its overflow policy:
+
+    block        keep the data and ask the producer to pause reading the pipe
+                 until the writer has caught up
+    drop_oldest  discard the oldest queued data to make room
+    drop         discard the new data and write a marker line saying how many
+                 chunks were lost once there is room again
+
+CompressedFileSink writes a gzip or zstd log from a thread of its own,
+TailBuffer keeps the last of a frame's output in memory, and LogStream follows
+it live for one viewer.
+"""
+
+import asyncio
+import collections
+import inspect
+import queue
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import log
+
+
+class FileSink(object):
+    """Write to a binary file object on the loop's default executor."""
+
+    def __init__(self, fh, flush=True):
+        """Constructor."""
+        self.fh = fh
+        self.flushable = flush
+
+    def _write(self, data):
+        self.fh.write(data)
+        if self.flushable:
+            self.fh.flush()
+
+    def write(self, data):
+        return asyncio.get_running_loop().run_in_executor(None, self._write, data)
+
+
+class WebSocketSink(object):
+    """Send to a websocket-like object with a sendMessage(payload, is_binary) method."""
+
+    def __init__(self, ws):
+        """Constructor."""
+        self.ws = ws
+
+    def write(self, data):
+        return self.ws.sendMessage(data, False)
+
+
+class TailBuffer(object):
+    """
+    A ring buffer of the most recent output of one frame.
+
+    Holds at most max_lines lines and max_bytes bytes; the oldest output is
+    trimmed as new output arrives, so the memory used per frame is bounded.
+    Offsets count every byte ever written, so start_offset moves forward as
+    output is trimmed and end_offset is the total written so far.
+    """
+
+    def __init__(self, max_lines=1000, max_bytes=262144):
+        """Constructor."""
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.chunks = collections.deque()
+        self.size = 0
+        self.lines = 0
+        self.start_offset = 0
+
+    @property
+    def end_offset(self):
+        return self.start_offset + self.size
+
+    def write(self, data):
+        """Append data, then trim the oldest output to the limits."""
+        if not data:
+            return
+        self.chunks.append(data)
+        self.size += len(data)
+        self.lines += data.count(b"\n")
+
+        while self.size > self.max_bytes or self.lines > self.max_lines:
+            oldest = self.chunks[0]
+            oldest_lines = oldest.count(b"\n")
+            excess_bytes = self.size - self.max_bytes
+            excess_lines = self.lines - self.max_lines
+
+            cut = len(oldest)
+            if excess_bytes < len(oldest) and excess_lines < oldest_lines:
+                # Trim part of the oldest chunk: past the excess lines and bytes,
+                # then on to the next line break so only whole lines are kept
+                cut = max(excess_bytes, 0)
+                index = 0
+                for i in range(excess_lines):
+                    index = oldest.index(b"\n", index) + 1
+                cut = max(cut, index)
+                if cut and oldest[cut - 1:cut] != b"\n":
+                    cut = oldest.find(b"\n", cut) + 1 or len(oldest)
+
+            if cut == len(oldest):
+                self.chunks.popleft()
+            else:
+                self.chunks[0] = oldest[cut:]
+            self.size -= cut
+            self.lines -= oldest.count(b"\n", 0, cut)
+            self.start_offset += cut
+
+    def read(self, offset=0):
+        """Return (offset, data) for the buffered output from offset on, clamped to what is held."""
+        offset = min(max(offset, self.start_offset), self.end_offset)
+        data = b"".join(self.chunks)
+        return offset, data[offset - self.start_offset:]
+
+    def tail(self, lines=None, max_bytes=None):
+        """Return (offset, data) for the last lines lines, at most max_bytes, of the buffered output."""
+        offset, data = self.read(self.start_offset)
+        start = 0
+        if lines:
+            start = len(data)
+            # Skip a final line break so the last line counts as one
+            end = len(data) - 1 if data.endswith(b"\n") else len(data)
+            for i in range(lines):
+                start = data.rfind(b"\n", 0, end)
+                if start < 0:
+                    start = 0
+                    break
+                end = start
+                start += 1
+        if max_bytes and len(data) - start > max_bytes:
+            start = len(data) - max_bytes
+        return offset + start, data[start:]
+
+
+class LogStream(object):
+    """
+    Follow the output of one frame from a byte offset, for one live viewer.
+
+    The output handler hands every chunk to write() by reference, and get()
+    returns everything that arrived since the last call joined into one block,
+    so each viewer costs one copy per batch however many lines were written.
+    Nothing here ever waits on the viewer: once more than max_bytes is queued
+    the queue is dropped and the viewer catches up from the TailBuffer instead,
+    skipping whatever has been trimmed from it by then. The offset returned with
+    each block tells the viewer where it starts, so a gap shows as a jump.
+    """
+
+    def __init__(self, tail, offset=0, max_bytes=1048576):
+        """Constructor."""
+        self.tail = tail
+        self.max_bytes = max_bytes
+        # The offset of the next byte this viewer has not been sent
+        self.offset = min(offset, tail.end_offset)
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+        self.skipped = 0
+        self.closed = False
+        # Start from the tail until the viewer is level with the live output
+        self._resync = self.offset < tail.end_offset
+        self._ready = asyncio.Event()
+        if self._resync:
+            self._ready.set()
+
+    def write(self, offset, data):
+        """Queue data, which starts at offset in the frame's output."""
+        if self._resync:
+            self._ready.set()
+            return
+        self.queue.append((offset, data))
+        self.queued_bytes += len(data)
+        if self.queued_bytes > self.max_bytes:
+            self.queue.clear()
+            self.queued_bytes = 0
+            self._resync = True
+        self._ready.set()
+
+    def close(self):
+        """End the stream once everything queued has been returned."""
+        self.closed = True
+        self._ready.set()
+
+    async def get(self):
+        """Return (offset, data) for the next block of output, or None at the end of the stream."""
+        while True:
+            if self._resync:
+                self._resync = False
+                offset, data = self.tail.read(self.offset)
+                # Data trimmed from the tail before the viewer got to it is lost
+                self.skipped += offset - self.offset
+                self.offset = offset + len(data)
+                if data:
+                    return offset, data
+
+            if self.queue:
+                offset = self.queue[0][0]
+                data = b"".join([chunk for chunk_offset, chunk in self.queue])
+                self.queue.clear()
+                self.queued_bytes = 0
+                self.offset = offset + len(data)
+                return offset, data
+
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+
+
+class CompressedFileSink(object):
+    """
+    Compress output into a log file from a dedicated writer thread.
+
+    write() only hands the data to the thread, so it never blocks the event loop.
+    The thread streams it through one compressor and writes the compressed output
+    in blocks of block_size bytes. Every sync_interval seconds, if anything new
+    has arrived, the compressor is flushed to a sync point and the output written,
+    so the log can be read back up to that point while the frame is still running
+    (zcat or zstdcat will complain about the missing end of the stream, but print
+    everything before it). close() finishes the stream; from the event loop, use
+    aclose(), as the last flush and write can take a while on a network filesystem.
+
+    codec is "gzip", or "zstd" when the zstandard module is installed.
+    """
+
+    logger = log.get_logger()
+
+    codecs = ("gzip", "zstd")
+    suffixes = {"gzip": ".gz", "zstd": ".zst"}
+
+    def __init__(self, path, codec="gzip", level=None, block_size=1048576, sync_interval=5.0):
+        """Constructor."""
+        if codec not in self.codecs:
+            raise ValueError("unknown compression codec: {}".format(codec))
+        if codec == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard module to be installed")
+
+        suffix = self.suffixes[codec]
+        self.path = path if path.endswith(suffix) else path + suffix
+        self.codec = codec
+        self.block_size = block_size
+        self.sync_interval = sync_interval
+
+        if codec == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=level or 3).compressobj()
+            self.sync_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            self.finish_mode = zstandard.COMPRESSOBJ_FLUSH_FINISH
+        else:
+            # wbits 31 selects the gzip container
+            self.compressor = zlib.compressobj(level or 6, zlib.DEFLATED, 31)
+            self.sync_mode = zlib.Z_SYNC_FLUSH
+            self.finish_mode = zlib.Z_FINISH
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.writes = 0
+        self.syncs = 0
+
+        self.fh = open(self.path, "ab", buffering=0)
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self.run, name="compressed-log", daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        """Hand data to the writer thread."""
+        self._queue.put(data)
+
+    def run(self):
+        output = bytearray()
+        dirty = False
+        last_sync = time.monotonic()
+
+        while True:
+            timeout = max(0.0, last_sync + self.sync_interval - time.monotonic())
+            try:
+                data = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                data = b""
+
+            if data is None:
+                break
+
+            if data:
+                self.bytes_in += len(data)
+                output += self.compressor.compress(data)
+                dirty = True
+
+            now = time.monotonic()
+            if dirty and now - last_sync >= self.sync_interval:
+                output += self.compressor.flush(self.sync_mode)
+                self.syncs += 1
+                dirty = False
+                self._write(output)
+            elif len(output) >= self.block_size:
+                self._write(output)
+            if now - last_sync >= self.sync_interval:
+                last_sync = now
+
+        output += self.compressor.flush(self.finish_mode)
+        self._write(output)
+        self.fh.close()
+
+    def _write(self, output):
+        if not output:
+            return
+        try:
+            self.fh.write(output)
+        except Exception:
+            self.logger.exception("failed to write compressed log", path=self.path)
+        self.bytes_out += len(output)
+        self.writes += 1
+        output.clear()
+
+    def close(self):
+        """Finish the compressed stream, write it out and close the file; blocks until done."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    async def aclose(self):
+        """Like close(), but wait for the writer thread on an executor, not the event loop."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "codec": self.codec,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "writes": self.writes,
+            "syncs": self.syncs,
+        }
+
+
+class QueuedSink(object):
+    """A sink behind a bounded queue drained by its own writer task."""
+
+    logger = log.get_logger()
+
+    policies = ("block", "drop_oldest", "drop")
+    marker = b"[asyncrqd: {} chunks of output dropped]\n"
+
+    def __init__(self, sink, maxsize=1024, policy="block", name=None, on_pause=None, on_resume=None):
+        """Constructor."""
+        if policy not in self.policies:
+            raise ValueError("unknown overflow policy: {}".format(policy))
+        self.sink = sink
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name or repr(sink)
+        self.on_pause = on_pause
+        self.on_resume = on_resume
+
+        # (enqueue time, data) pairs
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+        self.paused = False
+        self.dropped = 0
+        self.written = 0
+        self.written_bytes = 0
+        self._unreported_drops = 0
+        self._ready = None
+        self._task = None
+        self._closing = False
+
+    def put(self, data):
+        """Queue data for the writer without waiting, applying the overflow policy if full."""
+        if self._closing:
+            return
+        if self._task is None:
+            self._ready = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+        if len(self.queue) >= self.maxsize:
+            if self.policy == "drop":
+                self.dropped += 1
+                self._unreported_drops += 1
+                return
+            if self.policy == "drop_oldest":
+                enqueued, oldest = self.queue.popleft()
+                self.queued_bytes -= len(oldest)
+                self.dropped += 1
+                self._unreported_drops += 1
+            elif not self.paused:
+                self.paused = True
+                if self.on_pause is not None:
+                    self.on_pause(self)
+
+        self.queue.append((time.monotonic(), data))
+        self.queued_bytes += len(data)
+        self._ready.set()
+
+    @property
+    def lag(self):
+        """Seconds the oldest queued data has been waiting."""
+        if not self.queue:
+            return 0.0
+        return time.monotonic() - self.queue[0][0]
+
+    async def run(self):
+        """Write queued data to the sink until closed and drained."""
+        while True:
+            if not self.queue:
+                if self._closing:
+                    break
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            # Coalesce everything queued so far into one write
+            chunks = []
+            while self.queue:
+                enqueued, data = self.queue.popleft()
+                chunks.append(data)
+            self.queued_bytes = 0
+            if self._unreported_drops:
+                # The marker goes where the output went missing: drop_oldest lost
+                # chunks older than any still queued, drop lost ones newer than
+                # them, as nothing is queued once full until the queue is drained
+                marker = self.marker.replace(b"{}", str(self._unreported_drops).encode("ascii"))
+                if self.policy == "drop_oldest":
+                    chunks.insert(0, marker)
+                else:
+                    chunks.append(marker)
+                self._unreported_drops = 0
+            data = b"".join(chunks)
+
+            try:
+                result = self.sink.write(data)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                self.logger.exception("failed to write to sink", sink=self.name)
+            else:
+                self.written += 1
+                self.written_bytes += len(data)
+
+            if self.paused and len(self.queue) < self.maxsize:
+                self.paused = False
+                if self.on_resume is not None:
+                    self.on_resume(self)
+
+    async def close(self):
+        """Stop accepting data and wait for the queue to drain."""
+        self._closing = True
+        if self._task is None:
+            return
+        self._ready.set()
+        await self._task
+
+    def stats(self):
+        """Return the counters of this sink as a dict."""
+        return {
+            "name": self.name,
+            "policy": self.policy,
+            "queued": len(self.queue),
+            "queued_bytes": self.queued_bytes,
+            "lag": self.lag,
+            "paused": self.paused,
+            "dropped": self.dropped,
+            "written": self.written,
+            "written_bytes": self.written_bytes,
+        }
@@ -4,7 +4,9 @@ import asyncio
 import collections
 import time
 
+from . import config
 from . import log
+from .hoststats import HostStatsSampler
 
 class VmStatException(Exception):
     """VmStat Exception."""
@@ -13,9 +15,9 @@ class VmStatException(Exception):
 class Sample(object):
     """Sample data container."""
 
-    def __init__(self, pgout_number):
+    def __init__(self, pgout_number, epoch_time=None):
         """Constructor."""
-        self.epoch_time = time.time()
+        self.epoch_time = epoch_time or time.time()
         self.pgout_number = pgout_number
 
     def __repr__(self):
@@ -28,52 +30,68 @@ class Sample(object):
 
 
 class VmStat(object):
-    """Parse and return gpgout number from /proc/vmstat."""
+    """Track the pgpgout number from /proc/vmstat.
+
+    Given a shared HostStatsSampler, VmStat takes a sample from each of its
+    snapshots and needs no loop of its own; otherwise it owns a sampler and
+    start() samples every interval seconds.
+    """
 
     logger = log.get_logger()
-    prefix = "pgpgout "
 
-    def __init__(self, loop):
+    def __init__(self, loop, interval=None, sampler=None):
         """Constructor."""
         self.loop = loop
-        self.interval = 15
         self.sample_size = 10
-        self.sample_data = collections.deque(self.sample_size)
+        self.sample_data = collections.deque(maxlen=self.sample_size)
         self.min_viable_samples = 5
         self.stopping = False
+        # A sampler made here is closed by stop(); a shared one is its owner's
+        self._owns_sampler = sampler is None
+        if sampler is not None:
+            self.interval = sampler.interval
+        else:
+            vmstat = config.dot_notation().daemon.vmstat
+            self.interval = interval or (vmstat and vmstat.interval) or 15
+            sampler = HostStatsSampler(interval=self.interval)
+        self.sampler = sampler
+        self.sampler.subscribe(self.add_snapshot)
 
     def stop(self):
         self.stopping = True
+        self.sampler.unsubscribe(self.add_snapshot)
+        if self._owns_sampler:
+            self.sampler.close()
 
     async def start(self):
-        while True:
-            await self.run()
-
-            if self.stopping:
-                break
-
+        while not self.stopping:
+            self.run()
             await asyncio.sleep(self.interval)
 
     def get_pgpgout_number(self):
+        """Return the pgpgout number of the latest snapshot, sampling if there is none."""
         try:
-            prefix_len = len(self.prefix)
-            with open("/proc/vmstat") as vmStatFile:
-                for line in vmStatFile.readlines():
-                    if line[0:prefix_len] == self.prefix:
-                        return int(line[prefix_len:])
-        except Exception:
-            self.logger.warn("Failed to open /proc/vmstat file.")
-
-        return None
+            stats = self.sampler.latest or self.sampler.sample()
+        except OSError:
+            self.logger.warn("Failed to read /proc/vmstat file.")
+            return None
 
-    def run(self):
-        pgpgout_number = self.get_pgpgout_number()
+        return stats.pgpgout or None
 
-        if pgpgout_number is None:
+    def add_snapshot(self, stats):
+        """Take a sample from a HostStats snapshot."""
+        if not stats.pgpgout:
             self.logger.warn("Could not get pgpgout number.")
             return
 
-        self.sample_data.append(Sample(pgpgout_number))
+        self.sample_data.append(Sample(stats.pgpgout, stats.time))
+
+    def run(self):
+        """Sample the host; the snapshot reaches add_snapshot through the subscription."""
+        try:
+            self.sampler.sample()
+        except OSError:
+            self.logger.warn("Failed to read /proc/vmstat file.")
 
     def get_pgout_rate(self):
         """
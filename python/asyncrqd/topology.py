@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+"""
+The cpu topology and hardware inventory of the host, read once and cached.
+
+Every online logical cpu is mapped to its physical core, its package and its
+NUMA node. Physical cores are numbered in (node, package, core id) order, so
+neighbouring core numbers share a node, and sets of cpus and of cores are kept
+as int bitmaps: bit n set for cpu or core n.
+
+HardwareInventory holds what does not change while the host is up: the
+topology, memory and swap sizes, boot time, GPUs and so on. It is read at
+startup and only read again by HardwareInventory.refresh, which HotplugWatcher
+calls when the kernel reports a cpu or memory coming or going, so building a
+report never reads /proc or sysfs for these.
+"""
+
+import asyncio
+import collections
+import os
+import shutil
+import socket
+import subprocess
+import time
+
+from . import config
+from . import log
+from .proto import report_pb2
+
+
+def parse_cpu_list(cpu_list):
+    """Return the set of cpus in a taskset style list such as "0-3,8,10-11"."""
+    cpus = set()
+    for part in cpu_list.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, separator, last = part.partition("-")
+        if separator:
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(first))
+    return cpus
+
+
+def format_cpu_list(cpus):
+    """Return a taskset style list such as "0-3,8" for an iterable of cpus."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(first) if first == last else "{}-{}".format(first, last) for first, last in ranges
+    )
+
+
+def bits(bitmap):
+    """Return the list of the set bit numbers of bitmap, lowest first."""
+    result = []
+    while bitmap:
+        low = bitmap & -bitmap
+        result.append(low.bit_length() - 1)
+        bitmap ^= low
+    return result
+
+
+def popcount(bitmap):
+    return bin(bitmap).count("1")
+
+
+Cpu = collections.namedtuple("Cpu", ("cpu", "core", "package", "node"))
+
+
+class CpuTopology(object):
+    """The logical cpus, physical cores and NUMA nodes of the host."""
+
+    logger = log.get_logger()
+
+    default_root = "/sys/devices/system"
+
+    def __init__(self, cpus):
+        """Constructor; cpus is a list of Cpu tuples, core being the core id within its package."""
+        self.cpus = sorted(cpus)
+
+        keys = sorted({(cpu.node, cpu.package, cpu.core) for cpu in self.cpus})
+        index = {key: number for number, key in enumerate(keys)}
+
+        # Cpu bitmap of every physical core, and the core of every cpu
+        self.core_cpus = [0] * len(keys)
+        self.cpu_core = {}
+        # Core bitmap of every node
+        self.node_cores = collections.defaultdict(int)
+        for cpu in self.cpus:
+            number = index[(cpu.node, cpu.package, cpu.core)]
+            self.core_cpus[number] |= 1 << cpu.cpu
+            self.cpu_core[cpu.cpu] = number
+            self.node_cores[cpu.node] |= 1 << number
+        self.node_cores = dict(self.node_cores)
+
+        self.all_cores = (1 << len(keys)) - 1
+        self.all_cpus = 0
+        for cpu in self.cpus:
+            self.all_cpus |= 1 << cpu.cpu
+
+    @property
+    def num_cpus(self):
+        return len(self.cpus)
+
+    @property
+    def num_cores(self):
+        return len(self.core_cpus)
+
+    @property
+    def num_packages(self):
+        return len({cpu.package for cpu in self.cpus})
+
+    @property
+    def threads_per_core(self):
+        return max(1, self.num_cpus // max(1, self.num_cores))
+
+    def cores_of_cpus(self, cpus):
+        """Return the bitmap of the cores holding any of the cpus in a cpu bitmap."""
+        cores = 0
+        for cpu in bits(cpus):
+            core = self.cpu_core.get(cpu)
+            if core is not None:
+                cores |= 1 << core
+        return cores
+
+    def cpus_of_cores(self, cores):
+        """Return the cpu bitmap of a core bitmap."""
+        cpus = 0
+        for core in bits(cores):
+            cpus |= self.core_cpus[core]
+        return cpus
+
+    @staticmethod
+    def read_file(path):
+        """Return the stripped contents of path, or None if it cannot be read."""
+        try:
+            with open(path) as fh:
+                return fh.read().strip()
+        except OSError:
+            return None
+
+    @classmethod
+    def read(cls, root=None):
+        """Read the topology from sysfs under root, /sys/devices/system by default."""
+        linux = config.dot_notation().machine.linux
+        root = root or (linux and linux.sysfs_root) or cls.default_root
+        cpu_root = os.path.join(root, "cpu")
+
+        online = cls.read_file(os.path.join(cpu_root, "online"))
+        if online:
+            cpu_numbers = parse_cpu_list(online)
+        else:
+            cpu_numbers = set(range(os.cpu_count() or 1))
+
+        # The node of every cpu, from the node cpulists; 0 without NUMA
+        cpu_node = {}
+        node_root = os.path.join(root, "node")
+        try:
+            node_names = os.listdir(node_root)
+        except OSError:
+            node_names = []
+        for name in node_names:
+            if not name.startswith("node") or not name[4:].isdigit():
+                continue
+            cpulist = cls.read_file(os.path.join(node_root, name, "cpulist"))
+            for cpu in parse_cpu_list(cpulist or ""):
+                cpu_node[cpu] = int(name[4:])
+
+        cpus = []
+        for number in sorted(cpu_numbers):
+            topology = os.path.join(cpu_root, "cpu{}".format(number), "topology")
+            core = cls.read_file(os.path.join(topology, "core_id"))
+            package = cls.read_file(os.path.join(topology, "physical_package_id"))
+            cpus.append(
+                Cpu(
+                    number,
+                    int(core) if core is not None else number,
+                    max(0, int(package)) if package is not None else 0,
+                    cpu_node.get(number, 0),
+                )
+            )
+        return cls(cpus)
+
+    def to_dict(self):
+        return {
+            "cpus": self.num_cpus,
+            "cores": self.num_cores,
+            "packages": self.num_packages,
+            "nodes": {node: format_cpu_list(bits(self.cpus_of_cores(cores))) for node, cores in self.node_cores.items()},
+        }
+
+
+class HardwareInventory(collections.namedtuple(
+    "HardwareInventory",
+    (
+        "hostname",
+        "cpu_model",
+        "num_procs",
+        "cores_per_proc",
+        "threads_per_core",
+        "num_cpus",
+        "total_mem",
+        "total_swap",
+        "boot_time",
+        "timezone",
+        "gpu_count",
+        "gpu_memory",
+        "topology",
+    ),
+)):
+    """
+    The hardware of the host. Memory sizes are in kB and boot_time is in seconds
+    since the epoch.
+
+    get() returns the cached inventory, reading it the first time; refresh()
+    reads it again.
+    """
+
+    __slots__ = ()
+
+    logger = log.get_logger()
+
+    _cached = None
+
+    @classmethod
+    def get(cls):
+        if cls._cached is None:
+            cls.refresh()
+        return cls._cached
+
+    @classmethod
+    def refresh(cls):
+        """Read the inventory again, cache it and return it."""
+        cls._cached = cls.read()
+        return cls._cached
+
+    @staticmethod
+    def read_key_values(path, separator=":"):
+        """Return a dict of the "key: value" lines of path, or an empty dict if it cannot be read."""
+        result = {}
+        try:
+            with open(path) as fh:
+                for line in fh:
+                    key, found, value = line.partition(separator)
+                    if found:
+                        result.setdefault(key.strip(), value.strip())
+        except OSError:
+            pass
+        return result
+
+    @classmethod
+    def read_gpus(cls, proc_root):
+        """Return (gpu count, total gpu memory in kB), or (0, 0) without NVIDIA GPUs."""
+        try:
+            gpu_count = len(os.listdir(os.path.join(proc_root, "driver", "nvidia", "gpus")))
+        except OSError:
+            return 0, 0
+
+        nvidia_smi = shutil.which("nvidia-smi")
+        if nvidia_smi is None:
+            return gpu_count, 0
+        try:
+            output = subprocess.run(
+                [nvidia_smi, "--query-gpu=memory.total", "--format=csv,noheader,nounits"],
+                capture_output=True, text=True, timeout=10, check=True,
+            ).stdout
+            return gpu_count, sum(int(line) for line in output.split()) * 1024
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            cls.logger.warning("cannot read gpu memory", error=str(e))
+            return gpu_count, 0
+
+    @classmethod
+    def read(cls, proc_root=None, sysfs_root=None):
+        """Read the inventory from /proc, sysfs and the GPU driver."""
+        linux = config.dot_notation().machine.linux
+        proc_root = proc_root or (linux and linux.proc_root) or "/proc"
+        topology = CpuTopology.read(sysfs_root)
+
+        cpuinfo = cls.read_key_values(os.path.join(proc_root, "cpuinfo"))
+        meminfo = cls.read_key_values(os.path.join(proc_root, "meminfo"))
+        stat = cls.read_key_values(os.path.join(proc_root, "stat"), " ")
+        gpu_count, gpu_memory = cls.read_gpus(proc_root)
+
+        num_procs = max(1, topology.num_packages)
+        return cls(
+            hostname=socket.gethostname(),
+            cpu_model=cpuinfo.get("model name", ""),
+            num_procs=num_procs,
+            cores_per_proc=max(1, topology.num_cores // num_procs),
+            threads_per_core=topology.threads_per_core,
+            num_cpus=topology.num_cpus,
+            total_mem=int(meminfo.get("MemTotal", "0 kB").split()[0]),
+            total_swap=int(meminfo.get("SwapTotal", "0 kB").split()[0]),
+            boot_time=int(stat.get("btime", 0)),
+            timezone=time.tzname[0],
+            gpu_count=gpu_count,
+            gpu_memory=gpu_memory,
+            topology=topology,
+        )
+
+    def render_host(self):
+        """Return a report_pb2.RenderHost with the static fields filled in."""
+        return report_pb2.RenderHost(
+            name=self.hostname,
+            num_procs=self.num_procs,
+            cores_per_proc=self.cores_per_proc,
+            total_mem=self.total_mem,
+            total_swap=self.total_swap,
+            boot_time=self.boot_time,
+            attributes={
+                "cpu_model": self.cpu_model,
+                "hyperthreading_multiplier": str(self.threads_per_core),
+                "gpu_count": str(self.gpu_count),
+                "gpu_memory": str(self.gpu_memory),
+            },
+        )
+
+
+class HotplugWatcher(object):
+    """
+    Refresh the HardwareInventory when a cpu or memory block is hotplugged.
+
+    The kernel's uevents are read from a netlink socket, so nothing is polled.
+    Events come in bursts when many cpus change at once, so the refresh runs
+    delay seconds after the first one, in the default executor so that the
+    event loop is not held while it reads sysfs and runs nvidia-smi. on_change
+    is called on the event loop with the new inventory.
+    """
+
+    logger = log.get_logger()
+
+    NETLINK_KOBJECT_UEVENT = 15
+    devpaths = (b"/devices/system/cpu/", b"/devices/system/memory/", b"/devices/system/node/")
+
+    def __init__(self, on_change=None, delay=1.0):
+        """Constructor."""
+        self.on_change = on_change
+        self.delay = delay
+        self.sock = None
+        self._loop = None
+        self._handle = None
+        self._refreshing = None
+
+    def start(self, loop=None):
+        """Start watching; return False if the uevent socket cannot be opened."""
+        self._loop = loop or asyncio.get_running_loop()
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, self.NETLINK_KOBJECT_UEVENT)
+            # Group 1 carries the kernel's own events
+            self.sock.bind((0, 1))
+        except (AttributeError, OSError) as e:
+            self.logger.warning("cannot watch for hotplug events", error=str(e))
+            self.sock = None
+            return False
+        self.sock.setblocking(False)
+        self._loop.add_reader(self.sock, self._on_readable)
+        return True
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if self.is_hotplug(data) and self._handle is None:
+                self._handle = self._loop.call_later(self.delay, self._refresh)
+
+    @classmethod
+    def is_hotplug(cls, data):
+        """Return True if data, a kernel uevent, is about a cpu, memory block or node."""
+        # "online@/devices/system/cpu/cpu3\0ACTION=online\0DEVPATH=...\0..."
+        header = data.split(b"\0", 1)[0]
+        action, separator, devpath = header.partition(b"@")
+        return action in (b"add", b"remove", b"online", b"offline") and devpath.startswith(cls.devpaths)
+
+    def _refresh(self):
+        self._handle = None
+        # Reading the inventory runs nvidia-smi, which can take seconds
+        self._refreshing = self._loop.run_in_executor(None, HardwareInventory.refresh)
+        self._refreshing.add_done_callback(self._refreshed)
+
+    def _refreshed(self, future):
+        if future is self._refreshing:
+            self._refreshing = None
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.logger.error("cannot refresh the hardware inventory", error=str(future.exception()))
+            return
+
+        inventory = future.result()
+        self.logger.info(
+            "hardware changed", num_cpus=inventory.num_cpus, total_mem=inventory.total_mem
+        )
+        if self.on_change is not None:
+            try:
+                self.on_change(inventory)
+            except Exception:
+                self.logger.exception("hotplug callback failed")
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._refreshing is not None:
+            self._refreshing.cancel()
+            self._refreshing = None
+        if self.sock is not None:
+            self._loop.remove_reader(self.sock)
+            self.sock.close()
+            self.sock = None